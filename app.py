@@ -1,17 +1,27 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Query
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import Response, StreamingResponse, FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, field_validator, ValidationInfo
-import pandas as pd
-import numpy as np
+from pydantic import BaseModel, Field, field_validator, model_validator
 import os
-import io
 import logging
+import threading
 from typing import Optional, List
 from dotenv import load_dotenv
 from factory.data_access_factory import DataAccessFactory
+from data_access.storage_executor import StorageExecutor, create_storage_executor, iterate_in_executor
+from data_access.data_access import ConflictError
+from data_access.write_behind_data_access import WriteBehindDataAccess
+from customer_id.change_feed import ChangeNotifier
 from customer_id.customer_id_generator import CustomerIDGenerator
+from customer_id.sql_customer_id_generator import SQLCustomerIDGenerator
+from customer_id.excel_import import import_excel_file
+from customer_id.rules import IDRules, BRANCH_NAME_REQUIRED
+from customer_id.audit import audit_customer_ids, DEFAULT_AUDIT_EXAMPLES, MAX_AUDIT_EXAMPLES
+from customer_id.query import DEFAULT_QUERY_LIMIT, MAX_QUERY_LIMIT, dumps, page_records
+from customer_id.search_index import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from customer_id.export import EXPORT_FORMATS, ExportCache, export_stream, filter_export_data
+from monitoring.metrics import metrics, MetricsMiddleware
 
 load_dotenv()
 
@@ -25,17 +35,153 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 各端點與各階段的耗時，METRICS_ENABLED=0 停用；設定 SLOW_REQUEST_MS 時記錄超過門檻的請求與其各階段耗時
+app.add_middleware(MetricsMiddleware, slow_request_ms=float(os.getenv('SLOW_REQUEST_MS')) if os.getenv('SLOW_REQUEST_MS') else None)
+
 logging.basicConfig(level=logging.INFO)
 
-# 使用工廠模式來創建 DataAccess 實例
-data_access = DataAccessFactory.get_data_access(
-    'dropbox',
-    access_token=os.getenv('DROPBOX_ACCESS_TOKEN'),
-    directory=os.getenv('DROPBOX_DIRECTORY'),
-    file_name='customer_ids.xlsx'
-)
-# 初始化 CustomerIDGenerator
-generator = CustomerIDGenerator(data_access)
+@app.exception_handler(ConflictError)
+def conflict_error_handler(request, exc):
+    # 重試後仍與其他程序的寫入衝突
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+# 代碼表與編碼規則只在 customer_id.rules 定義一次，generator、欄位驗證與稽核共用
+RULES = IDRules.from_env()
+REGIONS = RULES.regions
+CATEGORIES = RULES.categories
+EXTRA_REGION_CODES = RULES.extra_region_code_names
+
+# 使用工廠模式來創建 DataAccess 實例，後端由 STORAGE_TYPE 決定 (dropbox / s3 / db / local)
+STORAGE_TYPE = os.getenv('STORAGE_TYPE', 'dropbox')
+
+def storage_options(storage_type):
+    # 遠端快照格式 (xlsx / parquet / arrow) 與本機快取目錄，Vercel 上只有 /tmp 可寫
+    snapshot_options = {'snapshot_format': os.getenv('SNAPSHOT_FORMAT', 'xlsx'), 'cache_dir': os.getenv('SNAPSHOT_CACHE_DIR')}
+    if storage_type == 'db':
+        return {
+            'db_url': os.getenv('DATABASE_URL'),
+            'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        }
+    if storage_type == 's3':
+        return {
+            'bucket_name': os.getenv('S3_BUCKET_NAME'),
+            'directory': os.getenv('S3_DIRECTORY'),
+            'file_name': 'customer_ids.xlsx',
+            'region': os.getenv('AWS_REGION'),
+            'access_key': os.getenv('AWS_ACCESS_KEY_ID'),
+            'secret_key': os.getenv('AWS_SECRET_ACCESS_KEY'),
+            'max_pool_connections': int(os.getenv('S3_MAX_POOL_CONNECTIONS', '16')),
+            **snapshot_options,
+        }
+    if storage_type == 'local':
+        # 本機目錄，供開發與效能測試使用
+        return {'directory': os.getenv('LOCAL_DIRECTORY', 'data'), 'file_name': 'customer_ids.xlsx', **snapshot_options}
+    return {
+        'access_token': os.getenv('DROPBOX_ACCESS_TOKEN'),
+        'directory': os.getenv('DROPBOX_DIRECTORY'),
+        'file_name': 'customer_ids.xlsx',
+        **snapshot_options,
+    }
+
+# 設定 SHARD_BY=region (或 region_category) 時每個地區 (與類別) 各存一份檔案，平行載入且異動只上傳所在的分片；不適用於 db
+SHARD_BY = os.getenv('SHARD_BY')
+
+def create_data_access():
+    if SHARD_BY and STORAGE_TYPE != 'db':
+        data_access = DataAccessFactory.get_sharded_data_access(
+            STORAGE_TYPE, SHARD_BY, REGIONS, CATEGORIES, max_workers=int(os.getenv('SHARD_WORKERS', '8')), **storage_options(STORAGE_TYPE))
+    else:
+        data_access = DataAccessFactory.get_data_access(STORAGE_TYPE, **storage_options(STORAGE_TYPE))
+    # 設定 WRITE_BEHIND_DIR 時先寫入本機 journal 就回應，背景再批次寫到遠端 (需要常駐程序，不適用 serverless)
+    if os.getenv('WRITE_BEHIND_DIR'):
+        data_access = WriteBehindDataAccess(
+            data_access,
+            os.getenv('WRITE_BEHIND_DIR'),
+            flush_interval=float(os.getenv('WRITE_BEHIND_INTERVAL', '2')),
+            max_batch=int(os.getenv('WRITE_BEHIND_BATCH', '100'))
+        )
+    return data_access
+
+# generator 與只讀單一地區分片的匯出共用同一個 DataAccess
+data_access = None
+data_access_lock = threading.Lock()
+
+def get_data_access():
+    global data_access
+    if data_access is None:
+        with data_access_lock:
+            if data_access is None:
+                data_access = create_data_access()
+    return data_access
+
+def create_notifier():
+    # 同一台主機上的多個 worker 共用的通知檔，例如 /dev/shm/customer_ids.seq；未設定時每次 refresh 都詢問遠端版本
+    path = os.getenv('CHANGE_NOTIFY_PATH')
+    if not path:
+        return None
+    return ChangeNotifier(path, max_age=float(os.getenv('CHANGE_NOTIFY_MAX_AGE', '30')))
+
+# 所有讀寫遠端的流程 (載入、refresh、寫入、匯入) 都在這個有上限的執行緒池執行，
+# 不阻塞事件迴圈，也不佔用 Starlette 處理同步端點 (搜尋) 的執行緒池
+storage = StorageExecutor(create_storage_executor(int(os.getenv('STORAGE_WORKERS', '8'))))
+
+def create_generator():
+    data_access = get_data_access()
+    # 資料庫直接下 SQL 配發與查詢 (延遲寫入時資料尚未進資料庫，仍用記憶體索引)
+    if STORAGE_TYPE == 'db' and not isinstance(data_access, WriteBehindDataAccess):
+        return SQLCustomerIDGenerator(data_access, create_notifier(), RULES, storage)
+    return CustomerIDGenerator(data_access, create_notifier(), RULES, storage)
+
+# CustomerIDGenerator 建立時要下載並解析整份資料，延後到第一次使用 (或背景預先建立)，
+# 不需要資料的 /regions、/categories 與靜態檔案在冷啟動時可以立即回應
+generator = None
+generator_lock = threading.Lock()
+
+def get_generator():
+    global generator
+    if generator is None:
+        with generator_lock:
+            if generator is None:
+                generator = create_generator()
+    return generator
+
+async def get_generator_async():
+    if generator is not None:
+        return generator
+    # 第一次建立要下載整份資料，在儲存執行緒池等待
+    return await storage.run(get_generator)
+
+def current_generator():
+    # 搜尋使用：其他 worker 寫入過時在背景套用新的 delta，這次先用目前的資料回應，延遲不受遠端影響
+    current = get_generator()
+    if current.notifier is not None:
+        current.refresh_in_background()
+    return current
+
+async def current_generator_async():
+    # 讀取前確認其他 worker 是否寫入過；有通知檔時只需 stat，有異動也只套用新的 delta
+    current = await get_generator_async()
+    if current.notifier is not None:
+        await current.refresh_data_async()
+    return current
+
+def warm_up_generator():
+    try:
+        get_generator()
+    except Exception as e:
+        # 第一次使用時會再重試
+        logging.error(f"Error initializing CustomerIDGenerator in background: {e}")
+
+if os.getenv('GENERATOR_WARMUP', '1') != '0':
+    threading.Thread(target=warm_up_generator, name='generator-warmup', daemon=True).start()
+
+export_cache = ExportCache(os.getenv('EXPORT_CACHE_DIR'))
+
+# 匯入進度，以呼叫端提供的 import_id 查詢
+import_progress = {}
+MAX_TRACKED_IMPORTS = 100
 
 class CustomerRequest(BaseModel):
     region: str = Field(...)
@@ -47,152 +193,265 @@ class CustomerRequest(BaseModel):
 
     @field_validator('region')
     def region_must_be_valid(cls, v):
-        valid_regions = ["1北投", "2台南", "3高雄"]
-        if v not in valid_regions:
+        if v not in RULES.region_codes:
             raise ValueError('無效的地區')
         return v
 
     @field_validator('category')
     def category_must_be_valid(cls, v):
-        valid_categories = ["0連鎖或相關企業的合開發票", "1連鎖或相關企業的不合開發票", "2單一客戶", "6機動", "7未定", f"8{os.getenv('DACHING_RELATIONSHIP')}", "9其他"]
-        if v not in valid_categories:
+        if v not in RULES.category_codes:
             raise ValueError('無效的類別')
         return v
 
     @field_validator('extra_region_code', mode='before')
     def extra_region_code_must_be_valid(cls, v):
-        valid_extra_region_codes = ["0無區分", "1本縣市", "2本縣市", "3本縣市", "4本縣市", "5外縣市", "6外縣市", "7外縣市", "8外縣市", "9外縣市"]
-        if v not in valid_extra_region_codes:
+        if v not in RULES.extra_region_codes:
             raise ValueError('無效的額外地區代碼')
         return v
 
     @field_validator('branch_name', mode='before')
-    def branch_name_must_be_valid(cls, v, info: ValidationInfo):
-        values = info.data
-        category = values.get('category')
-        branch_handling = values.get('branch_handling')
-        
-        if category == "0連鎖或相關企業的合開發票" and branch_handling == "以流水號編列此分行" and not v:
-            raise ValueError('對於所選類別和分支處理，分支名稱是必需的。')
+    def branch_name_default(cls, v):
         return v if v is not None else ""
 
+    @model_validator(mode='after')
+    def branch_name_must_be_valid(self):
+        # branch_handling 在 branch_name 之後才驗證，所以在整個模型驗證完後檢查；Excel 匯入使用同一條規則
+        if RULES.missing_branch_name(self.category, self.branch_handling, self.branch_name):
+            raise ValueError(BRANCH_NAME_REQUIRED)
+        return self
+
+class BatchCustomerRequest(BaseModel):
+    records: List[CustomerRequest]
+
 class UpdateCustomerRequest(BaseModel):
     customer_id: str = Field(...)
     new_company_name: Optional[str] = None
     new_branch_name: Optional[str] = None
 
+class BatchUpdateCustomerRequest(BaseModel):
+    updates: List[UpdateCustomerRequest]
+
+class DeleteCustomerIdsRequest(BaseModel):
+    customer_ids: List[str]
+
 class QueryCustomerRequest(BaseModel):
     company_name: str
     branch_handling: str = None
+    region: Optional[str] = None
+    category: Optional[str] = None
+    extra_region_code: Optional[str] = None
+    fields: Optional[List[str]] = None  # 只回傳這些欄位，預設全部
+    sort_by: str = 'CustomerID'
+    descending: bool = False
+    limit: int = Field(DEFAULT_QUERY_LIMIT, ge=1, le=MAX_QUERY_LIMIT)
+    cursor: Optional[str] = None  # 上一頁回應的 next_cursor
 
 class SearchResponse(BaseModel):
     company_names: List[str]
 
 @app.post("/update_customer_info")
-def update_customer_info(request: UpdateCustomerRequest):
+async def update_customer_info(request: UpdateCustomerRequest):
+    current = await get_generator_async()
     try:
-        generator.update_customer_info(request.customer_id, request.new_company_name, request.new_branch_name)
+        await current.update_customer_info_async(request.customer_id, request.new_company_name, request.new_branch_name)
         return {"detail": "客戶信息更新成功"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+@app.post("/update_customer_info_batch")
+async def update_customer_info_batch(request: BatchUpdateCustomerRequest):
+    # 一次寫入所有異動，逐筆回報結果；不存在的客戶ID不影響其他筆
+    current = await get_generator_async()
+    results = await current.update_customer_info_batch_async([update.model_dump() for update in request.updates])
+    await current.refresh_data_async()  # 刷新內存中的數據
+    return {"detail": f"已更新 {sum(result['status'] == 'updated' for result in results)} 筆", "results": results}
+
 @app.post("/import_excel")
-async def import_excel(file: UploadFile = File(...)):
-    content = await file.read()
-    df = pd.read_excel(io.BytesIO(content), engine='openpyxl')
-    df['CustomerID'] = df['CustomerID'].fillna('').astype(str)
-    generator.data = pd.concat([generator.data, df], ignore_index=True).drop_duplicates(subset=['CustomerID'])
-    generator.save()
-    generator.refresh_data()  # 刷新內存中的數據
-    return {"detail": "Excel file imported successfully"}
+async def import_excel(file: UploadFile = File(...), import_id: Optional[str] = None):
+    progress = None
+    if import_id:
+        if len(import_progress) >= MAX_TRACKED_IMPORTS:
+            import_progress.pop(next(iter(import_progress)))
+        progress = import_progress[import_id] = {"rows_processed": 0, "error_count": 0, "imported": 0, "done": False}
+    # 上傳檔已由 Starlette 暫存在磁碟，直接交給 openpyxl 逐塊讀取；
+    # 解析與逐塊寫入都在儲存執行緒池執行，不阻塞事件迴圈，也不佔用搜尋使用的執行緒池
+    current = await get_generator_async()
+    report = await current.storage.run(
+        import_excel_file, current, file.file, RULES, progress)
+    await current.refresh_data_async()  # 刷新內存中的數據
+    return {"detail": "Excel file imported successfully", **report}
+
+@app.get("/import_excel/progress/{import_id}")
+def import_excel_progress(import_id: str):
+    if import_id not in import_progress:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return import_progress[import_id]
 
 @app.get("/export_excel")
-def export_excel():
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        generator.data.to_excel(writer, index=False)
-    output.seek(0)
-    headers = {
-        'Content-Disposition': 'attachment; filename="customer_ids.xlsx"',
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    }
-    return StreamingResponse(output, headers=headers)
+async def export_excel(format: str = 'xlsx', region: str = None, category: str = None, extra_region_code: str = None):
+    """
+    匯出客戶ID。csv、ndjson 邊序列化邊送出，第一個位元組很快就到；
+    xlsx 是 zip 格式，必須先寫完整個暫存檔才開始送出，資料量大時請改用 format=csv。
+    回應標頭 X-Export-Streaming 標示 chunked (逐段串流) 或 buffered (整份寫完才送出)。
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+    media_type, file_name = EXPORT_FORMATS[format]
+    source = get_data_access() if generator is None and region else None
+    if hasattr(source, 'load_region'):
+        # 分片儲存且資料尚未載入時，只下載這個地區的分片，不必等整份資料載入
+        data, revision = await storage.run(source.load_region, region, category)
+    else:
+        current = await current_generator_async()
+        data, revision = await storage.run(lambda: (current.data, current.revision))
+    data = await storage.run(filter_export_data, data, region, category, extra_region_code)
+    # 版本未知時不快取，避免送出過期的檔案
+    cache_key = (revision, format, region, category, extra_region_code) if revision is not None else None
+    headers = {'Content-Disposition': f'attachment; filename="{file_name}"',
+               'X-Export-Streaming': 'buffered' if format == 'xlsx' else 'chunked'}
+    # 產生 xlsx 暫存檔與逐段序列化都在儲存執行緒池進行，不佔用事件迴圈
+    stream = await storage.run(export_stream, data, format, export_cache, cache_key)
+    return StreamingResponse(iterate_in_executor(storage.executor, stream), media_type=media_type, headers=headers)
 
 @app.delete("/delete_customer_id/{customer_id}")
-def delete_customer_id(customer_id: str):
-    if customer_id in generator.data['CustomerID'].values:
-        generator.data = generator.data[generator.data['CustomerID'] != customer_id]
-        generator.save()
-        generator.refresh_data()  # 刷新內存中的數據
-        logging.info(f"Deleted Customer ID: {customer_id}")
-        return {"detail": "Customer ID deleted successfully"}
-    else:
+async def delete_customer_id(customer_id: str):
+    current = await get_generator_async()
+    try:
+        await current.delete_customer_id_async(customer_id)
+    except ValueError:
         raise HTTPException(status_code=404, detail="Customer ID not found")
+    await current.refresh_data_async()  # 刷新內存中的數據
+    return {"detail": "Customer ID deleted successfully"}
+
+@app.post("/delete_customer_ids")
+async def delete_customer_ids(request: DeleteCustomerIdsRequest):
+    current = await get_generator_async()
+    results = await current.delete_customer_ids_async(request.customer_ids)
+    await current.refresh_data_async()  # 刷新內存中的數據
+    return {"detail": f"已刪除 {sum(result['status'] == 'deleted' for result in results)} 筆", "results": results}
 
 @app.post("/preview_customer_id")
-def preview_customer_id(request: CustomerRequest):
-    customer_id = generator.preview_customer_id(
-        request.region, request.category, request.company_name, request.extra_region_code, request.branch_name, request.branch_handling)
+async def preview_customer_id(request: CustomerRequest):
+    current = await current_generator_async()
+    # 預覽要等待寫入中的鎖 (SQL 版本還要查詢資料庫)，同樣在儲存執行緒池執行
+    customer_id = await current.storage.run(
+        current.preview_customer_id, request.region, request.category, request.company_name, request.extra_region_code, request.branch_name, request.branch_handling)
     return {"customer_id": customer_id}
 
 @app.post("/generate_customer_id")
-def generate_customer_id(request: CustomerRequest, confirm: bool = False):
+async def generate_customer_id(request: CustomerRequest, confirm: bool = False):
     if confirm:
-        customer_id = generator.generate_customer_id(
+        current = await get_generator_async()
+        customer_id = await current.generate_customer_id_async(
             request.region, request.category, request.company_name, request.extra_region_code, request.branch_name, request.branch_handling)
-        generator.refresh_data()  # 刷新內存中的數據
+        await current.refresh_data_async()  # 刷新內存中的數據
         return {"customer_id": customer_id, "status": "生成"}
     else:
-        customer_id = generator.preview_customer_id(
-            request.region, request.category, request.company_name, request.extra_region_code, request.branch_name, request.branch_handling)
+        current = await current_generator_async()
+        customer_id = await current.storage.run(
+            current.preview_customer_id, request.region, request.category, request.company_name, request.extra_region_code, request.branch_name, request.branch_handling)
         return {"customer_id": customer_id, "status": "預覽"}
 
+@app.post("/generate_customer_ids_batch")
+async def generate_customer_ids_batch(request: BatchCustomerRequest, confirm: bool = False):
+    records = [record.model_dump() for record in request.records]
+    current = await get_generator_async()
+    customer_ids = await current.generate_customer_ids_async(records, preview=not confirm)
+    if confirm:
+        await current.refresh_data_async()  # 刷新內存中的數據
+        return {"customer_ids": customer_ids, "status": "生成"}
+    return {"customer_ids": customer_ids, "status": "預覽"}
+
 @app.post("/query_customer_id")
-def query_customer_id(request: QueryCustomerRequest):
-    generator.refresh_data()  # 刷新內存中的數據
-    result = generator.query_customer_id(request.company_name, request.branch_handling)
-    if result.empty:
-        return {"detail": "查無此客戶ID", "data": []}
-    result = result.replace({np.inf: np.nan, -np.inf: np.nan}).fillna('')
-    return {"detail": "查詢成功", "data": result.to_dict(orient='records')}
+async def query_customer_id(request: QueryCustomerRequest):
+    current = await get_generator_async()
+    await current.refresh_data_async()  # 刷新內存中的數據
+    try:
+        page, next_cursor, total = await current.storage.run(
+            current.query_customer_id, request.company_name, request.branch_handling, request.region, request.category, request.extra_region_code,
+            fields=request.fields, sort_by=request.sort_by, descending=request.descending, limit=request.limit, cursor=request.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 只序列化這一頁，回應時間取決於 limit 而不是符合的筆數
+    detail = "查詢成功" if total else "查無此客戶ID"
+    content = dumps({"detail": detail, "data": page_records(page), "total": total, "next_cursor": next_cursor})
+    return Response(content=content, media_type='application/json')
 
 @app.get("/search_company_name/")
-def search_company_name(keyword: str = Query(..., min_length=1), region: str = None, category: str = None):
-    company_names = generator.search_company_name(keyword, region, category)
+def search_company_name(keyword: str = Query(..., min_length=1), region: str = None, category: str = None, extra_region_code: str = None,
+                        limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT), offset: int = Query(0, ge=0)):
+    company_names = current_generator().search_company_name(keyword, region, category, extra_region_code, limit=limit, offset=offset)
     return {"company_names": company_names}
 
 @app.get("/search_all_company_names/", response_model=SearchResponse)
-def search_all_company_names(keyword: str = Query(..., min_length=1)):
-    company_names = generator.search_company_name(keyword)
-    return {"company_names": company_names.tolist()}
+def search_all_company_names(keyword: str = Query(..., min_length=1),
+                             limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT), offset: int = Query(0, ge=0)):
+    company_names = current_generator().search_company_name(keyword, limit=limit, offset=offset)
+    return {"company_names": company_names}
 
 @app.get("/search_all_branch_names/")
-def search_all_branch_names(keyword: str = Query(..., min_length=1)):
-    branch_names = generator.search_branch_name(keyword)
+def search_all_branch_names(keyword: str = Query(..., min_length=1),
+                            limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT), offset: int = Query(0, ge=0)):
+    branch_names = current_generator().search_branch_name(keyword, limit=limit, offset=offset)
     return {"branch_names": branch_names}
 
 @app.get("/search_all_customer_ids/")
-def search_all_customer_ids(keyword: str = Query(..., min_length=1)):
-    filtered_data = generator.data[generator.data['CustomerID'].str.contains(keyword, case=False, na=False)]
-    customer_ids = filtered_data['CustomerID'].unique().tolist()
+def search_all_customer_ids(keyword: str = Query(..., min_length=1),
+                            limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT), offset: int = Query(0, ge=0)):
+    # 客戶ID依開頭比對
+    customer_ids = current_generator().search_customer_id(keyword, limit=limit, offset=offset)
     return {"customer_ids": customer_ids}
 
 @app.get("/search_branch_name/")
-def search_branch_name(keyword: str = Query(..., min_length=1), region: str = None, category: str = None, company_name: str = None, extra_region_code: str = None):
-    branch_names = generator.search_branch_name(keyword, region, category, company_name, extra_region_code)
+def search_branch_name(keyword: str = Query(..., min_length=1), region: str = None, category: str = None, company_name: str = None, extra_region_code: str = None,
+                       limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT), offset: int = Query(0, ge=0)):
+    branch_names = current_generator().search_branch_name(keyword, region, category, company_name, extra_region_code, limit=limit, offset=offset)
     return {"branch_names": branch_names}
 
+@app.get("/changes")
+async def get_changes(since: Optional[str] = None):
+    # 回傳 since 版本之後的異動，下次以回應的 revision 接續；reset 為 true 時呼叫端須重新查詢，再從 revision 接續
+    current = await get_generator_async()
+    entries = await current.changes_since_async(since)
+    if entries is None:
+        return {"reset": True, "revision": None if current.revision is None else str(current.revision), "changes": []}
+    changes = [{"revision": str(revision), **delta} for revision, delta in entries if delta is not None]
+    return {"reset": False, "revision": str(entries[-1][0]) if entries else since, "changes": changes}
+
+@app.get("/audit")
+async def audit(max_examples: int = Query(DEFAULT_AUDIT_EXAMPLES, ge=0, le=MAX_AUDIT_EXAMPLES)):
+    # 客戶ID完整性稽核 (只讀)；完全相同的重複列以 python -m customer_id.audit --repair 修復
+    current = await current_generator_async()
+    revision = current.revision
+    report = await storage.run(lambda: audit_customer_ids(current.data, RULES, max_examples))
+    return {"revision": None if revision is None else str(revision), **report}
+
+@app.get("/refresh_stats")
+def refresh_stats():
+    return get_generator().refresh_stats()
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/write_behind_stats")
+def write_behind_stats():
+    data_access = get_generator().data_access
+    if not isinstance(data_access, WriteBehindDataAccess):
+        return {"enabled": False}
+    return {"enabled": True, **data_access.stats()}
+
 @app.get("/regions")
 def get_regions():
-    return ["1北投", "2台南", "3高雄"]
+    return REGIONS
 
 @app.get("/categories")
 def get_categories():
-    return ["0連鎖或相關企業的合開發票", "1連鎖或相關企業的不合開發票", "2單一客戶", "6機動", "7未定", f"8{os.getenv('DACHING_RELATIONSHIP')}", "9其他"]
+    return CATEGORIES
 
 @app.get("/extra_region_codes")
 def get_extra_region_codes():
-    return ["0無區分", "1本縣市", "2本縣市", "3本縣市", "4本縣市", "5外縣市", "6外縣市", "7外縣市", "8外縣市", "9外縣市"]
+    return EXTRA_REGION_CODES
 
 @app.get("/favicon.ico", include_in_schema=False)
 def favicon():
@@ -0,0 +1,68 @@
+"""
+效能測試用的合成客戶資料，依種子產生，相同參數每次結果都一樣。
+
+涵蓋所有地區、類別、額外地區代碼與分行處理方式的組合，客戶ID依 CustomerIDGenerator 的編號規則編出，
+可以直接存成快照後繼續配發。
+"""
+import random
+
+import pandas as pd
+
+from customer_id.rules import IDRules
+from data_access.data_access import CUSTOMER_COLUMNS
+
+RULES = IDRules.from_env()
+REGIONS = RULES.regions
+CATEGORIES = RULES.categories
+EXTRA_REGION_CODES = RULES.extra_region_code_names
+BRANCH_HANDLINGS = ["00開立發票客編", "以流水號編列此分行"]
+# 非連鎖類別的客戶ID不含額外地區代碼，不同代碼會編出相同的ID (既有規則)，所以固定使用一種
+FLAT_EXTRA_REGION_CODE = "0無區分"
+
+NAME_PREFIXES = ["大同", "長榮", "統一", "台塑", "遠東", "新光", "國泰", "華南", "中華", "永豐",
+                 "光陽", "正新", "南亞", "東元", "聲寶", "味全", "義美", "全家", "台糖", "宏碁"]
+NAME_SUFFIXES = ["企業", "商行", "實業", "科技", "食品", "建設", "貿易", "電機", "藥局", "餐飲"]
+BRANCH_CITIES = ["台北", "新北", "桃園", "台中", "台南", "高雄", "基隆", "新竹", "嘉義", "屏東"]
+MAX_BRANCHES = 20
+
+
+def _company_name(rng, number):
+    return f"{rng.choice(NAME_PREFIXES)}{rng.choice(NAME_SUFFIXES)}{number}"
+
+
+def synthetic_customers(rows, seed=0):
+    """產生 rows 筆客戶資料 (DataFrame，欄位同 CUSTOMER_COLUMNS)。"""
+    rng = random.Random(seed)
+    company_serials = {}
+    records = []
+    number = 0
+    while len(records) < rows:
+        number += 1
+        region = rng.choice(REGIONS)
+        category = rng.choice(CATEGORIES)
+        region_code, category_code = region[0], category[0]
+        company_name = _company_name(rng, number)
+
+        if category_code not in '018':
+            key = (region, category)
+            serial = company_serials[key] = company_serials.get(key, 0) + 1
+            records.append((region, category, company_name, FLAT_EXTRA_REGION_CODE, '', None,
+                            f"{region_code}{category_code}{serial:06d}"))
+            continue
+
+        extra_region_code = rng.choice(EXTRA_REGION_CODES)
+        key = (region, category, extra_region_code)
+        serial = company_serials[key] = company_serials.get(key, 0) + 1
+        if serial > 999:
+            # 三碼流水號已用完，改配其他群組
+            continue
+        prefix = f"{region_code}{category_code}{serial:03d}{extra_region_code[0]}"
+        branch_handling = rng.choice(BRANCH_HANDLINGS) if category_code == '0' else None
+        if branch_handling == "00開立發票客編":
+            records.append((region, category, company_name, extra_region_code, '', branch_handling, f"{prefix}00"))
+            continue
+        for branch_serial in range(1, min(rng.randint(1, MAX_BRANCHES), rows - len(records)) + 1):
+            branch_name = f"{rng.choice(BRANCH_CITIES)}分店{branch_serial}"
+            records.append((region, category, company_name, extra_region_code, branch_name, branch_handling,
+                            f"{prefix}{branch_serial:02d}"))
+    return pd.DataFrame(records[:rows], columns=CUSTOMER_COLUMNS)
@@ -0,0 +1,189 @@
+"""
+負載測試：匯入與寫入進行中時，搜尋 (逐字輸入的 typeahead) 的延遲是否維持不變。
+
+    python -m benchmarks.load_test --rows 20000 --latency 50 --duration 10
+    python -m benchmarks.load_test --repo ../old-checkout   # 與其他版本比較，例如 git worktree 建立的舊版
+
+以本機目錄模擬遠端儲存：每次物件層級的存取 (_head / _download / _upload ...) 前加上 --latency 毫秒的延遲，
+相當於 Dropbox / S3 的往返時間。啟動兩個 uvicorn worker (A、B) 共用同一個目錄與通知檔：
+
+    idle    只對 A 送出搜尋
+    loaded  搜尋 A 的同時，--importers 個連線持續對 A 匯入 Excel，--writers 個連線持續對 B 批次配發 (每次一筆寫入)，
+            A 因此也要套用 B 的異動
+
+輸出兩個階段搜尋延遲的 p50 / p95 / p99 / max (毫秒) 與期間完成的匯入、寫入次數。
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.datasets import synthetic_customers, NAME_PREFIXES, NAME_SUFFIXES, REGIONS, CATEGORIES
+from data_access.local_data_access import LocalDataAccess
+
+SERVER = """
+import sys, time
+from data_access.local_data_access import LocalDataAccess
+latency = float(sys.argv[2]) / 1000
+
+def delayed(method):
+    def wrapper(*args, **kwargs):
+        time.sleep(latency)
+        return method(*args, **kwargs)
+    return wrapper
+
+for name in ('_exists', '_head', '_download', '_upload', '_list', '_delete'):
+    setattr(LocalDataAccess, name, delayed(getattr(LocalDataAccess, name)))
+
+import uvicorn
+import app
+uvicorn.run(app.app, host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')
+"""
+
+IMPORT_FILE_ROWS = 2000
+WRITE_BATCH = 20
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)], 2)
+
+    return {'count': len(ordered), 'p50': round(statistics.median(ordered), 2), 'p95': at(0.95), 'p99': at(0.99), 'max': round(ordered[-1], 2)}
+
+
+def _import_files(data, count):
+    files = []
+    for start in range(0, len(data), IMPORT_FILE_ROWS):
+        if len(files) >= count:
+            break
+        buffer = io.BytesIO()
+        data.iloc[start:start + IMPORT_FILE_ROWS].to_excel(buffer, index=False)
+        files.append(buffer.getvalue())
+    return files
+
+
+def _start_server(repo, env, port, latency):
+    process = subprocess.Popen([sys.executable, '-c', SERVER, str(port), str(latency)], cwd=repo, env=env)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/regions", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+async def _search(client, url, stop, samples):
+    keywords = [prefix[:length] + (suffix if length == 2 else '') for prefix in NAME_PREFIXES for suffix in NAME_SUFFIXES[:2] for length in (1, 2)]
+    number = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get(f"{url}/search_all_company_names/", params={'keyword': keywords[number % len(keywords)]})
+        response.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+        number += 1
+        await asyncio.sleep(0.01)  # 約每 10ms 一次按鍵
+
+
+async def _import(client, url, stop, files, counts):
+    number = 0
+    while not stop.is_set():
+        body = files[number % len(files)]
+        response = await client.post(f"{url}/import_excel", files={'file': ('customers.xlsx', body)})
+        response.raise_for_status()
+        counts['imports'] += 1
+        number += 1
+
+
+async def _write(client, url, stop, counts, worker):
+    number = 0
+    while not stop.is_set():
+        records = [
+            {'region': REGIONS[i % len(REGIONS)], 'category': CATEGORIES[2], 'company_name': f"負載測試{worker}-{number}-{i}",
+             'extra_region_code': '0無區分', 'branch_name': ''}
+            for i in range(WRITE_BATCH)
+        ]
+        response = await client.post(f"{url}/generate_customer_ids_batch", params={'confirm': 'true'}, json={'records': records})
+        if response.status_code != 409:  # 與其他 worker 衝突且重試用盡時略過
+            response.raise_for_status()
+            counts['writes'] += 1
+        number += 1
+
+
+async def run_phases(search_url, write_url, duration, importers, writers, files):
+    results = {}
+    timeout = httpx.Timeout(600)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        # 第一次請求會建立 generator (下載整份資料)，不計入
+        await client.get(f"{search_url}/search_all_company_names/", params={'keyword': '大'})
+        await client.get(f"{write_url}/search_all_company_names/", params={'keyword': '大'})
+        for phase, load in (('idle', False), ('loaded', True)):
+            stop = asyncio.Event()
+            samples, counts = [], {'imports': 0, 'writes': 0}
+            tasks = [asyncio.create_task(_search(client, search_url, stop, samples))]
+            if load:
+                tasks += [asyncio.create_task(_import(client, search_url, stop, files, counts)) for _ in range(importers)]
+                tasks += [asyncio.create_task(_write(client, write_url, stop, counts, worker)) for worker in range(writers)]
+            await asyncio.sleep(duration)
+            stop.set()
+            await asyncio.gather(*tasks)
+            results[phase] = {'search_ms': _percentiles(samples), **(counts if load else {})}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=50, help='每次儲存存取的模擬往返時間 (毫秒)')
+    parser.add_argument('--duration', type=float, default=10, help='每個階段的秒數')
+    parser.add_argument('--importers', type=int, default=2)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--snapshot-format', default='parquet')
+    parser.add_argument('--repo', default=os.getcwd(), help='要量測的程式碼目錄，預設為目前目錄')
+    args = parser.parse_args()
+
+    data = synthetic_customers(args.rows + IMPORT_FILE_ROWS * 10, seed=args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        LocalDataAccess(directory, 'customer_ids.xlsx', args.snapshot_format).save(data.iloc[:args.rows])
+        files = _import_files(data.iloc[args.rows:], 10)
+        env = dict(os.environ, STORAGE_TYPE='local', LOCAL_DIRECTORY=directory, SNAPSHOT_FORMAT=args.snapshot_format,
+                   CHANGE_NOTIFY_PATH=os.path.join(directory, 'customer_ids.seq'), GENERATOR_WARMUP='0', PYTHONDONTWRITEBYTECODE='1')
+        for name in ('WRITE_BEHIND_DIR', 'SHARD_BY'):
+            env.pop(name, None)
+        repo = os.path.abspath(args.repo)
+        ports = [_free_port(), _free_port()]
+        servers = [_start_server(repo, env, port, args.latency) for port in ports]
+        try:
+            results = asyncio.run(run_phases(f"http://127.0.0.1:{ports[0]}", f"http://127.0.0.1:{ports[1]}",
+                                             args.duration, args.importers, args.writers, files))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+    print(json.dumps({'rows': args.rows, 'latency_ms': args.latency, 'repo': repo, **results}, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
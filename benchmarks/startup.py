@@ -0,0 +1,70 @@
+"""
+冷啟動時間：每次在新的 Python 程序中匯入 app，量測
+
+    import_ms       匯入 app 所需時間
+    first_static_ms 匯入後第一個 /regions 回應 (不需要客戶資料)
+    first_data_ms   匯入後第一個需要客戶資料的回應 (/search_all_company_names/)
+
+    python -m benchmarks.startup --rows 10000 --runs 5
+    python -m benchmarks.startup --repo ../old-checkout   # 與其他版本比較，例如 git worktree 建立的舊版
+
+資料以 benchmarks.datasets 產生，存成本機 xlsx 快照 (與 Dropbox 上的格式相同)。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.datasets import synthetic_customers
+from data_access.local_data_access import LocalDataAccess
+
+CHILD = """
+import json, time
+from fastapi.testclient import TestClient
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = TestClient(app.app)
+assert client.get('/regions').status_code == 200
+static = time.perf_counter()
+assert client.get('/search_all_company_names/', params={'keyword': '大'}).status_code == 200
+data = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_static_ms': (static - imported) * 1000,
+    'first_data_ms': (data - imported) * 1000,
+}))
+"""
+
+
+def measure(repo, directory, snapshot_format, runs):
+    env = dict(os.environ, STORAGE_TYPE='local', LOCAL_DIRECTORY=directory, SNAPSHOT_FORMAT=snapshot_format,
+               METRICS_ENABLED='0', PYTHONDONTWRITEBYTECODE='1')
+    env.pop('WRITE_BEHIND_DIR', None)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=repo, env=env, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {name: statistics.median(sample[name] for sample in samples) for name in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--snapshot-format', default='xlsx')
+    parser.add_argument('--repo', default=os.getcwd(), help='要量測的程式碼目錄，預設為目前目錄')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        LocalDataAccess(directory, 'customer_ids.xlsx', args.snapshot_format).save(synthetic_customers(args.rows, seed=args.seed))
+        result = measure(os.path.abspath(args.repo), directory, args.snapshot_format, args.runs)
+    print(json.dumps({'rows': args.rows, 'runs': args.runs, 'repo': os.path.abspath(args.repo), **result}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+多執行緒、多個 CustomerIDGenerator 同時配發客戶ID的壓力測試。
+
+    python -m benchmarks.stress_allocation --threads 1,2,4,8 --instances 2 --latency 20
+    python -m benchmarks.stress_allocation --storage local --threads 1,2,4,8 --instances 3
+
+每個 generator 模擬一個獨立程序 (各自的記憶體索引)，共用同一個資料庫；
+--storage local 則讓每個 generator 在真正獨立的程序中執行，共用同一個本機目錄 (快照 + journal，
+與 Dropbox / S3 相同的條件寫入)。--latency 模擬遠端儲存的往返時間：資料庫加在每次寫入前，本機目錄加在每次上傳與查詢版本。
+結束時重新載入儲存的資料，檢查其中與各執行緒取得的客戶ID皆無重複；資料庫另外檢查寫入後的 refresh 不必重新載入。
+每一行都列出相對於第一個執行緒數 (通常為 1) 的 ids/s 倍數；最多執行緒沒有比較快時輸出警告，
+指定 --min-speedup 時低於該倍數即以非零狀態結束。
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import pandas as pd
+
+from customer_id.customer_id_generator import CustomerIDGenerator
+from customer_id.sql_customer_id_generator import SQLCustomerIDGenerator
+from data_access.data_access import ConflictError, CUSTOMER_COLUMNS
+from data_access.db_data_access import DBDataAccess
+from data_access.local_data_access import LocalDataAccess
+
+REGIONS = ["1北投", "2台南", "3高雄"]
+CATEGORIES = ["1連鎖或相關企業的不合開發票", "2單一客戶", "6機動", "9其他"]
+# 非連鎖類別的客戶ID不含額外地區代碼，不同代碼會編出相同的ID (既有規則)，所以固定使用一種
+EXTRA_REGION_CODE = "0無區分"
+
+
+class LatencyDBDataAccess(DBDataAccess):
+
+    def __init__(self, db_url, latency):
+        super().__init__(db_url)
+        self.latency = latency
+
+    def append(self, rows):
+        time.sleep(self.latency)
+        super().append(rows)
+
+
+class LatencyLocalDataAccess(LocalDataAccess):
+
+    def __init__(self, directory, latency):
+        super().__init__(directory, 'customer_ids.xlsx', 'parquet')
+        self.latency = latency
+
+    # 延遲加在物件層級的往返 (上傳與查詢版本)，與 Dropbox / S3 一樣發生在 journal 寫入的過程中
+    def _upload(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super()._upload(*args, **kwargs)
+
+    def _head(self, path):
+        time.sleep(self.latency)
+        return super()._head(path)
+
+
+def _allocate(generators, numbers, ids_per_thread, allocated, failures):
+    # numbers 中的每個執行緒輪流使用 generators，各自配發 ids_per_thread 個客戶ID
+    def worker(number):
+        generator = generators[number % len(generators)]
+        rng = random.Random(number)
+        for i in range(ids_per_thread):
+            try:
+                customer_id = generator.generate_customer_id(
+                    rng.choice(REGIONS), rng.choice(CATEGORIES), f"壓力測試{number}-{i}",
+                    EXTRA_REGION_CODE, f"分行{i}", "以流水號編列此分行")
+                allocated.append(customer_id)
+            except ConflictError:
+                failures['conflict'] += 1
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in numbers]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def _summary(threads, allocated, stored, gave_up, elapsed, reloads_after_write=0):
+    return {
+        'threads': threads,
+        'allocated': len(allocated),
+        'duplicates_returned': len(allocated) - len(set(allocated)),
+        'duplicates_stored': int(stored.duplicated().sum()),
+        'missing': len(set(allocated) - set(stored)),
+        'gave_up': gave_up,
+        'reloads_after_write': reloads_after_write,
+        'ids_per_second': len(allocated) / elapsed if elapsed else 0.0,
+    }
+
+
+def run(db_url, threads, instances, ids_per_thread, latency, sql_native=False):
+    generator_class = SQLCustomerIDGenerator if sql_native else CustomerIDGenerator
+    generators = [generator_class(LatencyDBDataAccess(db_url, latency)) for _ in range(instances)]
+    allocated = []
+    failures = Counter()
+
+    start = time.perf_counter()
+    _allocate(generators, range(threads), ids_per_thread, allocated, failures)
+    elapsed = time.perf_counter() - start
+
+    # 自己寫入後的 refresh 應該沿用版本號，不必重新載入
+    reloads_after_write = 0
+    for number, generator in enumerate(generators):
+        generator.refresh_data()
+        misses = generator.refresh_misses
+        allocated.append(generator.generate_customer_id(REGIONS[0], CATEGORIES[0], f"壓力測試收尾{number}", EXTRA_REGION_CODE, "分行", "以流水號編列此分行"))
+        generator.refresh_data()
+        reloads_after_write += generator.refresh_misses - misses
+
+    stored = DBDataAccess(db_url).load()['CustomerID']
+    return _summary(threads, allocated, stored, failures['conflict'], elapsed, reloads_after_write)
+
+
+def _local_instance(directory, numbers, ids_per_thread, latency):
+    # 在子程序中執行：一個 generator 與它的執行緒，回傳配發到的客戶ID、放棄的次數與配發耗時 (不含程序啟動)
+    logging.basicConfig(level=logging.ERROR)
+    allocated = []
+    failures = Counter()
+    generators = [CustomerIDGenerator(LatencyLocalDataAccess(directory, latency))]
+    start = time.perf_counter()
+    _allocate(generators, numbers, ids_per_thread, allocated, failures)
+    return allocated, failures['conflict'], time.perf_counter() - start
+
+
+def run_local(directory, threads, instances, ids_per_thread, latency):
+    # 先寫出空的快照，各程序才有共同的 journal 可以接續
+    LocalDataAccess(directory, 'customer_ids.xlsx', 'parquet').save(pd.DataFrame(columns=CUSTOMER_COLUMNS))
+    jobs = [(directory, range(instance, threads, instances), ids_per_thread, latency) for instance in range(min(instances, threads))]
+    with multiprocessing.get_context('spawn').Pool(len(jobs)) as pool:
+        results = pool.starmap(_local_instance, jobs)
+
+    allocated = [customer_id for ids, _, _ in results for customer_id in ids]
+    # 以新的 DataAccess 重新載入快照與 journal，檢查實際儲存的內容
+    stored = LocalDataAccess(directory, 'customer_ids.xlsx', 'parquet').load()['CustomerID']
+    return _summary(threads, allocated, stored, sum(gave_up for _, gave_up, _ in results), max(elapsed for _, _, elapsed in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', default='1,2,4,8')
+    parser.add_argument('--instances', type=int, default=2)
+    parser.add_argument('--ids-per-thread', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=20.0, help='每次遠端存取的模擬往返時間 (毫秒)')
+    parser.add_argument('--storage', choices=['sqlite', 'local'], default='sqlite', help='local 為本機目錄的快照 + journal，每個 instance 一個程序')
+    parser.add_argument('--db-url', default=None, help='預設使用暫存的 SQLite 檔案')
+    parser.add_argument('--sql-native', action='store_true', help='使用直接下 SQL 的 SQLCustomerIDGenerator')
+    parser.add_argument('--min-speedup', type=float, default=None,
+                        help='最多執行緒相對於第一個執行緒數 (通常為 1) 的 ids/s 倍數低於此值時以非零狀態結束')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    ok = True
+    baseline = None
+    for threads in [int(value) for value in args.threads.split(',')]:
+        with tempfile.TemporaryDirectory() as directory:
+            if args.storage == 'local':
+                result = run_local(directory, threads, args.instances, args.ids_per_thread, args.latency / 1000)
+            else:
+                db_url = args.db_url or f"sqlite:///{os.path.join(directory, 'stress.db')}"
+                result = run(db_url, threads, args.instances, args.ids_per_thread, args.latency / 1000, args.sql_native)
+        # 與第一個執行緒數的結果比較，確認多執行緒配發確實有加速
+        baseline = baseline or result
+        speedup = result['ids_per_second'] / baseline['ids_per_second'] if baseline['ids_per_second'] else 0.0
+        print(f"threads={result['threads']:>3}  allocated={result['allocated']:>6}  "
+              f"ids/s={result['ids_per_second']:>8.1f}  (threads={baseline['threads']}: {baseline['ids_per_second']:.1f}, x{speedup:.2f})  "
+              f"duplicates={result['duplicates_returned']}/{result['duplicates_stored']}  "
+              f"missing={result['missing']}  gave_up={result['gave_up']}  reloads_after_write={result['reloads_after_write']}")
+        ok = (ok and result['duplicates_returned'] == 0 and result['duplicates_stored'] == 0 and result['missing'] == 0
+              and result['reloads_after_write'] == 0)
+    if not ok:
+        raise SystemExit("duplicate or missing customer IDs, or reloads after own writes, detected")
+    if result is not baseline and speedup <= 1.0:
+        # 延遲很小時瓶頸在 CPU (GIL) 而不是往返時間，可加大 --latency 模擬遠端儲存
+        print(f"WARNING: {result['threads']} threads are no faster than {baseline['threads']} (x{speedup:.2f})", file=sys.stderr)
+    if args.min_speedup is not None and result is not baseline and speedup < args.min_speedup:
+        raise SystemExit(f"{result['threads']} threads reached only x{speedup:.2f} of {baseline['threads']}, below --min-speedup {args.min_speedup}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+主要操作的效能測試，結果輸出成 JSON，可與先前的結果比較。
+
+    python -m benchmarks.suite --rows 1000,10000,100000 --output results.json
+    python -m benchmarks.suite --rows 1000,10000,100000 --baseline results.json
+
+資料以 benchmarks.datasets 依種子產生，存到暫存目錄的 LocalDataAccess (或 --storage sqlite 的資料庫)，
+不需要 Dropbox、S3 或資料庫帳號。匯入與匯出透過 FastAPI 的 TestClient 呼叫 app 的端點。
+與 --baseline 比較時，中位數變慢超過 --threshold 倍的項目視為退步，程式以非零狀態結束。
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.datasets import synthetic_customers, REGIONS, CATEGORIES
+from customer_id.customer_id_generator import CustomerIDGenerator
+from customer_id.export import ExportCache
+from customer_id.sql_customer_id_generator import SQLCustomerIDGenerator
+from factory.data_access_factory import DataAccessFactory
+
+DEFAULT_ROWS = '1000,10000,100000'
+
+
+def measure(name, rows, func, repeat, results):
+    # func 接收第幾次執行，讓每次呼叫可以使用不同的資料
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    result = {
+        'name': name,
+        'rows': rows,
+        'repeat': repeat,
+        'median_ms': statistics.median(timings),
+        'mean_ms': statistics.fmean(timings),
+        'min_ms': timings[0],
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+    results.append(result)
+    logging.info(f"{name} rows={rows}: median {result['median_ms']:.3f} ms")
+    return result
+
+
+def create_generator(storage, directory, snapshot_format, data, shard_by=None):
+    if storage == 'sqlite':
+        data_access = DataAccessFactory.get_data_access('db', db_url=f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        data_access.save(data)
+        return lambda: SQLCustomerIDGenerator(data_access)
+    if shard_by:
+        data_access = DataAccessFactory.get_sharded_data_access(
+            'local', shard_by, REGIONS, CATEGORIES, directory=directory, file_name='customer_ids.xlsx', snapshot_format=snapshot_format)
+    else:
+        data_access = DataAccessFactory.get_data_access(
+            'local', directory=directory, file_name='customer_ids.xlsx', snapshot_format=snapshot_format)
+    data_access.save(data)
+    return lambda: CustomerIDGenerator(data_access)
+
+
+def excel_bytes(data):
+    buffer = io.BytesIO()
+    data.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def run_size(rows, args, client, app_module, results):
+    dataset = synthetic_customers(rows + args.import_rows, seed=args.seed)
+    data, imported = dataset.iloc[:rows].reset_index(drop=True), dataset.iloc[rows:]
+    sample = data.sample(n=min(len(data), args.repeat), random_state=args.seed, replace=False).reset_index(drop=True)
+    chain = data[data['Category'] == CATEGORIES[1]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        factory = create_generator(args.storage, directory, args.snapshot_format, data, args.shard_by)
+        generators = []
+        measure('startup', rows, lambda i: generators.append(factory()), 1, results)
+        generator = generators[-1]
+        app_module.generator = generator
+        repeat = args.repeat
+
+        def existing(i):
+            return sample.iloc[i % len(sample)]
+
+        measure('preview_customer_id.existing', rows, lambda i: generator.preview_customer_id(
+            *existing(i)[['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling']]), repeat, results)
+        measure('preview_customer_id.new_company', rows, lambda i: generator.preview_customer_id(
+            '1北投', CATEGORIES[2], f"效能測試預覽{i}", '0無區分', '', None), repeat, results)
+        measure('generate_customer_id.new_company', rows, lambda i: generator.generate_customer_id(
+            '2台南', CATEGORIES[2], f"效能測試新公司{i}", '0無區分', '', None), repeat, results)
+        if not chain.empty:
+            measure('generate_customer_id.new_branch', rows, lambda i: generator.generate_customer_id(
+                *chain.iloc[i % len(chain)][['Region', 'Category', 'CompanyName', 'ExtraRegionCode']],
+                f"效能測試分行{i}", None), repeat, results)
+        measure('generate_customer_ids.batch', rows, lambda i: generator.generate_customer_ids([
+            {'region': '3高雄', 'category': CATEGORIES[4], 'company_name': f"效能測試批次{i}-{j}", 'extra_region_code': '0無區分', 'branch_name': ''}
+            for j in range(args.batch_size)]), max(1, repeat // 10), results)
+
+        measure('search_company_name', rows, lambda i: generator.search_company_name(existing(i)['CompanyName'][:2]), repeat, results)
+        measure('search_company_name.scoped', rows, lambda i: generator.search_company_name(
+            existing(i)['CompanyName'][:2], existing(i)['Region'], existing(i)['Category']), repeat, results)
+        measure('search_branch_name', rows, lambda i: generator.search_branch_name('分店1'), repeat, results)
+        measure('search_customer_id', rows, lambda i: generator.search_customer_id(existing(i)['CustomerID'][:4]), repeat, results)
+        measure('query_customer_id', rows, lambda i: generator.query_customer_id(existing(i)['CompanyName']), repeat, results)
+        if not chain.empty:
+            largest = chain['CompanyName'].value_counts().index[0]
+            measure('endpoint.query_customer_id.largest_chain', rows, lambda i: _check(client.post(
+                '/query_customer_id', json={'company_name': largest})), repeat, results)
+
+        measure('update_customer_info', rows, lambda i: generator.update_customer_info(
+            existing(i)['CustomerID'], new_company_name=f"{existing(i)['CompanyName']}-改"), min(repeat, len(sample)), results)
+        victims = [generator.generate_customer_id('1北投', CATEGORIES[3], f"效能測試刪除{i}", '0無區分', '', None) for i in range(repeat)]
+        measure('delete_customer_id', rows, lambda i: generator.delete_customer_id(victims[i]), repeat, results)
+        batch_repeat = max(1, repeat // 10)
+        batch = data.sample(n=min(len(data), args.batch_size), random_state=args.seed + 1)
+        measure('update_customer_info_batch', rows, lambda i: generator.update_customer_info_batch([
+            {'customer_id': row.CustomerID, 'new_branch_name': f"效能測試批次更新{i}"} for row in batch.itertuples()]), batch_repeat, results)
+        batch_victims = [generator.generate_customer_ids([
+            {'region': '1北投', 'category': CATEGORIES[3], 'company_name': f"效能測試批次刪除{i}-{j}", 'extra_region_code': '0無區分', 'branch_name': ''}
+            for j in range(args.batch_size)]) for i in range(batch_repeat)]
+        measure('delete_customer_ids', rows, lambda i: generator.delete_customer_ids(batch_victims[i]), batch_repeat, results)
+
+        measure('refresh_data.unchanged', rows, lambda i: generator.refresh_data(), repeat, results)
+
+        upload = excel_bytes(imported)
+        measure('endpoint.import_excel', rows, lambda i: _check(client.post(
+            '/import_excel', files={'file': ('import.xlsx', upload)})), 1, results)
+        for export_format in args.export_formats.split(','):
+            def export(i, export_format=export_format):
+                return _check(client.get('/export_excel', params={'format': export_format}))
+
+            def export_cold(i, export_format=export_format):
+                # 換一個空的匯出快取，量測實際產生檔案的時間
+                app_module.export_cache = ExportCache(os.path.join(directory, 'export'))
+                return export(i)
+
+            measure(f"endpoint.export_excel.{export_format}", rows, export_cold, args.export_repeat, results)
+            measure(f"endpoint.export_excel.{export_format}.cached", rows, export, args.export_repeat, results)
+
+
+def _check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.url}: HTTP {response.status_code} {response.text[:200]}")
+    return response
+
+
+def compare(results, baseline, threshold):
+    # 以 (名稱, 資料量) 對應，回傳變慢超過 threshold 倍的項目；比較表輸出到 stderr，stdout 只留 JSON 報告
+    previous = {(result['name'], result['rows']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['name'], result['rows']))
+        if old is None or not old['median_ms']:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        result['baseline_median_ms'] = old['median_ms']
+        result['ratio'] = ratio
+        flag = 'REGRESSION' if ratio > threshold else ''
+        print(f"{result['name']:<40} rows={result['rows']:>8}  {old['median_ms']:>10.3f} -> {result['median_ms']:>10.3f} ms  x{ratio:.2f} {flag}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'storage': args.storage,
+        'snapshot_format': args.snapshot_format,
+        'shard_by': args.shard_by,
+        'seed': args.seed,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default=DEFAULT_ROWS, help='資料量，以逗號分隔 (1000 ~ 1000000)')
+    parser.add_argument('--repeat', type=int, default=50, help='每個項目執行的次數')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--storage', choices=['local', 'sqlite'], default='local')
+    parser.add_argument('--snapshot-format', default='parquet', help='local 儲存的快照格式 (xlsx / parquet / arrow)')
+    parser.add_argument('--shard-by', choices=['region', 'region_category'], help='local 儲存依地區 (與類別) 分片')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--import-rows', type=int, default=1000)
+    parser.add_argument('--export-formats', default='xlsx,csv,ndjson')
+    parser.add_argument('--export-repeat', type=int, default=3)
+    parser.add_argument('--output', help='結果寫入的 JSON 檔，預設輸出到標準輸出')
+    parser.add_argument('--baseline', help='先前的結果 JSON，用來比較')
+    parser.add_argument('--threshold', type=float, default=1.25, help='中位數變慢超過此倍數視為退步')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as app_directory:
+        # app 在匯入時就建立 DataAccess，先指到空的本機目錄，每個資料量再換成各自的 generator
+        os.environ['STORAGE_TYPE'] = 'local'
+        os.environ['LOCAL_DIRECTORY'] = app_directory
+        os.environ['GENERATOR_WARMUP'] = '0'
+        os.environ.pop('WRITE_BEHIND_DIR', None)
+        import app as app_module
+        from fastapi.testclient import TestClient
+        logging.getLogger().setLevel(logging.WARNING)
+        client = TestClient(app_module.app)
+
+        results = []
+        for rows in [int(value) for value in args.rows.split(',')]:
+            run_size(rows, args, client, app_module, results)
+
+    report = {'meta': metadata(args), 'results': results}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    if regressions:
+        sys.exit(f"{len(regressions)} benchmark(s) regressed by more than x{args.threshold}")
+
+
+if __name__ == '__main__':
+    main()
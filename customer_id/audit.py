@@ -0,0 +1,231 @@
+"""
+客戶ID的完整性稽核：整份資料一次向量化檢查，不逐列呼叫編碼規則。
+
+    python -m customer_id.audit                      # 稽核目前設定 (STORAGE_TYPE 等環境變數) 的資料
+    python -m customer_id.audit --file data.xlsx     # 稽核本機檔案 (xlsx / parquet / csv)
+    python -m customer_id.audit --output flagged.csv # 另外輸出所有有問題的列
+    python -m customer_id.audit --repair             # 移除完全相同的重複列
+
+只有「所有欄位都相同的重複列」會自動修復；客戶ID是對外使用的編號，其餘問題只列出，由人工處理。
+"""
+import argparse
+import json
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .query import page_records
+from .rules import (
+    CUSTOMER_ID_LENGTH, CHAIN_CATEGORY_CODES, INVOICE_BRANCH_HANDLING,
+    DEFAULT_REGION_CODE, DEFAULT_CATEGORY_CODE, DEFAULT_REGION_SERIAL,
+)
+
+DEFAULT_AUDIT_EXAMPLES = 20
+MAX_AUDIT_EXAMPLES = 1000
+MAX_MISSING_SERIALS = 20
+
+ISSUES = {
+    'malformed': "客戶ID不是 8 位數字",
+    'duplicate': "客戶ID重複",
+    'unknown_code': "地區、類別或額外地區代碼不在代碼表內",
+    'prefix_mismatch': "客戶ID的地區碼或類別碼與資料不符",
+    'region_serial_mismatch': "客戶ID的額外地區碼與資料不符",
+    'branch_serial_mismatch': "合開發票客編的分行流水號不是 00",
+    'company_serial_conflict': "同一家公司有不同的公司流水號",
+    'shared_company_serial': "不同公司使用相同的公司流水號",
+}
+COMPANY_COLUMNS = ['Region', 'Category', 'CompanyName', 'ExtraRegionCode']
+
+
+def _digits(customer_ids: pd.Series):
+    # 轉成固定寬度的 Unicode 陣列後直接取字元碼：(n, 9)，第 9 個字元不是 0 表示超過 8 碼
+    width = CUSTOMER_ID_LENGTH + 1
+    text = customer_ids.astype(str).to_numpy(dtype=f'U{width}')
+    chars = text.view(np.uint32).reshape(len(text), width)
+    digits = chars[:, :CUSTOMER_ID_LENGTH].astype(np.int64) - ord('0')
+    well_formed = ((digits >= 0) & (digits <= 9)).all(axis=1) & (chars[:, CUSTOMER_ID_LENGTH] == 0)
+    return np.where(well_formed[:, None], digits, 0), well_formed
+
+
+def _number(digits):
+    return digits @ (10 ** np.arange(digits.shape[1] - 1, -1, -1, dtype=np.int64))
+
+
+def _codes(values: pd.Series, mapping: dict, default: str):
+    # 類別欄位只需要對照每個類別一次，缺值 (code -1) 落在最後的預設碼
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        table = np.array([int(mapping.get(value, default)) for value in values.cat.categories] + [int(default)], dtype=np.int64)
+        return table[values.cat.codes.to_numpy()]
+    return values.map(mapping).fillna(default).astype(np.int64).to_numpy()
+
+
+def _nunique_within(values, groups, valid):
+    # 每一列所屬群組中 values 的相異值個數；valid 為 False 的列不參與也不標記
+    frame = pd.DataFrame({'group': groups[valid], 'value': values[valid]})
+    counts = np.zeros(len(values), dtype=np.int64)
+    counts[valid] = frame.groupby('group', sort=False)['value'].transform('nunique').to_numpy()
+    return counts
+
+
+def flag_rows(data: pd.DataFrame, rules) -> pd.DataFrame:
+    """回傳與 data 同樣索引的布林 DataFrame，每個欄位是 ISSUES 中的一種問題。"""
+    digits, well_formed = _digits(data['CustomerID'])
+    region_code = _codes(data['Region'], rules.region_codes, DEFAULT_REGION_CODE)
+    category_code = _codes(data['Category'], rules.category_codes, DEFAULT_CATEGORY_CODE)
+    region_serial = _codes(data['ExtraRegionCode'], rules.extra_region_codes, DEFAULT_REGION_SERIAL)
+    invoice = (category_code == 0) & (data['BranchHandling'] == INVOICE_BRANCH_HANDLING).to_numpy()
+    chain = np.isin(category_code, [int(code) for code in CHAIN_CATEGORY_CODES])
+
+    extra_region_code = data['ExtraRegionCode']
+    unknown = (
+        ~data['Region'].isin(rules.regions).to_numpy()
+        | ~data['Category'].isin(rules.categories).to_numpy()
+        | (extra_region_code.notna() & (extra_region_code != '') & ~extra_region_code.isin(rules.extra_region_code_names)).to_numpy()
+    )
+
+    # 客戶ID中代表公司的部分：連鎖類別為前 6 碼 (含額外地區碼)，其餘為完整的 8 碼
+    customer_number = _number(digits)
+    company_part = np.where(chain, customer_number // 100, customer_number)
+    company = data[COMPANY_COLUMNS].groupby(COMPANY_COLUMNS, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+
+    flags = pd.DataFrame({
+        'malformed': ~well_formed,
+        'duplicate': data['CustomerID'].astype(str).duplicated(keep=False).to_numpy(),
+        'unknown_code': unknown,
+        'prefix_mismatch': well_formed & (digits[:, 0] * 10 + digits[:, 1] != region_code * 10 + category_code),
+        'region_serial_mismatch': well_formed & chain & (digits[:, 5] != region_serial),
+        'branch_serial_mismatch': well_formed & invoice & (digits[:, 6] * 10 + digits[:, 7] != 0),
+        'company_serial_conflict': _nunique_within(company_part, company, well_formed) > 1,
+        'shared_company_serial': _nunique_within(company, company_part, well_formed) > 1,
+    }, index=data.index)
+    return flags[list(ISSUES)]
+
+
+def _serial_gaps(groups, serials, max_examples, describe):
+    # 每個群組的流水號應為 1..最大值的連續編號，缺號數 = 最大值 - 相異流水號個數
+    pairs = pd.DataFrame({'group': groups, 'serial': serials})
+    pairs = pairs[pairs['serial'] > 0].drop_duplicates()
+    summary = pairs.groupby('group', sort=True)['serial'].agg(['max', 'count'])
+    summary = summary[summary['max'] > summary['count']]
+    examples = []
+    for group, row in summary.head(max_examples).iterrows():
+        present = pairs.loc[pairs['group'] == group, 'serial'].to_numpy()
+        missing = np.setdiff1d(np.arange(1, row['max'] + 1), present)[:MAX_MISSING_SERIALS]
+        examples.append({**describe(group), 'max_serial': int(row['max']),
+                         'missing': int(row['max'] - row['count']), 'missing_serials': missing.tolist()})
+    return {'groups': len(summary), 'missing': int((summary['max'] - summary['count']).sum()), 'examples': examples}
+
+
+def serial_gaps(data: pd.DataFrame, rules, max_examples=DEFAULT_AUDIT_EXAMPLES) -> dict:
+    """公司流水號與分行流水號的缺號；刪除客戶ID也會產生缺號，僅供參考。"""
+    digits, well_formed = _digits(data['CustomerID'])
+    category_code = _codes(data['Category'], rules.category_codes, DEFAULT_CATEGORY_CODE)
+    invoice = (category_code == 0) & (data['BranchHandling'] == INVOICE_BRANCH_HANDLING).to_numpy()
+    chain = np.isin(category_code, [int(code) for code in CHAIN_CATEGORY_CODES]) & well_formed
+    single = ~chain & well_formed
+
+    prefix = digits[:, 0] * 10 + digits[:, 1]
+    # 連鎖類別的流水號依 (前兩碼, 額外地區碼) 分組，其餘類別依前兩碼分組
+    company_groups = np.concatenate([prefix[chain] * 10 + digits[chain, 5], 1000 + prefix[single]])
+    company_serials = np.concatenate([_number(digits[chain, 2:5]), _number(digits[single, 2:8])])
+
+    def describe_company(group):
+        if group >= 1000:
+            return {'prefix': f"{group - 1000:02d}", 'region_serial': None}
+        return {'prefix': f"{group // 10:02d}", 'region_serial': str(group % 10)}
+
+    branch = chain & ~invoice
+    return {
+        'company_serial': _serial_gaps(company_groups, company_serials, max_examples, describe_company),
+        'branch_serial': _serial_gaps(_number(digits[branch, :6]), _number(digits[branch, 6:8]), max_examples,
+                                      lambda group: {'company_prefix': f"{group:06d}"}),
+    }
+
+
+def exact_duplicates(data: pd.DataFrame) -> pd.Series:
+    """可自動修復的重複列：同一個客戶ID的所有列完全相同時，除第一列以外都標記為 True。"""
+    customer_ids = data['CustomerID'].astype(str)
+    repeated = data[customer_ids.duplicated(keep=False)]
+    marked = pd.Series(False, index=data.index)
+    if repeated.empty:
+        return marked
+    extra = repeated.astype(object).duplicated(keep='first')
+    distinct = repeated[~extra].groupby(customer_ids[repeated.index], sort=False).size()
+    repairable = customer_ids[repeated.index].isin(distinct.index[distinct == 1])
+    marked[repeated.index[extra & repairable]] = True
+    return marked
+
+
+def audit_customer_ids(data: pd.DataFrame, rules, max_examples=DEFAULT_AUDIT_EXAMPLES) -> dict:
+    """稽核整份資料，回傳各種問題的筆數、範例列、流水號缺號與可自動修復的重複列數。"""
+    flags = flag_rows(data, rules)
+    counts = flags.sum()
+    examples = {
+        issue: page_records(data[flags[issue].to_numpy()].head(max_examples))
+        for issue in ISSUES if counts[issue]
+    }
+    return {
+        "rows": len(data),
+        "flagged_rows": int(flags.any(axis=1).sum()),
+        "issues": {issue: int(counts[issue]) for issue in ISSUES},
+        "descriptions": ISSUES,
+        "examples": examples,
+        "gaps": serial_gaps(data, rules, max_examples),
+        "repairable_duplicates": int(exact_duplicates(data).sum()),
+    }
+
+
+def _read_file(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.csv'):
+        return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
+    return pd.read_excel(path, dtype={'CustomerID': str})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="客戶ID完整性稽核")
+    parser.add_argument('--file', help="稽核本機檔案，不指定時使用環境變數設定的儲存")
+    parser.add_argument('--output', help="將有問題的列輸出成 CSV，附上 Issues 欄位")
+    parser.add_argument('--max-examples', type=int, default=DEFAULT_AUDIT_EXAMPLES)
+    parser.add_argument('--repair', action='store_true', help="移除完全相同的重複列 (不可與 --file 併用)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    generator = None
+    if args.file:
+        if args.repair:
+            parser.error("--repair 只能用在環境變數設定的儲存")
+        from dotenv import load_dotenv
+        from .rules import IDRules
+        load_dotenv()
+        rules = IDRules.from_env()
+        data = _read_file(args.file)
+    else:
+        # 與 API 使用相同的儲存設定與代碼表
+        from app import get_generator, RULES
+        rules = RULES
+        generator = get_generator()
+        if args.repair:
+            generator.repair_duplicates()
+        data = generator.data
+
+    report = audit_customer_ids(data, rules, args.max_examples)
+    if generator is not None:
+        report["revision"] = None if generator.revision is None else str(generator.revision)
+    if args.output:
+        flags = flag_rows(data, rules)
+        flagged = flags.any(axis=1).to_numpy()
+        rows = pd.DataFrame(page_records(data[flagged]), columns=list(data.columns))
+        rows['Issues'] = [','.join(issue for issue, flagged in zip(ISSUES, row) if flagged) for row in flags[flagged].itertuples(index=False)]
+        rows.to_csv(args.output, index=False)
+        logging.info(f"Wrote {len(rows)} flagged rows to {args.output}")
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write('\n')
+    return 1 if report["flagged_rows"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows 只靠程序內的鎖
+    fcntl = None
+
+# 變更紀錄最多保留的列數 (新增 / 修改的列與刪除的客戶ID合計)，超過時丟掉最舊的異動
+DEFAULT_CHANGE_LOG_ROWS = 10000
+# 通知檔只存一個固定長度的序號
+SEQUENCE_BYTES = 8
+
+
+def _delta_size(delta):
+    if delta is None:
+        return 0
+    return len(delta['customer_ids']) if delta['op'] == 'delete' else len(delta['rows'])
+
+
+class ChangeLog:
+    """最近套用到記憶體的異動，依資料版本排列，讓 /changes 從任一已知版本接續回傳之後的 delta。"""
+
+    def __init__(self, max_rows=DEFAULT_CHANGE_LOG_ROWS):
+        self.max_rows = max_rows
+        self._entries = deque()
+        self._rows = 0
+        self._base = None
+        self._lock = threading.Lock()
+
+    def reset(self, revision):
+        # 整表重新載入或版本不明時清空，只能從目前版本開始接續
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+            self._base = revision
+
+    def record(self, revision, delta):
+        # delta 為 None 表示版本前進但資料沒有變動 (例如 journal 封存)
+        if revision is None:
+            self.reset(None)
+            return
+        with self._lock:
+            self._entries.append((revision, delta))
+            self._rows += _delta_size(delta)
+            while self._rows > self.max_rows and len(self._entries) > 1:
+                evicted, evicted_delta = self._entries.popleft()
+                self._rows -= _delta_size(evicted_delta)
+                self._base = evicted
+
+    def since(self, revision):
+        """回傳 revision 之後的 [(版本, delta), ...]；revision 不在紀錄內時回傳 None。"""
+        if revision is None:
+            return None
+        with self._lock:
+            base, entries = self._base, list(self._entries)
+        if revision == base:
+            return entries
+        for position in range(len(entries) - 1, -1, -1):
+            if entries[position][0] == revision:
+                return entries[position + 1:]
+        return None
+
+
+class ChangeNotifier:
+    """
+    同一台主機上多個 worker 之間的異動通知：共用檔案只存一個序號，每次寫入在檔案鎖內原地加一，
+    檔案大小固定，不隨寫入次數成長。讀取只需要讀 8 個位元組，序號沒變時不必詢問遠端版本。
+    其他主機的寫入不會通知到這裡，因此超過 max_age 秒仍會向遠端確認一次。
+    """
+
+    def __init__(self, path, max_age=30.0):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def sequence(self):
+        try:
+            with open(self.path, 'rb') as file:
+                return int.from_bytes(file.read(SEQUENCE_BYTES), 'little')
+        except FileNotFoundError:
+            return 0
+
+    def notify(self):
+        # 回傳寫入後的序號；讀取、加一與寫回之間不能被其他執行緒或程序插入，否則兩次寫入只會前進一號
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, 'r+b') as file:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_EX)  # 關檔時釋放
+                sequence = int.from_bytes(file.read(SEQUENCE_BYTES), 'little') + 1
+                file.seek(0)
+                file.write(sequence.to_bytes(SEQUENCE_BYTES, 'little'))
+                file.truncate()  # 舊版逐次附加的檔案改寫成固定長度
+                return sequence
@@ -0,0 +1,73 @@
+import pandas as pd
+
+# 客戶ID以外的欄位重複值很多，以 category 儲存：每列只存整數代碼，相同的字串只保留一份，
+# 以名稱篩選時比較的是代碼而不是逐列比較字串
+CATEGORY_COLUMNS = ['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling']
+
+
+def is_missing(value):
+    # 與 pd.isna 對純量的判斷相同 (None / NaN / NA / NaT)，但不經過 pandas 的型別分派，建索引時每列呼叫多次
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value)
+
+
+def normalize_record(record):
+    # 索引內的空值一律為 None，之後只需判斷 `None in key`
+    return tuple(None if is_missing(value) else value for value in record)
+
+
+def column_values(series: pd.Series) -> list:
+    """欄位轉成 list，空值為 None；category 欄位直接由代碼對應，相同的值共用同一個物件。"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories.tolist() + [None]
+        return [categories[code] for code in series.cat.codes.tolist()]
+    return [None if is_missing(value) else value for value in series.tolist()]
+
+
+def compact_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """CustomerIDGenerator 在記憶體中保存的資料表，CATEGORY_COLUMNS 轉成 category，列標籤重新由 0 連號。"""
+    # 逐欄建立新的 DataFrame：直接改寫欄位的話，原本的 2D object 區塊會以 view 的形式留下，所有字串都釋放不掉
+    columns = {}
+    for column in data.columns:
+        series = data[column]
+        if column in CATEGORY_COLUMNS and not isinstance(series.dtype, pd.CategoricalDtype):
+            columns[column] = series.astype('category')
+        else:
+            columns[column] = series.copy()
+    frame = pd.DataFrame(columns, index=data.index)
+    frame.index = pd.RangeIndex(len(frame))
+    return frame
+
+
+def append_rows(data: pd.DataFrame, entries: list, labels: list) -> pd.DataFrame:
+    # 新列以 labels 為列標籤，沿用既有的 category (必要時擴充類別)，合併後欄位型別不變；不修改傳入的 data
+    data = data.copy(deep=False)
+    rows = pd.DataFrame(entries, columns=data.columns, index=labels)
+    for column in CATEGORY_COLUMNS:
+        if column not in data.columns or not isinstance(data[column].dtype, pd.CategoricalDtype):
+            continue
+        _add_categories(data, column, rows[column])
+        rows[column] = pd.Categorical(rows[column], categories=data[column].cat.categories)
+    return pd.concat([data, rows])
+
+
+def _add_categories(data, column, values):
+    categories = data[column].cat.categories
+    values = pd.Index(pd.Series(values, dtype=object).dropna().unique())
+    new_values = values[categories.get_indexer(values) < 0]
+    if len(new_values):
+        # 沿用原本的代碼直接建立，比 cat.add_categories 少一次整欄重新編碼
+        dtype = pd.CategoricalDtype(categories.append(new_values))
+        data[column] = pd.Categorical.from_codes(data[column].cat.codes.to_numpy(), dtype=dtype)
+
+
+def assign_rows(data: pd.DataFrame, positions: list, column, values: list):
+    # 依列位置寫入，values 與 positions 一一對應；category 欄位不能直接寫入新的值，先擴充類別
+    if isinstance(data[column].dtype, pd.CategoricalDtype):
+        _add_categories(data, column, values)
+    data.iloc[positions, data.columns.get_loc(column)] = values
+
+
+def plain_frame(data: pd.DataFrame) -> pd.DataFrame:
+    # API 回應沿用原本的 object 欄位，fillna('') 等操作才不受 category 限制
+    columns = [column for column in CATEGORY_COLUMNS if column in data.columns and isinstance(data[column].dtype, pd.CategoricalDtype)]
+    return data.astype({column: object for column in columns}) if columns else data
@@ -1,30 +1,371 @@
-import os
-import re
+import random
+import threading
+import time
 import pandas as pd
 import logging
+from collections import Counter
+from data_access.storage_executor import StorageExecutor
+from data_access.data_access import ConflictError, rows_to_records
+from monitoring.metrics import metrics
+from .audit import exact_duplicates
+from .change_feed import ChangeLog
+from .compact import compact_frame, append_rows, assign_rows, plain_frame, normalize_record
+from .customer_index import CustomerIndex, RECORD_COLUMNS
+from .locks import ReadWriteLock, KeyedLocks
+from .query import DEFAULT_QUERY_LIMIT, query_fields, decode_cursor, paginate
+from .rules import IDRules, BRANCH, LAYOUT_SERIAL_LENGTHS
+from .search_index import SearchIndex, DEFAULT_SEARCH_LIMIT
+
+MAX_COMMIT_RETRIES = 5
+
+
+def _group_key(region, category, extra_region_code):
+    return tuple(None if pd.isna(value) else value for value in (region, category, extra_region_code))
+
+
+def _add_position(positions, customer_id, label):
+    current = positions.get(customer_id)
+    if current is None:
+        positions[customer_id] = label
+    elif isinstance(current, list):
+        current.append(label)
+    else:
+        positions[customer_id] = [current, label]
+
+
+def _build_positions(data):
+    # 客戶ID -> DataFrame 列標籤的雜湊索引；刪除列時其餘列的標籤不變，索引不必重建
+    customer_ids = data['CustomerID']
+    positions = dict(zip(customer_ids.tolist(), data.index.tolist()))
+    if len(positions) < len(customer_ids):
+        # 客戶ID重複時值為標籤的 list
+        duplicated = customer_ids[customer_ids.duplicated(keep=False)]
+        for customer_id in duplicated.unique().tolist():
+            del positions[customer_id]
+        for customer_id, label in zip(duplicated.tolist(), duplicated.index.tolist()):
+            _add_position(positions, customer_id, label)
+    return positions, len(data)
+
 
 class CustomerIDGenerator:
-    def __init__(self, data_access):
+    def __init__(self, data_access, notifier=None, rules=None, storage=None):
         self.data_access = data_access
+        # 非同步端點經由 storage 在儲存執行緒池執行讀寫遠端的流程
+        self.storage = storage if storage is not None else StorageExecutor()
+        self.rules = rules if rules is not None else IDRules.from_env()
+        self.index, self.search_index = self._create_indexes()
+        self.refresh_hits = 0
+        self.refresh_misses = 0
+        self.refresh_deltas = 0
+        # 最近的異動 (供 /changes 接續) 與同一台主機上 worker 之間的通知
+        self.changes = ChangeLog()
+        self.notifier = notifier
+        self._notified_sequence = None
+        self._checked_at = 0.0
+        self._background_refresh = None
+        self._background_guard = threading.Lock()
+        # 整表重新載入與批次作業取得寫鎖；單筆作業取得讀鎖再加上所屬流水號群組的鎖
+        self._lock = ReadWriteLock()
+        self._group_locks = KeyedLocks()
+        # 保護索引、搜尋索引與 DataFrame 的共用結構
+        self._index_lock = threading.RLock()
+        self._pending_rows = []
+        self._pending_labels = []
+        self._removed_labels = []
+        self._positions = {}
+        self._next_label = 0
+        self._initialize_data()
+
+    def _create_indexes(self):
+        return CustomerIndex(), SearchIndex()
+
+    def _initialize_data(self):
         if not self.data_access.file_exists():
             self.data = pd.DataFrame(columns=['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling', 'CustomerID'])
             self.data_access.save(self.data)
         else:
             self.data = self.data_access.load()
+        self.revision = self.data_access.revision
+        self.changes.reset(self.revision)
+
+    @property
+    def data(self):
+        with self._index_lock:
+            self._materialize()
+            return self._data
+
+    @data.setter
+    def data(self, value):
+        # 任何整表替換都重建索引；先在鎖外建好新的索引再一次替換，重建期間搜尋仍使用舊的索引，不必等待
+        with self._stage('index'):
+            data = compact_frame(value)
+            positions, next_label = _build_positions(data)
+            index, search_index = self._create_indexes()
+            index.build(data)
+            search_index.build(index.rows())
+        with self._index_lock:
+            self._data, self.index, self.search_index = data, index, search_index
+            self._pending_rows, self._pending_labels, self._removed_labels = [], [], []
+            self._positions, self._next_label = positions, next_label
+
+    def _materialize(self):
+        # 單筆配發與刪除只先記在 _pending_rows / _removed_labels，需要整表時才一次套用，避免每筆都複製整個 DataFrame
+        if self._pending_rows:
+            self._data = append_rows(self._data, self._pending_rows, self._pending_labels)
+            self._pending_rows, self._pending_labels = [], []
+        if self._removed_labels:
+            self._data = self._data[~self._data.index.isin(self._removed_labels)]
+            self._removed_labels = []
+
+    def _add_position(self, customer_id, label):
+        _add_position(self._positions, customer_id, label)
+
+    def _row_labels(self, customer_id):
+        labels = self._positions.get(customer_id)
+        if labels is None:
+            return []
+        return labels if isinstance(labels, list) else [labels]
+
+    # 寫入遠端成功後同步記憶體中的 DataFrame，呼叫端須持有 _index_lock
+    def _rows_appended(self, entries):
+        for entry in entries:
+            self._add_position(entry['CustomerID'], self._next_label)
+            self._pending_labels.append(self._next_label)
+            self._next_label += 1
+        self._pending_rows.extend(entries)
+
+    def _rows_updated(self, changes_by_id):
+        # changes_by_id: 客戶ID -> {欄位: 新值}；同一欄位的所有列一次寫入
+        self._materialize()
+        columns = {}
+        for customer_id, changes in changes_by_id.items():
+            labels = self._row_labels(customer_id)
+            for column, value in changes.items():
+                column_labels, values = columns.setdefault(column, ([], []))
+                column_labels.extend(labels)
+                values.extend([value] * len(labels))
+        for column, (labels, values) in columns.items():
+            if labels:
+                assign_rows(self._data, self._data.index.get_indexer(labels), column, values)
+
+    def _rows_deleted(self, customer_ids):
+        # 只記下要刪除的列標籤，下次需要整表時一次移除
+        for customer_id in customer_ids:
+            self._removed_labels.extend(self._row_labels(customer_id))
+            self._positions.pop(customer_id, None)
+
+    def _stage(self, name):
+        return metrics.stage(name, 'generator')
+
+    def _group_lock(self, region, category, extra_region_code):
+        return self._group_locks.get(_group_key(region, category, extra_region_code))
 
     def refresh_data(self):
-        self.data = self.data_access.load()
+        sequence = self.notifier.sequence() if self.notifier is not None else None
+        if self._notified_fresh(sequence):
+            self._refresh_hit()
+            return
+        # 先比對遠端版本，未變更時不重新下載與解析
+        revision = self.data_access.get_revision()
+        if revision is not None and revision == self.revision:
+            self._refresh_hit()
+            self._mark_checked(sequence)
+            return
+        with self._lock.exclusive():
+            # 等待寫鎖期間可能已有其他執行緒重新載入
+            if revision is not None and revision == self.revision:
+                self._refresh_hit()
+            elif not self._apply_changes():
+                self._reload()
+            self._mark_checked(sequence)
+
+    def _notified_fresh(self, sequence):
+        # 同一台主機上的 worker 都沒有寫入 (通知序號未變) 且最近確認過版本時，不必詢問遠端
+        return (sequence is not None and sequence == self._notified_sequence
+                and time.monotonic() - self._checked_at < self.notifier.max_age)
+
+    async def refresh_data_async(self):
+        # 不需要詢問遠端時只做一次 stat，直接在事件迴圈上完成
+        sequence = self.notifier.sequence() if self.notifier is not None else None
+        if self._notified_fresh(sequence):
+            self._refresh_hit()
+            return
+        await self.storage.run(self.refresh_data)
+
+    def refresh_in_background(self):
+        """
+        搜尋等對延遲敏感的讀取使用：需要詢問遠端時交給儲存執行緒池，不等待結果，這次讀取使用目前的資料。
+        同時只會有一個背景 refresh；回傳其 Future，不需要時回傳 None。
+        """
+        sequence = self.notifier.sequence() if self.notifier is not None else None
+        if self._notified_fresh(sequence):
+            self._refresh_hit()
+            return None
+        with self._background_guard:
+            if self._background_refresh is None or self._background_refresh.done():
+                self._background_refresh = self.storage.executor.submit(self._refresh_logged)
+            return self._background_refresh
+
+    def _refresh_logged(self):
+        try:
+            self.refresh_data()
+        except Exception as e:
+            # 下次讀取時會再試
+            logging.error(f"Error refreshing customer data in background: {e}")
+
+    def _refresh_hit(self):
+        self.refresh_hits += 1
+        metrics.inc('customer_id_refresh_total', result='hit')
+
+    def _mark_checked(self, sequence):
+        if self.revision is not None:
+            self._notified_sequence = sequence
+            self._checked_at = time.monotonic()
+
+    def _apply_changes(self):
+        # 只套用其他程序新寫入的 delta，記憶體的資料表與索引不必整份重建
+        changes = self.data_access.load_changes()
+        if changes is None:
+            return False
+        with self._index_lock, self._stage('index'):
+            for revision, delta in changes:
+                self._apply_delta(delta)
+                self.changes.record(revision, delta)
+        self.revision = self.data_access.revision
+        if not changes or changes[-1][0] != self.revision:
+            self.changes.record(self.revision, None)
+        self.refresh_deltas += 1
+        metrics.inc('customer_id_refresh_total', result='delta')
+        logging.info(f"Applied {len(changes)} changes from {self.revision}")
+        return True
+
+    def _apply_delta(self, delta):
+        # 與 journal 重播 (apply_delta) 的規則相同，呼叫端須持有 _index_lock
+        if delta['op'] == 'delete':
+            customer_ids = [customer_id for customer_id in dict.fromkeys(map(str, delta['customer_ids'])) if customer_id in self.index]
+            self._rows_deleted(customer_ids)
+            for customer_id in customer_ids:
+                self._index_remove(customer_id)
+            return
+        if delta['op'] not in ('append', 'upsert'):
+            return
+        rows = [dict(row, CustomerID=str(row['CustomerID'])) for row in delta['rows']]
+        if delta['op'] == 'append':
+            rows = [row for row in rows if row['CustomerID'] not in self.index]
+        else:
+            # 單一的列就地修改；客戶ID重複時以這次的列取代所有相同客戶ID的列
+            counts = Counter(row['CustomerID'] for row in rows)
+            changes_by_id = {}
+            replaced = []
+            for row in rows:
+                customer_id = row['CustomerID']
+                if customer_id not in self.index:
+                    continue
+                if counts[customer_id] == 1 and len(self.index.records(customer_id)) == 1:
+                    changes_by_id[customer_id] = {column: row[column] for column in RECORD_COLUMNS}
+                else:
+                    replaced.append(customer_id)
+            if changes_by_id:
+                self._rows_updated(changes_by_id)
+                for customer_id, changes in changes_by_id.items():
+                    self._index_update(customer_id, **changes)
+            replaced = list(dict.fromkeys(replaced))
+            self._rows_deleted(replaced)
+            for customer_id in replaced:
+                self._index_remove(customer_id)
+            rows = [row for row in rows if row['CustomerID'] not in changes_by_id]
+        for row in rows:
+            self._index_add([row[column] for column in RECORD_COLUMNS], row['CustomerID'])
+        self._rows_appended(rows)
+
+    def _reload(self):
+        with self._lock.exclusive():
+            self.refresh_misses += 1
+            metrics.inc('customer_id_refresh_total', result='miss')
+            self.data = self.data_access.load()
+            self.revision = self.data_access.revision
+            self.changes.reset(self.revision)
+
+    def _committed(self, delta):
+        # 本程序寫入成功後：更新版本、記錄異動並通知同一台主機上的其他 worker
+        self.revision = self.data_access.revision
+        self.changes.record(self.revision, delta)
+        if self.notifier is None:
+            return
+        previous = self._notified_sequence
+        sequence = self.notifier.notify()
+        # 期間沒有其他 worker 寫入 (序號只多了這一次) 時，記憶體仍與遠端一致，下次 refresh 不必詢問遠端
+        if previous is not None and sequence == previous + 1 and self.revision is not None:
+            self._notified_sequence = sequence
+
+    def changes_since(self, since):
+        """回傳 since 版本之後的 [(版本, delta), ...]；無法接續時回傳 None，呼叫端須重新查詢整份資料。"""
+        self.refresh_data()
+        return self.changes.since(since)
+
+    def _commit_with_retry(self, attempt):
+        # 樂觀寫入：遠端版本衝突時重新載入資料並重算，最多重試 MAX_COMMIT_RETRIES 次
+        for retry in range(MAX_COMMIT_RETRIES):
+            try:
+                return attempt()
+            except ConflictError as e:
+                logging.warning(f"Commit conflict ({retry + 1}/{MAX_COMMIT_RETRIES}), reloading: {e}")
+                # 隨機退避，避免多個程序同時重試又再次衝突
+                time.sleep(random.uniform(0, 0.01 * 2 ** retry))
+                self._reload()
+        raise ConflictError("資料已被其他使用者修改，請稍後再試")
+
+    def refresh_stats(self):
+        return {"hits": self.refresh_hits, "misses": self.refresh_misses, "deltas": self.refresh_deltas, "revision": self.revision}
 
     def save(self):
-        self.data_access.save(self.data)
+        with self._lock.exclusive():
+            self.data_access.save(plain_frame(self.data))
+            self.revision = self.data_access.revision
+            self.changes.reset(self.revision)
+            if self.notifier is not None:
+                self.notifier.notify()
+
+    # 非同步版本：鎖與遠端 I/O 都在儲存執行緒池執行，事件迴圈只等待結果
+    async def changes_since_async(self, since):
+        return await self.storage.run(self.changes_since, since)
+
+    async def generate_customer_id_async(self, region, category, company_name, extra_region_code=None, branch_name=None, branch_handling=None):
+        return await self.storage.run(self.generate_customer_id, region, category, company_name, extra_region_code, branch_name, branch_handling)
+
+    async def generate_customer_ids_async(self, records, preview=False):
+        return await self.storage.run(self.generate_customer_ids, records, preview)
+
+    async def update_customer_info_async(self, customer_id, new_company_name=None, new_branch_name=None):
+        await self.storage.run(self.update_customer_info, customer_id, new_company_name, new_branch_name)
+
+    async def update_customer_info_batch_async(self, updates):
+        return await self.storage.run(self.update_customer_info_batch, updates)
+
+    async def delete_customer_id_async(self, customer_id):
+        await self.storage.run(self.delete_customer_id, customer_id)
+
+    async def delete_customer_ids_async(self, customer_ids):
+        return await self.storage.run(self.delete_customer_ids, customer_ids)
 
     def preview_customer_id(self, region, category, company_name, extra_region_code=None, branch_name=None, branch_handling=None):
-        return self._generate_customer_id(region, category, company_name, extra_region_code, branch_name, branch_handling, preview=True)
+        with self._lock.shared(), self._group_lock(region, category, extra_region_code), self._stage('index'):
+            return self._generate_customer_id(region, category, company_name, extra_region_code, branch_name, branch_handling, preview=True)
 
     def generate_customer_id(self, region, category, company_name, extra_region_code=None, branch_name=None, branch_handling=None):
-        customer_id = self._generate_customer_id(region, category, company_name, extra_region_code, branch_name, branch_handling, preview=False)
-        if customer_id:
-            if self._is_customer_id_exists(customer_id):
+        return self._commit_with_retry(lambda: self._allocate_customer_id(
+            region, category, company_name, extra_region_code, branch_name, branch_handling))
+
+    def _allocate_customer_id(self, region, category, company_name, extra_region_code, branch_name, branch_handling):
+        # 群組鎖一直持有到寫入完成，同群組的下一筆才會看到這次配發的流水號
+        with self._lock.shared(), self._group_lock(region, category, extra_region_code):
+            # 計算流水號與確認是否已存在要看到同一份資料，否則其他程序剛寫入的ID會被誤當成既有的ID
+            with self.index.snapshot(), self._stage('index'):
+                customer_id = self._generate_customer_id(region, category, company_name, extra_region_code, branch_name, branch_handling, preview=False)
+                exists = bool(customer_id) and self._is_customer_id_exists(customer_id)
+            if not customer_id:
+                return customer_id
+            if exists:
                 logging.warning(f"Customer ID {customer_id} already exists. Skipping insertion.")
                 return customer_id
             new_entry = {
@@ -36,116 +377,317 @@ class CustomerIDGenerator:
                 'BranchHandling': branch_handling,
                 'CustomerID': customer_id
             }
-            self.data = pd.concat([self.data, pd.DataFrame([new_entry])], ignore_index=True)
-            self.data_access.save(self.data)
+            with self._index_lock:
+                self._index_add([new_entry[column] for column in RECORD_COLUMNS], customer_id)
+            try:
+                self.data_access.append(pd.DataFrame([new_entry]))
+            except Exception:
+                with self._index_lock:
+                    self._index_remove(customer_id)
+                raise
+            with self._index_lock:
+                self._rows_appended([new_entry])
+            self._committed({'op': 'append', 'rows': [new_entry]})
+            metrics.inc('customer_id_rows_total', operation='generate')
             logging.info(f"Generated Customer ID: {customer_id} for {company_name}")
-        return customer_id
+            return customer_id
+
+    def generate_customer_ids(self, records, preview=False):
+        records = list(records)
+        if preview:
+            with self._lock.exclusive():
+                return self._allocate_customer_ids(records, preview=True)
+        return self._commit_with_retry(lambda: self._allocate_customer_ids(records, preview=False))
+
+    def _allocate_customer_ids(self, records, preview):
+        # 逐筆沿用單筆的編號規則，批次內的記錄會看到前面剛配發的流水號；最後只寫入一次
+        with self._lock.exclusive():
+            customer_ids = []
+            new_entries = []
+            with self._index_lock, self.index.snapshot(), self._stage('index'):
+                try:
+                    for record in records:
+                        customer_id = self._generate_customer_id(
+                            record['region'], record['category'], record['company_name'], record.get('extra_region_code'),
+                            record.get('branch_name'), record.get('branch_handling'), preview=preview)
+                        customer_ids.append(customer_id)
+                        if not customer_id or self._is_customer_id_exists(customer_id):
+                            continue
+                        new_entry = {
+                            'Region': record['region'],
+                            'Category': record['category'],
+                            'CompanyName': record['company_name'],
+                            'ExtraRegionCode': record.get('extra_region_code'),
+                            'BranchName': record.get('branch_name'),
+                            'BranchHandling': record.get('branch_handling'),
+                            'CustomerID': customer_id
+                        }
+                        self._index_add([new_entry[column] for column in RECORD_COLUMNS], customer_id)
+                        new_entries.append(new_entry)
+                except Exception:
+                    self._discard_index_entries(new_entries)
+                    raise
+                if preview:
+                    # 預覽只借用索引計算流水號，算完即撤回
+                    self._discard_index_entries(new_entries)
+                    return customer_ids
+            if not new_entries:
+                return customer_ids
+
+            try:
+                self.data_access.append(pd.DataFrame(new_entries))
+            except Exception:
+                with self._index_lock:
+                    self._discard_index_entries(new_entries)
+                raise
+            with self._index_lock:
+                self._rows_appended(new_entries)
+            self._committed({'op': 'append', 'rows': new_entries})
+            metrics.inc('customer_id_rows_total', len(new_entries), operation='generate')
+            logging.info(f"Generated {len(new_entries)} Customer IDs in batch")
+            return customer_ids
+
+    def _discard_index_entries(self, entries):
+        for entry in entries:
+            self._index_remove(entry['CustomerID'])
+
+    def _index_add(self, record, customer_id):
+        record = normalize_record(record)
+        self.index.add(record, customer_id)
+        self.search_index.add(record, customer_id)
+
+    def _index_remove(self, customer_id):
+        for record in self.index.records(customer_id):
+            self.search_index.remove(record, customer_id)
+        self.index.remove(customer_id)
+
+    def _index_update(self, customer_id, **changes):
+        for record in self.index.records(customer_id):
+            self.search_index.remove(record, customer_id)
+        self.index.update(customer_id, **changes)
+        for record in self.index.records(customer_id):
+            self.search_index.add(record, customer_id)
 
     def _is_customer_id_exists(self, customer_id):
-        return not self.data[self.data['CustomerID'] == customer_id].empty
+        return customer_id in self.index
 
     def _generate_customer_id(self, region, category, company_name, extra_region_code=None, branch_name=None, branch_handling=None, preview=False):
-        existing_record = self.data[
-            (self.data['Region'] == region) &
-            (self.data['Category'] == category) &
-            (self.data['CompanyName'] == company_name) &
-            (self.data['ExtraRegionCode'] == extra_region_code) &
-            (self.data['BranchName'] == branch_name) &
-            (self.data['BranchHandling'] == branch_handling)
-        ]
-
-        if not existing_record.empty:
-            return existing_record['CustomerID'].iloc[0]
-
-        region_codes = {'1北投': '1', '2台南': '2', '3高雄': '3'}
-        category_codes = {
-            '0連鎖或相關企業的合開發票': '0',
-            '1連鎖或相關企業的不合開發票': '1',
-            '2單一客戶': '2',
-            '6機動': '6',
-            '7未定': '7',
-            f"8{os.getenv('DACHING_RELATIONSHIP')}": '8',
-            '9其他': '9'
-        }
-
-        extra_region_codes = {
-            "0無區分": "0", "1本縣市": "1", "2本縣市": "2", "3本縣市": "3",
-            "4本縣市": "4", "5外縣市": "5", "6外縣市": "6", "7外縣市": "7",
-            "8外縣市": "8", "9外縣市": "9"
-        }
-
-        region_code = region_codes.get(region, '0')
-        category_code = category_codes.get(category, '9')
-        region_serial = extra_region_codes.get(extra_region_code, '0')
-
-        if category_code == '0' and branch_handling == '00開立發票客編':
-            company_serial = self._get_company_serial(region, category, company_name, extra_region_code, 3)
-            customer_id = f"{region_code}{category_code}{company_serial}{region_serial}00"
-        elif category_code in ['0', '1', '8']:
-            company_serial = self._get_company_serial(region, category, company_name, extra_region_code, 3)
-            branch_serial = self._get_branch_serial(region, category, company_name, extra_region_code, branch_name)
-            customer_id = f"{region_code}{category_code}{company_serial}{region_serial}{branch_serial}"
-        else:
-            company_serial = self._get_company_serial(region, category, company_name, extra_region_code, 6)
-            customer_id = f"{region_code}{category_code}{company_serial}"
+        existing_customer_id = self.index.find_customer_id(
+            (region, category, company_name, extra_region_code, branch_name, branch_handling))
+        if existing_customer_id is not None:
+            return existing_customer_id
 
-        if preview:
-            return customer_id
-        return customer_id
+        region_code, category_code, region_serial = self.rules.codes(region, category, extra_region_code)
+        layout = self.rules.layout(category_code, branch_handling)
+        company_serial = self._get_company_serial(region, category, company_name, extra_region_code, LAYOUT_SERIAL_LENGTHS[layout])
+        branch_serial = None
+        if layout == BRANCH:
+            branch_serial = self._get_branch_serial(region, category, company_name, extra_region_code, branch_name)
+        return self.rules.compose(layout, region_code, category_code, company_serial, region_serial, branch_serial)
 
     def _get_company_serial(self, region, category, company_name, extra_region_code, length):
-        existing_company = self.data[
-            (self.data['Region'] == region) &
-            (self.data['Category'] == category) &
-            (self.data['CompanyName'] == company_name) &
-            (self.data['ExtraRegionCode'] == extra_region_code)
-        ]
-        if not existing_company.empty:
-            return existing_company['CustomerID'].iloc[0][2:2+length]
-        max_serial = self.data[
-            (self.data['Region'] == region) &
-            (self.data['Category'] == category) &
-            (self.data['ExtraRegionCode'] == extra_region_code)
-        ]['CustomerID'].str[2:2+length].astype(int).max()
-        return f"{(max_serial + 1) if pd.notna(max_serial) else 1:0{length}d}"
+        existing_customer_id = self.index.company_customer_id(region, category, company_name, extra_region_code)
+        if existing_customer_id is not None:
+            return existing_customer_id[2:2+length]
+        max_serial = self.index.max_company_serial(region, category, extra_region_code, length)
+        return f"{(max_serial + 1) if max_serial is not None else 1:0{length}d}"
 
     def _get_branch_serial(self, region, category, company_name, extra_region_code, branch_name):
-        existing_branches = self.data[
-            (self.data['Region'] == region) &
-            (self.data['Category'] == category) &
-            (self.data['CompanyName'] == company_name) &
-            (self.data['ExtraRegionCode'] == extra_region_code)
-        ]
-        if not existing_branches.empty:
-            max_branch_serial = existing_branches['CustomerID'].str[-2:].astype(int).max()
-            return f"{(max_branch_serial + 1) if pd.notna(max_branch_serial) else 1:02d}"
+        if self.index.company_customer_id(region, category, company_name, extra_region_code) is not None:
+            max_branch_serial = self.index.max_branch_serial(region, category, company_name, extra_region_code)
+            return f"{(max_branch_serial + 1) if max_branch_serial is not None else 1:02d}"
         return '00' if not branch_name else '01'
 
-    def query_customer_id(self, company_name, branch_handling=None):
-        result = self.data[self.data['CompanyName'] == company_name]
-        if branch_handling:
-            result = result[result['BranchHandling'] == branch_handling]
-        return result
+    def query_customer_id(self, company_name, branch_handling=None, region=None, category=None, extra_region_code=None,
+                          fields=None, sort_by='CustomerID', descending=False, limit=DEFAULT_QUERY_LIMIT, cursor=None):
+        """回傳 (這一頁的資料, 下一頁的游標, 符合的總筆數)，沒有下一頁時游標為 None。"""
+        fields = query_fields(fields, sort_by)
+        after = decode_cursor(cursor, sort_by, descending) if cursor else None
+        data = self.data
+        with self._stage('filter'):
+            mask = data['CompanyName'] == company_name
+            for column, value in (('BranchHandling', branch_handling), ('Region', region), ('Category', category), ('ExtraRegionCode', extra_region_code)):
+                if value:
+                    mask &= data[column] == value
+            page, next_cursor, total = paginate(data[mask], sort_by, descending, limit, after)
+        return plain_frame(page[fields]), next_cursor, total
 
-    def search_company_name(self, keyword):
-        # Escape the keyword to handle special characters
-        escaped_keyword = re.escape(keyword)
-        result = self.data[self.data['CompanyName'].str.contains(escaped_keyword, case=False, na=False)]
-        result = result['CompanyName'].drop_duplicates()
-        return result
+    def search_company_name(self, keyword, region=None, category=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        with self._index_lock, self._stage('index'):
+            names, _ = self.search_index.search_company_names(keyword, region, category, extra_region_code, limit, offset)
+        return names
 
-    def search_branch_name(self, keyword: str):
-        result = self.data[self.data['BranchName'].str.contains(keyword, case=False, na=False)]
-        return result['BranchName'].unique().tolist()
+    def search_branch_name(self, keyword: str, region=None, category=None, company_name=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        with self._index_lock, self._stage('index'):
+            names, _ = self.search_index.search_branch_names(keyword, region, category, company_name, extra_region_code, limit, offset)
+        return names
+
+    def search_customer_id(self, prefix, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        with self._index_lock, self._stage('index'):
+            customer_ids, _ = self.search_index.search_customer_ids(prefix, limit, offset)
+        return customer_ids
 
     def update_customer_info(self, customer_id, new_company_name=None, new_branch_name=None):
-        if customer_id not in self.data['CustomerID'].values:
-            raise ValueError("客戶ID不存在")
+        self._commit_with_retry(lambda: self._update_customer_info(customer_id, new_company_name, new_branch_name))
+        logging.info(f"Updated Customer ID: {customer_id} with new company name: {new_company_name} and new branch name: {new_branch_name}")
 
-        if new_company_name:
-            self.data.loc[self.data['CustomerID'] == customer_id, 'CompanyName'] = new_company_name
-        if new_branch_name:
-            self.data.loc[self.data['CustomerID'] == customer_id, 'BranchName'] = new_branch_name
+    def _update_customer_info(self, customer_id, new_company_name, new_branch_name):
+        with self._lock.shared():
+            records = self.index.records(customer_id)
+            if not records:
+                raise ValueError("客戶ID不存在")
+            region, category, _, extra_region_code = records[0][:4]
+            changes = {}
+            if new_company_name:
+                changes['CompanyName'] = new_company_name
+            if new_branch_name:
+                changes['BranchName'] = new_branch_name
+            with self._group_lock(region, category, extra_region_code):
+                rows = pd.DataFrame(self.index.records(customer_id), columns=RECORD_COLUMNS).assign(CustomerID=customer_id, **changes)
+                # 先寫入遠端，成功後才更新記憶體
+                self.data_access.upsert(rows)
+                if changes:
+                    with self._index_lock, self._stage('index'):
+                        self._rows_updated({customer_id: changes})
+                        self._index_update(customer_id, **changes)
+                self._committed({'op': 'upsert', 'rows': rows_to_records(rows)})
 
-        self.data_access.save(self.data)
-        logging.info(f"Updated Customer ID: {customer_id} with new company name: {new_company_name} and new branch name: {new_branch_name}")
+    def delete_customer_id(self, customer_id):
+        self._commit_with_retry(lambda: self._delete_customer_id(customer_id))
+        logging.info(f"Deleted Customer ID: {customer_id}")
+
+    def _delete_customer_id(self, customer_id):
+        with self._lock.shared():
+            records = self.index.records(customer_id)
+            if not records:
+                raise ValueError("客戶ID不存在")
+            region, category, _, extra_region_code = records[0][:4]
+            with self._group_lock(region, category, extra_region_code):
+                self.data_access.delete([customer_id])
+                with self._index_lock, self._stage('index'):
+                    self._rows_deleted([customer_id])
+                    self._index_remove(customer_id)
+                self._committed({'op': 'delete', 'customer_ids': [customer_id]})
+
+    def update_customer_info_batch(self, updates):
+        """
+        updates 為含 customer_id / new_company_name / new_branch_name 的 dict；全部只寫入一次。
+        回傳與 updates 順序相同的結果，status 為 updated / unchanged / not_found。
+        """
+        updates = list(updates)
+        results = self._commit_with_retry(lambda: self._update_customer_info_batch(updates))
+        logging.info(f"Updated {sum(result['status'] == 'updated' for result in results)} Customer IDs in batch")
+        return results
+
+    def _update_customer_info_batch(self, updates):
+        with self._lock.exclusive():
+            existing = self.index.existing(update['customer_id'] for update in updates)
+            results = []
+            changes_by_id = {}
+            for update in updates:
+                customer_id = update['customer_id']
+                changes = {}
+                if update.get('new_company_name'):
+                    changes['CompanyName'] = update['new_company_name']
+                if update.get('new_branch_name'):
+                    changes['BranchName'] = update['new_branch_name']
+                if customer_id not in existing:
+                    results.append({'customer_id': customer_id, 'status': 'not_found', 'detail': "客戶ID不存在"})
+                elif not changes:
+                    results.append({'customer_id': customer_id, 'status': 'unchanged', 'detail': "沒有要更新的欄位"})
+                else:
+                    # 同一個客戶ID出現多次時依序合併，後面的值為準
+                    changes_by_id.setdefault(customer_id, {}).update(changes)
+                    results.append({'customer_id': customer_id, 'status': 'updated', 'detail': "客戶信息更新成功"})
+            if not changes_by_id:
+                return results
+
+            records = [
+                {**dict(zip(RECORD_COLUMNS, record)), **changes, 'CustomerID': customer_id}
+                for customer_id, changes in changes_by_id.items()
+                for record in self.index.records(customer_id)
+            ]
+            rows = pd.DataFrame(records, columns=RECORD_COLUMNS + ['CustomerID'])
+            self.data_access.upsert(rows)
+            with self._index_lock, self._stage('index'):
+                self._rows_updated(changes_by_id)
+                for customer_id, changes in changes_by_id.items():
+                    self._index_update(customer_id, **changes)
+            self._committed({'op': 'upsert', 'rows': rows_to_records(rows)})
+            return results
+
+    def delete_customer_ids(self, customer_ids):
+        """刪除多個客戶ID，只寫入一次；回傳與輸入順序相同的結果，status 為 deleted / not_found。"""
+        customer_ids = list(customer_ids)
+        results = self._commit_with_retry(lambda: self._delete_customer_ids(customer_ids))
+        logging.info(f"Deleted {sum(result['status'] == 'deleted' for result in results)} Customer IDs in batch")
+        return results
+
+    def _delete_customer_ids(self, customer_ids):
+        with self._lock.exclusive():
+            existing = self.index.existing(customer_ids)
+            results = [
+                {'customer_id': customer_id, 'status': 'deleted', 'detail': "客戶ID已刪除"} if customer_id in existing
+                else {'customer_id': customer_id, 'status': 'not_found', 'detail': "客戶ID不存在"}
+                for customer_id in customer_ids
+            ]
+            if not existing:
+                return results
+            victims = list(dict.fromkeys(customer_id for customer_id in customer_ids if customer_id in existing))
+            self.data_access.delete(victims)
+            with self._index_lock, self._stage('index'):
+                self._rows_deleted(victims)
+                for customer_id in victims:
+                    self._index_remove(customer_id)
+            self._committed({'op': 'delete', 'customer_ids': victims})
+            return results
+
+    def repair_duplicates(self):
+        """移除完全相同的重複列，每個客戶ID保留一列；欄位不同的重複客戶ID不處理。回傳移除的列數。"""
+        removed = self._commit_with_retry(self._repair_duplicates)
+        logging.info(f"Removed {removed} duplicate rows")
+        return removed
+
+    def _repair_duplicates(self):
+        with self._lock.exclusive():
+            data = self.data
+            extra = exact_duplicates(data)
+            if not extra.any():
+                return 0
+            customer_ids = data.loc[extra, 'CustomerID'].astype(str).unique()
+            kept = data[data['CustomerID'].astype(str).isin(customer_ids) & ~extra]
+            rows = plain_frame(kept).reindex(columns=RECORD_COLUMNS + ['CustomerID'])
+            # 客戶ID重複時 upsert 以這些列取代所有相同客戶ID的列 (與 journal 重播的規則相同)
+            delta = {'op': 'upsert', 'rows': rows_to_records(rows)}
+            self.data_access.upsert(rows)
+            with self._index_lock, self._stage('index'):
+                self._apply_delta(delta)
+            self._committed(delta)
+            return int(extra.sum())
+
+    def import_data(self, df):
+        return self._commit_with_retry(lambda: self._import_data(df))
+
+    def _import_data(self, df):
+        # 已存在的客戶ID以現有資料為準，只附加新的列
+        with self._lock.exclusive():
+            new_rows = df[~df['CustomerID'].isin(self.index.existing(df['CustomerID']))].drop_duplicates(subset=['CustomerID'])
+            if new_rows.empty:
+                return 0
+            new_rows = new_rows.reindex(columns=RECORD_COLUMNS + ['CustomerID'])
+            entries = new_rows.to_dict(orient='records')
+            with self._index_lock:
+                for entry in entries:
+                    self._index_add([entry[column] for column in RECORD_COLUMNS], entry['CustomerID'])
+            try:
+                self.data_access.append(new_rows)
+            except Exception:
+                with self._index_lock:
+                    self._discard_index_entries(entries)
+                raise
+            with self._index_lock:
+                self._rows_appended(entries)
+            self._committed({'op': 'append', 'rows': rows_to_records(new_rows)})
+            metrics.inc('customer_id_rows_total', len(new_rows), operation='import')
+            logging.info(f"Imported {len(new_rows)} customer records")
+            return len(new_rows)
@@ -0,0 +1,170 @@
+import bisect
+import contextlib
+from .compact import column_values, normalize_record
+
+RECORD_COLUMNS = ['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling']
+COMPANY_SERIAL_LENGTHS = (3, 6)
+
+
+def _is_complete(key):
+    # 與 DataFrame 的 == 比較一致：含有空值的欄位永遠不會匹配 (索引內的空值已統一為 None)
+    return None not in key
+
+
+def _parse_serial(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+class _SerialCounter:
+    __slots__ = ('counts', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.max = None
+
+    def add(self, serial):
+        self.counts[serial] = self.counts.get(serial, 0) + 1
+        if self.max is None or serial > self.max:
+            self.max = serial
+
+    def remove(self, serial):
+        count = self.counts.get(serial, 0) - 1
+        if count > 0:
+            self.counts[serial] = count
+            return
+        self.counts.pop(serial, None)
+        if serial == self.max:
+            self.max = max(self.counts) if self.counts else None
+
+
+class CustomerIndex:
+    """記錄、公司與流水號的雜湊索引，讓 CustomerIDGenerator 不必每次掃描整個 DataFrame。"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # 以序號為位置的 (record, customer_id)，刪除的位置留 None；其餘索引只存序號
+        self._rows = []
+        self._ordinals_by_id = {}
+        self._records = {}
+        self._companies = {}
+        self._company_serials = {}
+        self._branch_serials = {}
+
+    def build(self, data):
+        self.clear()
+        columns = [column_values(data[column]) for column in RECORD_COLUMNS]
+        for record, customer_id in zip(zip(*columns), column_values(data['CustomerID'])):
+            self._append(record, customer_id)
+
+    def add(self, record, customer_id):
+        return self._append(normalize_record(record), customer_id)
+
+    def _append(self, record, customer_id):
+        ordinal = len(self._rows)
+        self._rows.append(None)
+        self._ordinals_by_id.setdefault(customer_id, []).append(ordinal)
+        self._insert(ordinal, record, customer_id)
+        return ordinal
+
+    def remove(self, customer_id):
+        for ordinal in self._ordinals_by_id.pop(customer_id, []):
+            self._discard(ordinal)
+
+    def update(self, customer_id, **changes):
+        for ordinal in self._ordinals_by_id.get(customer_id, []):
+            record = dict(zip(RECORD_COLUMNS, self._rows[ordinal][0]))
+            record.update(changes)
+            self._discard(ordinal)
+            self._insert(ordinal, normalize_record(record[column] for column in RECORD_COLUMNS), customer_id)
+
+    def rows(self):
+        return (row for row in self._rows if row is not None)
+
+    def snapshot(self):
+        # 記憶體索引本身就是一致的，不需要額外的交易
+        return contextlib.nullcontext()
+
+    def records(self, customer_id):
+        return [self._rows[ordinal][0] for ordinal in self._ordinals_by_id.get(customer_id, [])]
+
+    def existing(self, customer_ids):
+        return {customer_id for customer_id in customer_ids if customer_id in self._ordinals_by_id}
+
+    def find_customer_id(self, record):
+        ordinals = self._records.get(normalize_record(record))
+        return self._rows[ordinals[0]][1] if ordinals else None
+
+    def company_customer_id(self, region, category, company_name, extra_region_code):
+        ordinals = self._companies.get(normalize_record((region, category, company_name, extra_region_code)))
+        return self._rows[ordinals[0]][1] if ordinals else None
+
+    def max_company_serial(self, region, category, extra_region_code, length):
+        counter = self._company_serials.get(((region, category, extra_region_code), length))
+        return counter.max if counter else None
+
+    def max_branch_serial(self, region, category, company_name, extra_region_code):
+        counter = self._branch_serials.get((region, category, company_name, extra_region_code))
+        return counter.max if counter else None
+
+    def __contains__(self, customer_id):
+        return customer_id in self._ordinals_by_id
+
+    def _keys(self, record):
+        region, category, company_name, extra_region_code = record[:4]
+        return (region, category, company_name, extra_region_code), (region, category, extra_region_code)
+
+    def _insert(self, ordinal, record, customer_id):
+        self._rows[ordinal] = (record, customer_id)
+        company_key, group_key = self._keys(record)
+        text = str(customer_id)
+
+        if _is_complete(record):
+            bisect.insort(self._records.setdefault(record, []), ordinal)
+        if _is_complete(company_key):
+            bisect.insort(self._companies.setdefault(company_key, []), ordinal)
+            branch_serial = _parse_serial(text[-2:])
+            if branch_serial is not None:
+                self._branch_serials.setdefault(company_key, _SerialCounter()).add(branch_serial)
+        if _is_complete(group_key):
+            for length in COMPANY_SERIAL_LENGTHS:
+                company_serial = _parse_serial(text[2:2 + length])
+                if company_serial is not None:
+                    self._company_serials.setdefault((group_key, length), _SerialCounter()).add(company_serial)
+
+    def _discard(self, ordinal):
+        record, customer_id = self._rows[ordinal]
+        self._rows[ordinal] = None
+        company_key, group_key = self._keys(record)
+        text = str(customer_id)
+
+        if _is_complete(record):
+            self._remove_entry(self._records, record, ordinal)
+        if _is_complete(company_key):
+            self._remove_entry(self._companies, company_key, ordinal)
+            branch_serial = _parse_serial(text[-2:])
+            if branch_serial is not None:
+                self._remove_serial(self._branch_serials, company_key, branch_serial)
+        if _is_complete(group_key):
+            for length in COMPANY_SERIAL_LENGTHS:
+                company_serial = _parse_serial(text[2:2 + length])
+                if company_serial is not None:
+                    self._remove_serial(self._company_serials, (group_key, length), company_serial)
+
+    @staticmethod
+    def _remove_entry(mapping, key, ordinal):
+        entries = mapping[key]
+        del entries[bisect.bisect_left(entries, ordinal)]
+        if not entries:
+            del mapping[key]
+
+    @staticmethod
+    def _remove_serial(mapping, key, serial):
+        counter = mapping[key]
+        counter.remove(serial)
+        if counter.max is None:
+            del mapping[key]
@@ -0,0 +1,111 @@
+import logging
+import tempfile
+import pandas as pd
+from monitoring.metrics import metrics
+from data_access.snapshot_format import to_arrow_table, from_arrow_table
+from .rules import BRANCH_NAME_REQUIRED
+
+IMPORT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+IMPORT_COLUMNS = ['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling', 'CustomerID']
+
+
+def iter_excel_chunks(file, chunk_size=IMPORT_CHUNK_SIZE):
+    from openpyxl import load_workbook  # 匯入時才載入，縮短冷啟動
+    # read_only 模式逐列讀取，不會把整個工作表載入記憶體
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell) if cell is not None else '' for cell in next(rows, ())]
+        width = len(header)
+        chunk = []
+        for row in rows:
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            if all(cell is None for cell in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def validate_chunk(chunk, rules):
+    errors = pd.Series([''] * len(chunk), index=chunk.index, dtype=object)
+    checks = [
+        (chunk['CustomerID'] == '', '缺少客戶ID'),
+        (chunk['CompanyName'].isna(), '缺少公司名稱'),
+        (~chunk['Region'].isin(rules.regions), '無效的地區'),
+        (~chunk['Category'].isin(rules.categories), '無效的類別'),
+        # 舊資料允許沒有額外地區代碼，有填時才檢查
+        (chunk['ExtraRegionCode'].notna() & ~chunk['ExtraRegionCode'].isin(rules.extra_region_code_names), '無效的額外地區代碼'),
+        (rules.missing_branch_name(chunk['Category'], chunk['BranchHandling'], chunk['BranchName']), BRANCH_NAME_REQUIRED),
+    ]
+    for mask, message in checks:
+        errors[mask] = errors[mask] + message + ';'
+    return errors.str.rstrip(';')
+
+
+def import_excel_file(generator, file, rules, progress=None, chunk_size=IMPORT_CHUNK_SIZE):
+    import pyarrow as pa  # 匯入時才載入，縮短冷啟動
+    report = {
+        'total_rows': 0,
+        'imported': 0,
+        'skipped_existing': 0,
+        'skipped_duplicate': 0,
+        'error_count': 0,
+        'errors': [],
+    }
+    seen = set()
+    chunks = iter_excel_chunks(file, chunk_size)
+    # 驗證過的新列逐塊寫到本機暫存檔 (Arrow IPC)，記憶體只保留一塊資料；全部驗證完才讀回，整份匯入只寫入一次
+    with tempfile.TemporaryFile(prefix='customer_import_') as spool:
+        writer = None
+        while True:
+            with metrics.stage('parse', 'import'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            start_row = report['total_rows'] + 2  # 第 1 列是標題
+            chunk = chunk.reindex(columns=IMPORT_COLUMNS)
+            chunk['CustomerID'] = chunk['CustomerID'].map(lambda value: '' if pd.isna(value) else str(value).strip())
+            chunk.index = range(start_row, start_row + len(chunk))
+            report['total_rows'] += len(chunk)
+
+            errors = validate_chunk(chunk, rules)
+            invalid = errors != ''
+            report['error_count'] += int(invalid.sum())
+            for row, customer_id, message in zip(chunk.index[invalid], chunk['CustomerID'][invalid], errors[invalid]):
+                if len(report['errors']) >= MAX_REPORTED_ERRORS:
+                    break
+                report['errors'].append({'row': int(row), 'customer_id': customer_id, 'errors': message.split(';')})
+
+            valid = chunk[~invalid]
+            existing = valid['CustomerID'].isin(generator.index.existing(valid['CustomerID']))
+            duplicate = valid['CustomerID'].isin(seen) | valid['CustomerID'].duplicated()
+            report['skipped_existing'] += int(existing.sum())
+            report['skipped_duplicate'] += int((duplicate & ~existing).sum())
+            new_rows = valid[~existing & ~duplicate]
+            seen.update(new_rows['CustomerID'])
+            if not new_rows.empty:
+                table = to_arrow_table(new_rows)
+                if writer is None:
+                    writer = pa.ipc.new_stream(spool, table.schema)
+                writer.write_table(table)
+
+            if progress is not None:
+                progress.update(rows_processed=report['total_rows'], error_count=report['error_count'])
+
+        if writer is not None:
+            writer.close()
+            spool.seek(0)
+            with metrics.stage('parse', 'import'):
+                new_rows = from_arrow_table(pa.ipc.open_stream(spool).read_all())
+            report['imported'] = generator.import_data(new_rows)
+    if progress is not None:
+        progress.update(imported=report['imported'], done=True)
+    logging.info(f"Imported Excel: {report['imported']} new rows out of {report['total_rows']}, {report['error_count']} invalid")
+    return report
@@ -0,0 +1,160 @@
+import os
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+import pandas as pd
+from monitoring.metrics import metrics
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'customer_ids.xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'customer_ids.csv'),
+    'ndjson': ('application/x-ndjson', 'customer_ids.ndjson'),
+}
+
+
+def _iter_records(data, chunk_size=EXPORT_CHUNK_SIZE):
+    for start in range(0, len(data), chunk_size):
+        chunk = data.iloc[start:start + chunk_size].astype(object)
+        yield chunk.where(chunk.notna(), None)
+
+
+def iter_csv(data, chunk_size=EXPORT_CHUNK_SIZE):
+    # 加上 BOM，Excel 開啟 CSV 時才會正確辨識中文
+    yield '\ufeff'.encode('utf-8') + ','.join(data.columns).encode('utf-8') + b'\n'
+    for chunk in _iter_records(data, chunk_size):
+        with metrics.stage('serialize', 'export'):
+            body = chunk.to_csv(index=False, header=False).encode('utf-8')
+        yield body
+
+
+def iter_ndjson(data, chunk_size=EXPORT_CHUNK_SIZE):
+    for chunk in _iter_records(data, chunk_size):
+        with metrics.stage('serialize', 'export'):
+            lines = (json.dumps(record, ensure_ascii=False) for record in chunk.to_dict(orient='records'))
+            body = ('\n'.join(lines) + '\n').encode('utf-8')
+        yield body
+
+
+def write_xlsx(data, path, chunk_size=EXPORT_CHUNK_SIZE):
+    from openpyxl import Workbook  # 匯出時才載入，縮短冷啟動
+    # write_only 模式逐列寫出，記憶體用量不隨資料量成長
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(data.columns))
+    for chunk in _iter_records(data, chunk_size):
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def open_file_stream(path, chunk_size=1024 * 1024):
+    # 先開檔再回傳產生器，之後檔案就算被快取淘汰刪除也能讀完
+    f = open(path, 'rb')
+
+    def blocks():
+        with f:
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    break
+                yield block
+    return blocks()
+
+
+class ExportCache:
+    """依資料版本快取已產生的匯出檔，資料未變更時直接回傳檔案。"""
+
+    def __init__(self, directory=None, max_entries=8):
+        self.directory = directory or tempfile.mkdtemp(prefix='customer_export_')
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            path = self._entries.get(key)
+            if path is None:
+                return None
+            self._entries.move_to_end(key)
+            return path
+
+    def put(self, key, path):
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous != path:
+                remove_file(previous)
+            self._entries[key] = path
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                remove_file(evicted)
+
+    def temp_path(self, suffix):
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        os.close(fd)
+        return path
+
+
+
+def export_stream(data, export_format, cache, cache_key=None):
+    metrics.inc('customer_id_rows_total', len(data), operation='export')
+    if cache_key is not None:
+        path = cache.get(cache_key)
+        if path is not None:
+            try:
+                return open_file_stream(path)
+            except OSError:
+                pass
+
+    if export_format == 'xlsx':
+        # xlsx 是 zip 格式，只能先寫到暫存檔再串流送出
+        path = cache.temp_path('.xlsx')
+        with metrics.stage('serialize', 'export'):
+            write_xlsx(data, path)
+        stream = open_file_stream(path)
+        if cache_key is not None:
+            cache.put(cache_key, path)
+        else:
+            remove_file(path)
+        return stream
+
+    chunks = iter_csv(data) if export_format == 'csv' else iter_ndjson(data)
+    return _tee_to_cache(chunks, cache, cache_key, f".{export_format}") if cache_key is not None else chunks
+
+
+def _tee_to_cache(chunks, cache, cache_key, suffix):
+    # 邊串流邊寫入快取檔，完整送出後才放進快取
+    path = cache.temp_path(suffix)
+    completed = False
+    try:
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        completed = True
+    finally:
+        if completed:
+            cache.put(cache_key, path)
+        else:
+            remove_file(path)
+
+
+def filter_export_data(data, region=None, category=None, extra_region_code=None):
+    mask = pd.Series(True, index=data.index)
+    if region:
+        mask &= data['Region'] == region
+    if category:
+        mask &= data['Category'] == category
+    if extra_region_code:
+        mask &= data['ExtraRegionCode'] == extra_region_code
+    return data if mask.all() else data[mask]
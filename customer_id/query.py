@@ -0,0 +1,84 @@
+import json
+import math
+import base64
+import heapq
+from .compact import is_missing
+from .customer_index import RECORD_COLUMNS
+
+try:
+    import orjson
+except ImportError:  # 沒有安裝 orjson 時使用標準函式庫
+    orjson = None
+
+QUERY_FIELDS = RECORD_COLUMNS + ['CustomerID']
+DEFAULT_QUERY_LIMIT = 100
+MAX_QUERY_LIMIT = 1000
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def query_fields(fields, sort_by):
+    fields = list(fields) if fields else list(QUERY_FIELDS)
+    unknown = [field for field in fields + [sort_by] if field not in QUERY_FIELDS]
+    if unknown:
+        raise ValueError(f"無效的欄位: {', '.join(unknown)}")
+    return fields
+
+
+def sort_key(value, customer_id):
+    # 依 (排序欄位, 客戶ID) 排序，空值視為空字串，與 SQL 的 COALESCE(欄位, '') 一致
+    return '' if is_missing(value) else str(value), str(customer_id)
+
+
+def encode_cursor(sort_by, descending, key):
+    # 游標記錄上一頁最後一筆的排序值 (keyset)，翻頁期間有新增或刪除也不會跳過或重複
+    payload = dumps([sort_by, descending, *key])
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, descending):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort_by, cursor_descending, value, customer_id = json.loads(payload)
+    except (ValueError, TypeError):
+        raise ValueError("無效的分頁游標")
+    if not isinstance(value, str) or not isinstance(customer_id, str):
+        raise ValueError("無效的分頁游標")
+    if cursor_sort_by != sort_by or cursor_descending != descending:
+        raise ValueError("分頁游標與排序條件不符")
+    return value, customer_id
+
+
+def paginate(data, sort_by='CustomerID', descending=False, limit=DEFAULT_QUERY_LIMIT, after=None):
+    """依 (sort_by, CustomerID) 排序後取出 after 之後的一頁，回傳 (這一頁, 下一頁的游標, 總筆數)。"""
+    keys = [sort_key(value, customer_id) for value, customer_id in zip(data[sort_by].tolist(), data['CustomerID'].tolist())]
+    # 只挑出游標之後的前 limit + 1 筆 (多一筆判斷是否還有下一頁)，不必每頁都排序全部符合的列
+    bound = tuple(after) if after else None
+    if descending:
+        candidates = [position for position, key in enumerate(keys) if key < bound] if after else range(len(keys))
+        # 相同排序值時後面的列在前，與整份遞增排序後反轉的順序一致
+        top = heapq.nlargest(limit + 1, candidates, key=lambda position: (keys[position], position))
+    else:
+        candidates = [position for position, key in enumerate(keys) if key > bound] if after else range(len(keys))
+        top = heapq.nsmallest(limit + 1, candidates, key=keys.__getitem__)
+    positions = top[:limit]
+    next_cursor = encode_cursor(sort_by, descending, keys[positions[-1]]) if len(top) > limit and positions else None
+    return data.iloc[positions], next_cursor, len(keys)
+
+
+def _cell(value):
+    # 與原本的 replace(inf) + fillna('') 相同：空值與無限大輸出為空字串
+    if is_missing(value) or (isinstance(value, float) and math.isinf(value)):
+        return ''
+    return value
+
+
+def page_records(page):
+    """由欄位陣列直接組成這一頁的 records，不經過 DataFrame 的 fillna / to_dict。"""
+    fields = list(page.columns)
+    columns = [[_cell(value) for value in page[field].tolist()] for field in fields]
+    return [dict(zip(fields, row)) for row in zip(*columns)]
@@ -0,0 +1,83 @@
+import os
+import pandas as pd
+
+# 客戶ID共 8 碼：地區碼 + 類別碼 + 公司流水號，連鎖類別再加上額外地區碼與分行流水號
+CUSTOMER_ID_LENGTH = 8
+CHAIN_CATEGORY_CODES = ('0', '1', '8')
+INVOICE_BRANCH_HANDLING = '00開立發票客編'
+SERIAL_BRANCH_HANDLING = '以流水號編列此分行'
+BRANCH_NAME_REQUIRED = '對於所選類別和分支處理，分支名稱是必需的。'
+
+# 編碼格式：合開發票的總公司 (分行流水號固定 00)、連鎖企業的分行、單一公司
+INVOICE = 'invoice'
+BRANCH = 'branch'
+COMPANY = 'company'
+LAYOUT_SERIAL_LENGTHS = {INVOICE: 3, BRANCH: 3, COMPANY: 6}
+
+DEFAULT_REGION_CODE = '0'
+DEFAULT_CATEGORY_CODE = '9'
+DEFAULT_REGION_SERIAL = '0'
+
+
+class IDRules:
+    """客戶ID的代碼表與編碼規則，建立一次後由 generator、API 的驗證與稽核共用。"""
+
+    def __init__(self, region_codes: dict, category_codes: dict, extra_region_codes: dict):
+        self.region_codes = dict(region_codes)
+        self.category_codes = dict(category_codes)
+        self.extra_region_codes = dict(extra_region_codes)
+        self.regions = list(self.region_codes)
+        self.categories = list(self.category_codes)
+        self.extra_region_code_names = list(self.extra_region_codes)
+
+    @classmethod
+    def from_env(cls):
+        # 類別 8 的名稱由環境變數 DACHING_RELATIONSHIP 決定，須在 load_dotenv 之後建立
+        return cls(
+            {'1北投': '1', '2台南': '2', '3高雄': '3'},
+            {
+                '0連鎖或相關企業的合開發票': '0',
+                '1連鎖或相關企業的不合開發票': '1',
+                '2單一客戶': '2',
+                '6機動': '6',
+                '7未定': '7',
+                f"8{os.getenv('DACHING_RELATIONSHIP')}": '8',
+                '9其他': '9',
+            },
+            {
+                '0無區分': '0', '1本縣市': '1', '2本縣市': '2', '3本縣市': '3',
+                '4本縣市': '4', '5外縣市': '5', '6外縣市': '6', '7外縣市': '7',
+                '8外縣市': '8', '9外縣市': '9',
+            },
+        )
+
+    def codes(self, region, category, extra_region_code):
+        """回傳 (地區碼, 類別碼, 額外地區碼)，不在代碼表內的值使用預設碼。"""
+        return (
+            self.region_codes.get(region, DEFAULT_REGION_CODE),
+            self.category_codes.get(category, DEFAULT_CATEGORY_CODE),
+            self.extra_region_codes.get(extra_region_code, DEFAULT_REGION_SERIAL),
+        )
+
+    def missing_branch_name(self, category, branch_handling, branch_name):
+        """合開發票類別以流水號編列分行時必須填分行名稱；可傳入單一值，或以 Series 向量化檢查整塊匯入資料。"""
+        if isinstance(branch_name, pd.Series):
+            invoice = category.map(self.category_codes) == '0'
+            return invoice & (branch_handling == SERIAL_BRANCH_HANDLING) & (branch_name.isna() | (branch_name == ''))
+        return self.category_codes.get(category) == '0' and branch_handling == SERIAL_BRANCH_HANDLING and not branch_name
+
+    @staticmethod
+    def layout(category_code, branch_handling):
+        if category_code == '0' and branch_handling == INVOICE_BRANCH_HANDLING:
+            return INVOICE
+        if category_code in CHAIN_CATEGORY_CODES:
+            return BRANCH
+        return COMPANY
+
+    @staticmethod
+    def compose(layout, region_code, category_code, company_serial, region_serial=None, branch_serial=None):
+        if layout == INVOICE:
+            return f"{region_code}{category_code}{company_serial}{region_serial}00"
+        if layout == BRANCH:
+            return f"{region_code}{category_code}{company_serial}{region_serial}{branch_serial}"
+        return f"{region_code}{category_code}{company_serial}"
@@ -0,0 +1,158 @@
+import bisect
+import heapq
+from collections import Counter, defaultdict
+from .compact import is_missing
+
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+
+
+def _grams(text):
+    # 單字與相鄰二字 (bigram)，中文不需斷詞即可做子字串查詢
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class _NameIndex:
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.scopes = {}
+        self.lowered = {}
+
+    def add(self, name, scope):
+        if name not in self.scopes:
+            lowered = name.casefold()
+            self.lowered[name] = lowered
+            self.scopes[name] = Counter()
+            for gram in _grams(lowered):
+                self.postings[gram].add(name)
+        self.scopes[name][scope] += 1
+
+    def remove(self, name, scope):
+        scopes = self.scopes.get(name)
+        if scopes is None:
+            return
+        scopes[scope] -= 1
+        if scopes[scope] <= 0:
+            del scopes[scope]
+        if scopes:
+            return
+        del self.scopes[name]
+        for gram in _grams(self.lowered.pop(name)):
+            names = self.postings[gram]
+            names.discard(name)
+            if not names:
+                del self.postings[gram]
+
+    def search(self, keyword, scope=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        keyword = keyword.casefold()
+        if not keyword:
+            return [], 0
+        grams = [keyword] if len(keyword) == 1 else [keyword[i:i + 2] for i in range(len(keyword) - 1)]
+        postings = sorted((self.postings.get(gram, set()) for gram in set(grams)), key=len)
+        candidates = postings[0].intersection(*postings[1:]) if postings else set()
+
+        matches = [
+            name for name in candidates
+            if keyword in self.lowered[name] and (scope is None or self._in_scope(name, scope))
+        ]
+        # 完全相符 > 開頭相符 > 相符位置越前越好 > 名稱越短越好
+        ranked = heapq.nsmallest(offset + limit, matches, key=lambda name: self._rank(name, keyword))
+        return ranked[offset:], len(matches)
+
+    def _rank(self, name, keyword):
+        lowered = self.lowered[name]
+        position = lowered.find(keyword)
+        return (0 if lowered == keyword else 1 if position == 0 else 2, position, len(name), name)
+
+    def _in_scope(self, name, scope):
+        return any(
+            all(wanted is None or wanted == actual for wanted, actual in zip(scope, key))
+            for key in self.scopes[name]
+        )
+
+
+class _PrefixIndex:
+
+    def __init__(self):
+        self.keys = []
+        self.counts = Counter()
+
+    def build(self, keys):
+        # 整批建立時排序一次，逐筆 insort 在大量資料下是 O(n²)
+        self.counts = Counter(keys)
+        self.keys = sorted(self.counts)
+
+    def add(self, key):
+        if self.counts[key] == 0:
+            bisect.insort(self.keys, key)
+        self.counts[key] += 1
+
+    def remove(self, key):
+        if self.counts[key] <= 0:
+            return
+        self.counts[key] -= 1
+        if self.counts[key] == 0:
+            del self.counts[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def search(self, prefix, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', lo=start)
+        return self.keys[start + offset:min(end, start + offset + limit)], end - start
+
+
+class SearchIndex:
+    """公司名稱、分行名稱與客戶ID的即時查詢索引，隨資料異動同步更新。"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.company_names = _NameIndex()
+        self.branch_names = _NameIndex()
+        self.customer_ids = _PrefixIndex()
+
+    # record 來自 CustomerIndex，空值已統一為 None
+    def build(self, records):
+        self.clear()
+        customer_ids = []
+        for record, customer_id in records:
+            self._add_names(record)
+            if customer_id is not None:
+                customer_ids.append(str(customer_id))
+        self.customer_ids.build(customer_ids)
+
+    def add(self, record, customer_id):
+        self._add_names(record)
+        if not is_missing(customer_id):
+            self.customer_ids.add(str(customer_id))
+
+    def _add_names(self, record):
+        region, category, company_name, extra_region_code, branch_name = record[:5]
+        if company_name is not None:
+            self.company_names.add(str(company_name), (region, category, extra_region_code))
+        if branch_name is not None and branch_name != '':
+            self.branch_names.add(str(branch_name), (region, category, company_name, extra_region_code))
+
+    def remove(self, record, customer_id):
+        region, category, company_name, extra_region_code, branch_name = record[:5]
+        if company_name is not None:
+            self.company_names.remove(str(company_name), (region, category, extra_region_code))
+        if branch_name is not None and branch_name != '':
+            self.branch_names.remove(str(branch_name), (region, category, company_name, extra_region_code))
+        if not is_missing(customer_id):
+            self.customer_ids.remove(str(customer_id))
+
+    def search_company_names(self, keyword, region=None, category=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        scope = None if region is None and category is None and extra_region_code is None else (region, category, extra_region_code)
+        return self.company_names.search(keyword, scope, limit, offset)
+
+    def search_branch_names(self, keyword, region=None, category=None, company_name=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        scope = (region, category, company_name, extra_region_code)
+        if all(value is None for value in scope):
+            scope = None
+        return self.branch_names.search(keyword, scope, limit, offset)
+
+    def search_customer_ids(self, prefix, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        return self.customer_ids.search(prefix, limit, offset)
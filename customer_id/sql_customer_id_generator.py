@@ -0,0 +1,78 @@
+import contextlib
+from monitoring.metrics import metrics
+from .customer_id_generator import CustomerIDGenerator
+from .query import DEFAULT_QUERY_LIMIT, query_fields, decode_cursor, encode_cursor, sort_key
+from .search_index import DEFAULT_SEARCH_LIMIT
+from .sql_index import SQLCustomerIndex, SQLSearchIndex
+
+
+class SQLCustomerIDGenerator(CustomerIDGenerator):
+    """
+    給 DBDataAccess 使用的 CustomerIDGenerator：配發、搜尋與查詢都直接下 SQL，
+    不在記憶體保留整張表，記憶體用量與每次請求的延遲不隨資料量成長。
+    只有匯出等需要整張表的操作才會載入，並快取到資料版本改變為止。
+    """
+
+    def _create_indexes(self):
+        return SQLCustomerIndex(self.data_access), SQLSearchIndex(self.data_access)
+
+    def _initialize_data(self):
+        self._data = None
+        self.revision = self.data_access.get_revision()
+
+    def _materialize(self):
+        if self._data is None:
+            self._data = self.data_access.load()
+            self._pending_rows = []
+
+    def _stage(self, name):
+        # 查詢都在資料庫執行，已由 DBDataAccess 記錄為 db_query
+        return contextlib.nullcontext()
+
+    def _reload(self):
+        # 查詢本來就直接讀資料庫，只需丟掉整表快取
+        with self._lock.exclusive():
+            self.refresh_misses += 1
+            metrics.inc('customer_id_refresh_total', result='miss')
+            self._data = None
+            self.revision = self.data_access.get_revision()
+
+    def _rows_appended(self, entries):
+        self.index.release(entry['CustomerID'] for entry in entries)
+        self._data = None
+
+    def _rows_updated(self, changes_by_id):
+        self._data = None
+
+    def _rows_deleted(self, customer_ids):
+        self._data = None
+
+    def changes_since(self, since):
+        # 變更紀錄就在資料庫裡，各 worker 查到的都一樣
+        return self.data_access.changes(since)
+
+    def query_customer_id(self, company_name, branch_handling=None, region=None, category=None, extra_region_code=None,
+                          fields=None, sort_by='CustomerID', descending=False, limit=DEFAULT_QUERY_LIMIT, cursor=None):
+        fields = query_fields(fields, sort_by)
+        after = decode_cursor(cursor, sort_by, descending) if cursor else None
+        # 多取一筆判斷是否還有下一頁
+        rows, total = self.data_access.query(company_name, branch_handling, region, category, extra_region_code,
+                                             sort_by=sort_by, descending=descending, limit=limit + 1, after=after)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows.iloc[:limit]
+            last = rows.iloc[-1]
+            next_cursor = encode_cursor(sort_by, descending, sort_key(last[sort_by], last['CustomerID']))
+        return rows[fields], next_cursor, total
+
+    def search_company_name(self, keyword, region=None, category=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        names, _ = self.search_index.search_company_names(keyword, region, category, extra_region_code, limit, offset)
+        return names
+
+    def search_branch_name(self, keyword: str, region=None, category=None, company_name=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        names, _ = self.search_index.search_branch_names(keyword, region, category, company_name, extra_region_code, limit, offset)
+        return names
+
+    def search_customer_id(self, prefix, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        customer_ids, _ = self.search_index.search_customer_ids(prefix, limit, offset)
+        return customer_ids
@@ -0,0 +1,100 @@
+from .customer_index import CustomerIndex
+from .search_index import DEFAULT_SEARCH_LIMIT
+
+
+def _max(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+class SQLCustomerIndex:
+    """
+    與 CustomerIndex 相同介面，查詢直接下到 DBDataAccess。
+    已配發但尚未寫入資料庫的客戶ID (例如批次配發途中) 暫存在記憶體的 pending 索引，查詢時一併考慮。
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = CustomerIndex()
+
+    def clear(self):
+        self.pending.clear()
+
+    def build(self, data):
+        self.pending.clear()
+
+    def add(self, record, customer_id):
+        return self.pending.add(record, customer_id)
+
+    def remove(self, customer_id):
+        self.pending.remove(customer_id)
+
+    def update(self, customer_id, **changes):
+        self.pending.update(customer_id, **changes)
+
+    def release(self, customer_ids):
+        # 已寫入資料庫，之後由 SQL 查得到
+        for customer_id in customer_ids:
+            self.pending.remove(customer_id)
+
+    def rows(self):
+        return iter(())
+
+    def snapshot(self):
+        return self.db.snapshot()
+
+    def records(self, customer_id):
+        return self.pending.records(customer_id) or self.db.records(customer_id)
+
+    def existing(self, customer_ids):
+        customer_ids = list(customer_ids)
+        return self.db.existing_customer_ids(customer_ids) | self.pending.existing(customer_ids)
+
+    def find_customer_id(self, record):
+        customer_id = self.db.find_customer_id(record)
+        return customer_id if customer_id is not None else self.pending.find_customer_id(record)
+
+    def company_customer_id(self, region, category, company_name, extra_region_code):
+        customer_id = self.db.company_customer_id(region, category, company_name, extra_region_code)
+        if customer_id is not None:
+            return customer_id
+        return self.pending.company_customer_id(region, category, company_name, extra_region_code)
+
+    def max_company_serial(self, region, category, extra_region_code, length):
+        return _max(self.db.max_company_serial(region, category, extra_region_code, length),
+                    self.pending.max_company_serial(region, category, extra_region_code, length))
+
+    def max_branch_serial(self, region, category, company_name, extra_region_code):
+        return _max(self.db.max_branch_serial(region, category, company_name, extra_region_code),
+                    self.pending.max_branch_serial(region, category, company_name, extra_region_code))
+
+    def __contains__(self, customer_id):
+        return customer_id in self.pending or bool(self.db.existing_customer_ids([customer_id]))
+
+
+class SQLSearchIndex:
+    """與 SearchIndex 相同介面，以 LIKE 查詢資料庫；資料異動不需要維護任何記憶體結構。"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def clear(self):
+        pass
+
+    def build(self, records):
+        pass
+
+    def add(self, record, customer_id):
+        pass
+
+    def remove(self, record, customer_id):
+        pass
+
+    def search_company_names(self, keyword, region=None, category=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        return self.db.search_company_names(keyword, region, category, extra_region_code, limit, offset)
+
+    def search_branch_names(self, keyword, region=None, category=None, company_name=None, extra_region_code=None, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        return self.db.search_branch_names(keyword, region, category, company_name, extra_region_code, limit, offset)
+
+    def search_customer_ids(self, prefix, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        return self.db.search_customer_ids(prefix, limit, offset)
@@ -1,12 +1,32 @@
 from abc import ABC, abstractmethod
 import pandas as pd
 
+CUSTOMER_COLUMNS = ['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling', 'CustomerID']
+
+
+def rows_to_records(rows: pd.DataFrame) -> list:
+    # NaN 轉成 None，才能序列化成 JSON 或寫入資料庫的 NULL
+    rows = rows.astype(object)
+    return rows.where(rows.notna(), None).to_dict(orient='records')
+
+
+class ConflictError(Exception):
+    """遠端資料已被其他程序修改，本次寫入未套用；呼叫端應重新載入後重試。"""
+
+
 class DataAccess(ABC):
 
+    # 最近一次 load 或本程序寫入後的遠端版本；None 表示未知，下次 refresh 必須重新載入
+    revision = None
+
     @abstractmethod
     def file_exists(self) -> bool:
         pass
 
+    @abstractmethod
+    def get_revision(self):
+        pass
+
     @abstractmethod
     def save(self, data: pd.DataFrame) -> None:
         pass
@@ -14,3 +34,25 @@ class DataAccess(ABC):
     @abstractmethod
     def load(self) -> pd.DataFrame:
         pass
+
+    @abstractmethod
+    def append(self, rows: pd.DataFrame) -> None:
+        pass
+
+    @abstractmethod
+    def upsert(self, rows: pd.DataFrame) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, customer_ids: list) -> None:
+        pass
+
+    # 變更紀錄：回傳版本 since 之後的 [(版本, delta), ...]，delta 與 journal 的格式相同
+    # ({'op': 'append' / 'upsert', 'rows': [...]} 或 {'op': 'delete', 'customer_ids': [...]})。
+    # 不支援或中間有缺漏 (例如已壓縮或整表覆寫) 時回傳 None，呼叫端改為整表載入
+    def changes(self, since):
+        return None
+
+    # 與 changes 相同，但從本物件上次 load 或寫入的版本開始，讀完後如同 load 一樣推進 revision
+    def load_changes(self):
+        return None
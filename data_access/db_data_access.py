@@ -1,16 +1,52 @@
+import json
 import pandas as pd
 import logging
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event, create_engine, inspect, select, func, and_, or_, case, cast, distinct, MetaData, Table, Column, Index, String, Integer, Text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
-from .data_access import DataAccess
+from .data_access import DataAccess, ConflictError, CUSTOMER_COLUMNS, rows_to_records
+from monitoring.metrics import metrics
+
+RECORD_COLUMNS = CUSTOMER_COLUMNS[:-1]
+IN_CHUNK_SIZE = 500
+# 變更紀錄保留最近幾個版本，更舊的版本只能整表載入
+CHANGE_LOG_RETENTION = 1000
+
+
+def _like_pattern(text, anywhere=True):
+    # 跳脫 LIKE 的萬用字元；anywhere=False 時只比對開頭
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%" if anywhere else f"{escaped}%"
+
+
+def _disable_pysqlite_transaction(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _emit_begin(conn):
+    conn.exec_driver_sql('BEGIN')
+
 
 class DBDataAccess(DataAccess):
 
-    def __init__(self, db_url):
-        self.engine = create_engine(db_url)
+    def __init__(self, db_url, pool_size=5, max_overflow=10, pool_recycle=1800):
+        engine_options = {'pool_pre_ping': True}
+        if make_url(db_url).get_backend_name() != 'sqlite':
+            # SQLite 使用 SQLAlchemy 預設的連線池，不接受這些參數
+            engine_options.update(pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle)
+        self.engine = create_engine(db_url, **engine_options)
+        if make_url(db_url).get_backend_name() == 'sqlite':
+            # pysqlite 只在寫入時才真正開始交易，改由 SQLAlchemy 自己送 BEGIN，讓 snapshot 內的查詢讀到一致的資料
+            event.listen(self.engine, 'connect', _disable_pysqlite_transaction)
+            event.listen(self.engine, 'begin', _emit_begin)
+        self._local = threading.local()
         self.Session = sessionmaker(bind=self.engine)
         self.session = self.Session()
         self.metadata = MetaData()
+        self.revision = None
         self.customers_table = Table('customers', self.metadata,
                                      Column('Region', String),
                                      Column('Category', String),
@@ -18,24 +54,302 @@ class DBDataAccess(DataAccess):
                                      Column('ExtraRegionCode', String, nullable=True),
                                      Column('BranchName', String, nullable=True),
                                      Column('BranchHandling', String, nullable=True),
-                                     Column('CustomerID', String, primary_key=True))
-        if not self.engine.dialect.has_table(self.engine, 'customers'):
-            self.metadata.create_all(self.engine)
+                                     Column('CustomerID', String, primary_key=True),
+                                     # 流水號配發依群組與公司查詢 (含 CustomerID，取最大流水號時不必回表)，查詢客戶ID依公司名稱與分行處理方式
+                                     Index('ix_customers_group_company', 'Region', 'Category', 'ExtraRegionCode', 'CompanyName', 'CustomerID'),
+                                     Index('ix_customers_company_branch_handling', 'CompanyName', 'BranchHandling'))
+        # 每次寫入都遞增的版本號，讓 refresh 只需查一個整數
+        self.version_table = Table('customers_version', self.metadata,
+                                   Column('id', Integer, primary_key=True),
+                                   Column('version', Integer, nullable=False))
+        # 每個版本的 delta，與版本號在同一個交易內寫入
+        self.changes_table = Table('customers_changes', self.metadata,
+                                   Column('version', Integer, primary_key=True),
+                                   Column('delta', Text, nullable=False))
+        self.metadata.create_all(self.engine)
+        # create_all 不會替既有的資料表補建索引
+        for index in self.customers_table.indexes:
+            index.create(self.engine, checkfirst=True)
+        self._ensure_unique_customer_id()
+        with self.engine.begin() as conn:
+            if conn.execute(select(self.version_table.c.version)).first() is None:
+                conn.execute(self.version_table.insert().values(id=1, version=0))
+
+    def _ensure_unique_customer_id(self):
+        # 舊版以 to_sql(if_exists='replace') 建立的資料表沒有主鍵，補上唯一索引，重複配發才會觸發 IntegrityError
+        inspector = inspect(self.engine)
+        if inspector.get_pk_constraint('customers').get('constrained_columns') == ['CustomerID']:
+            return
+        unique = [index['column_names'] for index in inspector.get_indexes('customers') if index.get('unique')]
+        unique += [constraint['column_names'] for constraint in inspector.get_unique_constraints('customers')]
+        if ['CustomerID'] in unique:
+            return
+        table = self.customers_table
+        with self.engine.connect() as conn:
+            duplicates = conn.execute(
+                select(table.c.CustomerID).group_by(table.c.CustomerID).having(func.count() > 1).limit(20)).scalars().all()
+        if duplicates:
+            raise RuntimeError(f"customers table has duplicate CustomerID values, deduplicate before upgrading: {duplicates}")
+        logging.info("Creating unique index on customers.CustomerID")
+        Index('ux_customers_customer_id', table.c.CustomerID, unique=True).create(self.engine)
 
     def file_exists(self) -> bool:
-        return self.engine.dialect.has_table(self.engine, 'customers')
+        return inspect(self.engine).has_table('customers')
+
+    def get_revision(self):
+        try:
+            with metrics.stage('db_query', 'database'), self.engine.connect() as conn:
+                # SQL generator 不會 load 整張表，版本號在這裡記下，之後的寫入才能接續版本
+                self.revision = self._read_version(conn)
+                return self.revision
+        except Exception as e:
+            self.revision = None
+            logging.error(f"Error reading database revision: {e}")
+            return None
 
     def save(self, data: pd.DataFrame) -> None:
         try:
-            data.to_sql('customers', self.engine, if_exists='replace', index=False)
+            # 以 delete + insert 取代 to_sql replace，保留 CustomerID 主鍵約束
+            records = rows_to_records(data.reindex(columns=CUSTOMER_COLUMNS))
+            with metrics.stage('db_write', 'database'), self.engine.begin() as conn:
+                conn.execute(self.customers_table.delete())
+                if records:
+                    conn.execute(self.customers_table.insert(), records)
+                self.revision = self._bump_version(conn, {'op': 'save'})
         except Exception as e:
+            self.revision = None
             logging.error(f"Error saving to database: {e}")
 
     def load(self) -> pd.DataFrame:
         try:
-            data = pd.read_sql_table('customers', self.engine)
+            with metrics.stage('db_query', 'database'), self.engine.begin() as conn:
+                data = pd.read_sql_table('customers', conn)
+                self.revision = self._read_version(conn)
             data['CustomerID'] = data['CustomerID'].astype(str)
+            metrics.inc('customer_id_rows_total', len(data), operation='load')
             return data
         except Exception as e:
+            self.revision = None
             logging.error(f"Error loading from database: {e}")
-            return pd.DataFrame(columns=['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling', 'CustomerID'])
+            return pd.DataFrame(columns=CUSTOMER_COLUMNS)
+
+    def append(self, rows: pd.DataFrame) -> None:
+        try:
+            records = rows_to_records(rows)
+            metrics.inc('customer_id_rows_total', len(records), operation='append')
+            if records:
+                with metrics.stage('db_write', 'database'), self.engine.begin() as conn:
+                    conn.execute(self.customers_table.insert(), records)
+                    self.revision = self._bump_version(conn, {'op': 'append', 'rows': records})
+        except IntegrityError as e:
+            # 主鍵衝突：客戶ID已被其他程序配發，整批交易已回滾
+            self.revision = None
+            raise ConflictError(f"CustomerID already exists in database: {e.orig}") from e
+        except Exception as e:
+            self.revision = None
+            logging.error(f"Error appending to database: {e}")
+            raise
+
+    def upsert(self, rows: pd.DataFrame) -> None:
+        try:
+            table = self.customers_table
+            metrics.inc('customer_id_rows_total', len(rows), operation='upsert')
+            with metrics.stage('db_write', 'database'), self.engine.begin() as conn:
+                records = rows_to_records(rows)
+                for record in records:
+                    result = conn.execute(
+                        table.update().where(table.c.CustomerID == record['CustomerID']).values(**record))
+                    if result.rowcount == 0:
+                        conn.execute(table.insert(), record)
+                self.revision = self._bump_version(conn, {'op': 'upsert', 'rows': records})
+        except Exception as e:
+            self.revision = None
+            logging.error(f"Error upserting to database: {e}")
+            raise
+
+    def delete(self, customer_ids: list) -> None:
+        try:
+            table = self.customers_table
+            metrics.inc('customer_id_rows_total', len(customer_ids), operation='delete')
+            with metrics.stage('db_write', 'database'), self.engine.begin() as conn:
+                customer_ids = list(customer_ids)
+                for start in range(0, len(customer_ids), IN_CHUNK_SIZE):
+                    conn.execute(table.delete().where(table.c.CustomerID.in_(customer_ids[start:start + IN_CHUNK_SIZE])))
+                self.revision = self._bump_version(conn, {'op': 'delete', 'customer_ids': customer_ids})
+        except Exception as e:
+            self.revision = None
+            logging.error(f"Error deleting from database: {e}")
+            raise
+
+    def _read_version(self, conn):
+        return conn.execute(select(self.version_table.c.version)).scalar()
+
+    def _bump_version(self, conn, delta):
+        previous = self.revision
+        conn.execute(self.version_table.update().values(version=self.version_table.c.version + 1))
+        version = self._read_version(conn)
+        changes = self.changes_table
+        conn.execute(changes.insert().values(version=version, delta=json.dumps(delta, ensure_ascii=False)))
+        conn.execute(changes.delete().where(changes.c.version <= version - CHANGE_LOG_RETENTION))
+        # 若中間有其他程序寫入，我們的記憶體資料已過期，保留 None 讓下次 refresh 重新載入
+        return version if previous is not None and version == previous + 1 else None
+
+    def changes(self, since):
+        try:
+            since = int(since)
+            with metrics.stage('db_query', 'database'), self.engine.begin() as conn:
+                current = self._read_version(conn)
+                changes = self.changes_table
+                rows = conn.execute(
+                    select(changes.c.version, changes.c.delta).where(changes.c.version > since).order_by(changes.c.version)).all()
+        except (TypeError, ValueError):
+            return None
+        except Exception as e:
+            logging.error(f"Error reading changes from database: {e}")
+            return None
+        # since 之後的每個版本都要還在紀錄內，且中間沒有整表覆寫
+        if [version for version, _ in rows] != list(range(since + 1, current + 1)):
+            return None
+        entries = [(version, json.loads(delta)) for version, delta in rows]
+        if any(delta['op'] == 'save' for _, delta in entries):
+            return None
+        return entries
+
+    # 以下查詢讓 SQLCustomerIDGenerator 直接在資料庫上配發與搜尋，不必把整張表載入記憶體。
+    # 與 DataFrame 的 == 比較一致，任何鍵值為空 (None / NaN) 時都不會匹配。
+
+    def find_customer_id(self, record):
+        return self._first_customer_id(dict(zip(RECORD_COLUMNS, record)))
+
+    def company_customer_id(self, region, category, company_name, extra_region_code):
+        return self._first_customer_id({'Region': region, 'Category': category, 'CompanyName': company_name, 'ExtraRegionCode': extra_region_code})
+
+    def max_company_serial(self, region, category, extra_region_code, length):
+        table = self.customers_table
+        serial = cast(func.substr(table.c.CustomerID, 3, length), Integer)
+        return self._max({'Region': region, 'Category': category, 'ExtraRegionCode': extra_region_code}, serial)
+
+    def max_branch_serial(self, region, category, company_name, extra_region_code):
+        customer_id = self.customers_table.c.CustomerID
+        serial = cast(func.substr(customer_id, func.length(customer_id) - 1, 2), Integer)
+        return self._max({'Region': region, 'Category': category, 'CompanyName': company_name, 'ExtraRegionCode': extra_region_code}, serial)
+
+    def records(self, customer_id):
+        table = self.customers_table
+        query = select(*[table.c[column] for column in RECORD_COLUMNS]).where(table.c.CustomerID == customer_id)
+        with self._connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def existing_customer_ids(self, customer_ids):
+        table = self.customers_table
+        customer_ids = list(dict.fromkeys(str(customer_id) for customer_id in customer_ids))
+        existing = set()
+        with self._connect() as conn:
+            for start in range(0, len(customer_ids), IN_CHUNK_SIZE):
+                chunk = customer_ids[start:start + IN_CHUNK_SIZE]
+                existing.update(conn.execute(select(table.c.CustomerID).where(table.c.CustomerID.in_(chunk))).scalars())
+        return existing
+
+    def query(self, company_name, branch_handling=None, region=None, category=None, extra_region_code=None,
+              sort_by='CustomerID', descending=False, limit=None, after=None):
+        # 依 (sort_by, CustomerID) 排序，after 為上一頁最後一筆的排序值；回傳 (資料, 符合的總筆數)
+        table = self.customers_table
+        conditions = [table.c.CompanyName == company_name]
+        for column, value in (('BranchHandling', branch_handling), ('Region', region), ('Category', category), ('ExtraRegionCode', extra_region_code)):
+            if value:
+                conditions.append(table.c[column] == value)
+        sort_column = func.coalesce(table.c[sort_by], '')
+        order = [sort_column.desc(), table.c.CustomerID.desc()] if descending else [sort_column, table.c.CustomerID]
+        query = select(table).where(*conditions).order_by(*order)
+        if after is not None:
+            value, customer_id = after
+            if descending:
+                query = query.where(or_(sort_column < value, and_(sort_column == value, table.c.CustomerID < customer_id)))
+            else:
+                query = query.where(or_(sort_column > value, and_(sort_column == value, table.c.CustomerID > customer_id)))
+        if limit is not None:
+            query = query.limit(limit)
+        with self._connect() as conn:
+            rows = pd.read_sql(query, conn).reindex(columns=CUSTOMER_COLUMNS)
+            total = conn.execute(select(func.count()).select_from(table).where(*conditions)).scalar()
+        return rows, total
+
+    def search_company_names(self, keyword, region=None, category=None, extra_region_code=None, limit=50, offset=0):
+        table = self.customers_table
+        scope = [table.c[column] == value for column, value in
+                 (('Region', region), ('Category', category), ('ExtraRegionCode', extra_region_code)) if value is not None]
+        return self._search_names(table.c.CompanyName, keyword, scope, limit, offset)
+
+    def search_branch_names(self, keyword, region=None, category=None, company_name=None, extra_region_code=None, limit=50, offset=0):
+        table = self.customers_table
+        scope = [table.c[column] == value for column, value in
+                 (('Region', region), ('Category', category), ('CompanyName', company_name), ('ExtraRegionCode', extra_region_code)) if value is not None]
+        return self._search_names(table.c.BranchName, keyword, scope + [table.c.BranchName != ''], limit, offset)
+
+    def search_customer_ids(self, prefix, limit=50, offset=0):
+        customer_id = self.customers_table.c.CustomerID
+        condition = customer_id.like(_like_pattern(prefix, anywhere=False), escape='\\')
+        with self._connect() as conn:
+            ids = conn.execute(select(customer_id).where(condition).order_by(customer_id).limit(limit).offset(offset)).scalars().all()
+            total = conn.execute(select(func.count()).where(condition)).scalar()
+        return ids, total
+
+    @contextmanager
+    def snapshot(self):
+        # 區塊內同一執行緒的查詢共用一個唯讀交易，看到同一時間點的資料 (例如算出流水號後再確認是否已存在)
+        if getattr(self._local, 'conn', None) is not None:
+            yield
+            return
+        with self.engine.connect() as conn:
+            if self.engine.dialect.name != 'sqlite':
+                conn = conn.execution_options(isolation_level='REPEATABLE READ')
+            with conn.begin():
+                self._local.conn = conn
+                try:
+                    yield
+                finally:
+                    self._local.conn = None
+
+    @contextmanager
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        with metrics.stage('db_query', 'database'):
+            if conn is not None:
+                yield conn
+                return
+            with self.engine.connect() as conn:
+                yield conn
+
+    def _key_conditions(self, values):
+        if any(pd.isna(value) for value in values.values()):
+            return None
+        return [self.customers_table.c[column] == value for column, value in values.items()]
+
+    def _first_customer_id(self, values):
+        conditions = self._key_conditions(values)
+        if conditions is None:
+            return None
+        customer_id = self.customers_table.c.CustomerID
+        with self._connect() as conn:
+            return conn.execute(select(customer_id).where(*conditions).order_by(customer_id).limit(1)).scalar()
+
+    def _max(self, values, expression):
+        conditions = self._key_conditions(values)
+        if conditions is None:
+            return None
+        with self._connect() as conn:
+            return conn.execute(select(func.max(expression)).where(*conditions)).scalar()
+
+    def _search_names(self, column, keyword, conditions, limit, offset):
+        keyword = keyword.lower()
+        if not keyword:
+            return [], 0
+        lowered = func.lower(column)
+        conditions = conditions + [lowered.like(_like_pattern(keyword), escape='\\')]
+        # 完全相符 > 開頭相符 > 名稱越短越好
+        rank = case((lowered == keyword, 0), (lowered.like(_like_pattern(keyword, anywhere=False), escape='\\'), 1), else_=2)
+        query = select(column).where(*conditions).group_by(column).order_by(rank, func.length(column), column).limit(limit).offset(offset)
+        with self._connect() as conn:
+            names = conn.execute(query).scalars().all()
+            total = conn.execute(select(func.count(distinct(column))).where(*conditions)).scalar()
+        return names, total
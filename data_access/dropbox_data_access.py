@@ -1,41 +1,58 @@
-import pandas as pd
 import logging
 import dropbox
-from .data_access import DataAccess
-import io
+from .data_access import ConflictError
+from .journal_data_access import JournalDataAccess
 
-class DropboxDataAccess(DataAccess):
+class DropboxDataAccess(JournalDataAccess):
 
-    def __init__(self, access_token, directory, file_name):
-        self.dbx = dropbox.Dropbox(access_token)
+    storage_name = 'Dropbox'
+
+    def __init__(self, access_token, directory, file_name, snapshot_format='xlsx', cache_dir=None, client=None):
+        # 分片共用同一個 client (與其 HTTP session)；未提供時自行建立
+        self.dbx = client if client is not None else dropbox.Dropbox(access_token)
         self.directory = directory
         self.file_name = file_name
-        self.file_path = f"{self.directory}/{self.file_name}"
+        super().__init__(f"{self.directory}/{self.file_name}", snapshot_format, cache_dir)
 
-    def file_exists(self) -> bool:
+    def _exists(self, path: str) -> bool:
         try:
-            self.dbx.files_get_metadata(self.file_path)
+            self.dbx.files_get_metadata(path)
             return True
         except dropbox.exceptions.ApiError as e:
             logging.error(f"Error checking if file exists in Dropbox: {e}")
             return False
 
-    def save(self, data: pd.DataFrame) -> None:
+    def _head(self, path: str) -> str:
+        return self.dbx.files_get_metadata(path).rev
+
+    def _download(self, path: str) -> tuple:
+        metadata, res = self.dbx.files_download(path=path)
+        return res.content, metadata.rev
+
+    def _upload(self, path: str, body: bytes, overwrite: bool = True, expected_rev: str = None) -> str:
+        if expected_rev is not None:
+            mode = dropbox.files.WriteMode.update(expected_rev)
+        else:
+            mode = dropbox.files.WriteMode('overwrite') if overwrite else dropbox.files.WriteMode('add')
         try:
-            with io.BytesIO() as output:
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    data.to_excel(writer, index=False)
-                output.seek(0)
-                self.dbx.files_upload(output.read(), self.file_path, mode=dropbox.files.WriteMode('overwrite'))
-        except Exception as e:
-            logging.error(f"Error saving to Dropbox: {e}")
-
-    def load(self) -> pd.DataFrame:
+            return self.dbx.files_upload(body, path, mode=mode).rev
+        except dropbox.exceptions.ApiError as e:
+            if e.error.is_path() and e.error.get_path().reason.is_conflict():
+                raise ConflictError(f"Dropbox file {path} was modified by another writer") from e
+            raise
+
+    def _list(self, folder: str) -> list:
         try:
-            metadata, res = self.dbx.files_download(path=self.file_path)
-            data = pd.read_excel(io.BytesIO(res.content), engine='openpyxl')
-            data['CustomerID'] = data['CustomerID'].astype(str)
-            return data
-        except Exception as e:
-            logging.error(f"Error loading from Dropbox: {e}")
-            return pd.DataFrame(columns=['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling', 'CustomerID'])
+            result = self.dbx.files_list_folder(folder)
+        except dropbox.exceptions.ApiError:
+            # journal 資料夾尚未建立
+            return []
+        names = [entry.name for entry in result.entries]
+        while result.has_more:
+            result = self.dbx.files_list_folder_continue(result.cursor)
+            names.extend(entry.name for entry in result.entries)
+        return names
+
+    def _delete(self, paths: list) -> None:
+        for path in paths:
+            self.dbx.files_delete_v2(path)
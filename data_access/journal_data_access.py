@@ -0,0 +1,432 @@
+import json
+import logging
+import threading
+from abc import abstractmethod
+import pandas as pd
+from .data_access import DataAccess, ConflictError, CUSTOMER_COLUMNS, rows_to_records
+from .snapshot_format import snapshot_path, serialize_snapshot, deserialize_snapshot
+from .snapshot_cache import SnapshotCache
+from monitoring.metrics import metrics
+
+
+def apply_delta(data: pd.DataFrame, delta: dict) -> pd.DataFrame:
+    op = delta['op']
+    if op == 'seal':
+        return data
+    if op == 'delete':
+        return data[~data['CustomerID'].isin(delta['customer_ids'])].reset_index(drop=True)
+
+    rows = pd.DataFrame(delta['rows'], columns=CUSTOMER_COLUMNS)
+    rows['CustomerID'] = rows['CustomerID'].astype(str)
+    if op == 'append':
+        # 已存在的客戶ID不重複附加，重播 journal 時才不會產生重複列
+        return pd.concat([data, rows[~rows['CustomerID'].isin(data['CustomerID'])]], ignore_index=True)
+    if op == 'upsert':
+        if not data['CustomerID'].is_unique or not rows['CustomerID'].is_unique:
+            # 舊資料有重複的客戶ID時無法逐列對應，rows 取代所有相同客戶ID的列
+            return pd.concat([data[~data['CustomerID'].isin(rows['CustomerID'])], rows], ignore_index=True)
+        data = data.copy()
+        positions = pd.Index(data['CustomerID']).get_indexer(rows['CustomerID'])
+        existing = positions >= 0
+        if existing.any():
+            data.iloc[positions[existing], [data.columns.get_loc(c) for c in CUSTOMER_COLUMNS]] = rows[existing][CUSTOMER_COLUMNS].values
+        return pd.concat([data, rows[~existing]], ignore_index=True)
+    raise ValueError(f"Unknown journal operation: {op}")
+
+
+def _mergeable(first: dict, delta: dict) -> bool:
+    # 新增與刪除可以直接串接；修改同一個客戶ID兩次會被當成重複列，所以修改各自寫出
+    return first['op'] == delta['op'] and first['op'] in ('append', 'delete')
+
+
+def _merge_deltas(deltas: list) -> dict:
+    if len(deltas) == 1:
+        return deltas[0]
+    key = 'customer_ids' if deltas[0]['op'] == 'delete' else 'rows'
+    return {'op': deltas[0]['op'], key: [item for delta in deltas for item in delta[key]]}
+
+
+class JournalDataAccess(DataAccess):
+    """
+    給 Dropbox / S3 這類只能整檔上傳的儲存使用：
+    每次異動只上傳一個小的 delta 檔到 journal，累積到 compact_threshold 筆後才重寫整份快照。
+    journal 依快照版本分代存放，delta 以「不存在才建立」的方式寫入，快照以版本條件覆寫，
+    多個程序同時寫入時後到者會收到 ConflictError，重新載入後再重試。
+    子類別只需要提供 _exists / _head / _download / _upload / _list / _delete 這幾個物件層級的操作。
+    """
+
+    storage_name = 'storage'
+    compact_threshold = 50
+    load_retries = 3
+
+    def __init__(self, file_path, snapshot_format='xlsx', cache_dir=None):
+        self.file_path = file_path
+        self.snapshot_format = snapshot_format
+        self.snapshot_path = snapshot_path(file_path, snapshot_format)
+        self.journal_path = f"{self.snapshot_path}.journal"
+        self.cache = SnapshotCache(cache_dir, self.snapshot_path) if cache_dir else None
+        self._journal_names = []
+        self._snapshot_rev = None
+        self._sealed = False
+        self._stale = False
+        self._lock = threading.RLock()
+        # 群組提交：排隊中的 delta，與是否有執行緒正在上傳
+        self._written = threading.Condition(self._lock)
+        self._queue = []
+        self._writing = False
+        self.revision = None
+
+    @abstractmethod
+    def _exists(self, path: str) -> bool:
+        pass
+
+    # 回傳物件目前的版本 (Dropbox rev / S3 ETag)
+    @abstractmethod
+    def _head(self, path: str) -> str:
+        pass
+
+    # 回傳 (內容, 版本)
+    @abstractmethod
+    def _download(self, path: str) -> tuple:
+        pass
+
+    # 回傳寫入後的版本。overwrite=False 時只在物件不存在時建立，
+    # 指定 expected_rev 時只在遠端版本相符時覆寫；條件不成立時丟出 ConflictError
+    @abstractmethod
+    def _upload(self, path: str, body: bytes, overwrite: bool = True, expected_rev: str = None) -> str:
+        pass
+
+    # 回傳資料夾內的檔名，資料夾不存在時回傳空清單
+    @abstractmethod
+    def _list(self, folder: str) -> list:
+        pass
+
+    @abstractmethod
+    def _delete(self, paths: list) -> None:
+        pass
+
+    def _fetch(self, path: str) -> tuple:
+        with metrics.stage('remote_fetch', self.storage_name):
+            content, revision = self._download(path)
+        metrics.transferred(self.storage_name, 'download', len(content))
+        return content, revision
+
+    def _store(self, path: str, body: bytes, overwrite: bool = True, expected_rev: str = None) -> str:
+        with metrics.stage('upload', self.storage_name):
+            revision = self._upload(path, body, overwrite, expected_rev)
+        metrics.transferred(self.storage_name, 'upload', len(body))
+        return revision
+
+    def _serialize(self, data: pd.DataFrame) -> bytes:
+        with metrics.stage('serialize', self.storage_name):
+            return serialize_snapshot(data, self.snapshot_format)
+
+    def _deserialize(self, content: bytes, snapshot_format: str) -> pd.DataFrame:
+        with metrics.stage('parse', self.storage_name):
+            return deserialize_snapshot(content, snapshot_format)
+
+    def file_exists(self) -> bool:
+        if self._exists(self.snapshot_path):
+            return True
+        # 從 xlsx 切換到欄式格式時，舊的 xlsx 仍視為既有資料
+        return self.snapshot_path != self.file_path and self._exists(self.file_path)
+
+    def get_revision(self):
+        try:
+            with metrics.stage('remote_fetch', self.storage_name):
+                snapshot_rev = self._head(self.snapshot_path)
+                return self._compose_revision(snapshot_rev, sorted(self._list(self._journal_folder(snapshot_rev))))
+        except Exception as e:
+            logging.error(f"Error reading revision from {self.storage_name}: {e}")
+            return None
+
+    def save(self, data: pd.DataFrame) -> None:
+        with self._lock:
+            self._wait_for_writes()
+            try:
+                self._write_snapshot(data)
+            except Exception as e:
+                self.revision = None
+                logging.error(f"Error saving to {self.storage_name}: {e}")
+
+    def load(self) -> pd.DataFrame:
+        with self._lock:
+            self._wait_for_writes()
+            data = self._load_latest()
+            # 呼叫端拿到的資料與本物件的版本一致後才允許寫入
+            self._stale = self.revision is None
+            metrics.inc('customer_id_rows_total', len(data), operation='load')
+            return data
+
+    def _load_latest(self) -> pd.DataFrame:
+        for attempt in range(self.load_retries):
+            try:
+                return self._load()
+            except Exception as e:
+                self.revision = None
+                if attempt + 1 < self.load_retries and self._snapshot_changed():
+                    # 讀取途中其他程序完成壓縮並清掉舊一代 journal，改讀新的快照
+                    continue
+                logging.error(f"Error loading from {self.storage_name}: {e}")
+                return pd.DataFrame(columns=CUSTOMER_COLUMNS)
+
+    def _load(self) -> pd.DataFrame:
+        data, self._snapshot_rev = self._read_snapshot()
+        # 改為分代目錄之前寫入的 journal，下次壓縮後就會清掉
+        with metrics.stage('remote_fetch', self.storage_name):
+            legacy_names = sorted(name for name in self._list(self.journal_path) if '/' not in name and name.endswith('.json'))
+        for name in legacy_names:
+            content, _ = self._fetch(f"{self.journal_path}/{name}")
+            data = apply_delta(data, json.loads(content))
+        folder = self._journal_folder(self._snapshot_rev)
+        with metrics.stage('remote_fetch', self.storage_name):
+            names = sorted(self._list(folder))
+        self._sealed = False
+        for name in names:
+            content, _ = self._fetch(f"{folder}/{name}")
+            delta = json.loads(content)
+            data = apply_delta(data, delta)
+            self._sealed = delta['op'] == 'seal'
+        self._journal_names = names
+        self.revision = self._compose_revision(self._snapshot_rev, names)
+        return data
+
+    def changes(self, since):
+        """回傳 since 之後的 [(版本, delta), ...]；since 已被壓縮進新的快照或無法辨識時回傳 None，呼叫端須整表載入。"""
+        try:
+            result = self._read_changes(since)
+        except Exception as e:
+            logging.error(f"Error reading changes from {self.storage_name}: {e}")
+            return None
+        return None if result is None else [(revision, delta) for revision, delta in result[1] if delta['op'] != 'seal']
+
+    def load_changes(self):
+        """只讀取本物件上次載入或寫入之後的 delta，並如同 load 一樣推進版本；回傳 None 時呼叫端須改用 load。"""
+        with self._lock:
+            if self.revision is None or self._stale:
+                return None
+            self._wait_for_writes()
+            try:
+                result = self._read_changes(self.revision)
+            except Exception as e:
+                logging.error(f"Error reading changes from {self.storage_name}: {e}")
+                return None
+            if result is None:
+                return None
+            names, entries = result
+            self._journal_names = names
+            self._sealed = self._sealed or any(delta['op'] == 'seal' for _, delta in entries)
+            self.revision = self._compose_revision(self._snapshot_rev, names)
+            return [(revision, delta) for revision, delta in entries if delta['op'] != 'seal']
+
+    def _read_changes(self, since):
+        # 版本為「快照版本:最後一個 journal 檔名」，只能在同一代 journal 內往後讀
+        if since is None:
+            return None
+        snapshot_rev, _, last_name = str(since).rpartition(':')
+        if not snapshot_rev:
+            return None
+        with metrics.stage('remote_fetch', self.storage_name):
+            if self._head(self.snapshot_path) != snapshot_rev:
+                return None
+            names = sorted(self._list(self._journal_folder(snapshot_rev)))
+        if last_name and last_name not in names:
+            return None
+        entries = []
+        for name in names[names.index(last_name) + 1 if last_name else 0:]:
+            content, _ = self._fetch(f"{self._journal_folder(snapshot_rev)}/{name}")
+            entries.append((self._compose_revision(snapshot_rev, [name]), json.loads(content)))
+        return names, entries
+
+    def _snapshot_changed(self) -> bool:
+        try:
+            with metrics.stage('remote_fetch', self.storage_name):
+                return self._head(self.snapshot_path) != self._snapshot_rev
+        except Exception:
+            return False
+
+    def append(self, rows: pd.DataFrame) -> None:
+        metrics.inc('customer_id_rows_total', len(rows), operation='append')
+        self._write_delta({'op': 'append', 'rows': rows_to_records(rows)})
+
+    def upsert(self, rows: pd.DataFrame) -> None:
+        metrics.inc('customer_id_rows_total', len(rows), operation='upsert')
+        self._write_delta({'op': 'upsert', 'rows': rows_to_records(rows)})
+
+    def delete(self, customer_ids: list) -> None:
+        metrics.inc('customer_id_rows_total', len(customer_ids), operation='delete')
+        self._write_delta({'op': 'delete', 'customer_ids': list(customer_ids)})
+
+    def compact(self) -> None:
+        with self._lock:
+            self._wait_for_writes()
+            known = (self._snapshot_rev, list(self._journal_names))
+            data = self._load_latest()
+            # 壓縮時讀到其他程序的異動，呼叫端記憶體中的資料已過期，下次寫入前必須重新載入
+            stale = (self._snapshot_rev, self._journal_names) != known
+            if self.revision is None:
+                self._stale = True
+                return
+            try:
+                if not self._sealed:
+                    # 先佔住下一個序號封存這一代 journal，之後其他程序寫入時會衝突並重新載入
+                    seal = json.dumps({'op': 'seal'}).encode('utf-8')
+                    self._store(f"{self._journal_folder(self._snapshot_rev)}/{self._next_journal_name()}", seal, overwrite=False)
+                # 只有在快照未被其他程序改寫時才覆蓋
+                self._write_snapshot(data, expected_rev=self._snapshot_rev)
+            except ConflictError:
+                self.revision = None
+                logging.info(f"Skipped compaction on {self.storage_name}: journal changed by another writer")
+            except Exception as e:
+                self.revision = None
+                logging.error(f"Error compacting {self.storage_name}: {e}")
+            if stale:
+                self._stale = True
+                self.revision = None
+
+    def _write_snapshot(self, data: pd.DataFrame, expected_rev=None) -> None:
+        self._snapshot_rev = self._store(
+            self.snapshot_path, self._serialize(data), expected_rev=expected_rev)
+        if self.cache:
+            with metrics.stage('cache_write', self.storage_name):
+                self.cache.store(self._snapshot_rev, data)
+        self._journal_names = []
+        self._sealed = False
+        self._stale = False
+        self.revision = self._compose_revision(self._snapshot_rev, self._journal_names)
+        # 新快照已包含所有 delta，其他代的 journal 可以清掉
+        generation = self._journal_folder(self._snapshot_rev)[len(self.journal_path) + 1:]
+        try:
+            self._delete([
+                f"{self.journal_path}/{name}" for name in self._list(self.journal_path)
+                if name != generation and not name.startswith(f"{generation}/")
+            ])
+        except Exception as e:
+            logging.error(f"Error cleaning up journal on {self.storage_name}: {e}")
+
+    def _read_snapshot(self) -> tuple:
+        if self.snapshot_path != self.file_path and not self._exists(self.snapshot_path):
+            # 尚未轉換的舊 xlsx：讀進來後立即寫出欄式快照
+            content, _ = self._fetch(self.file_path)
+            data = self._deserialize(content, 'xlsx')
+            legacy_journal_path = f"{self.file_path}.journal"
+            for name in sorted(self._list(legacy_journal_path)):
+                entry, _ = self._fetch(f"{legacy_journal_path}/{name}")
+                data = apply_delta(data, json.loads(entry))
+            revision = self._store(self.snapshot_path, self._serialize(data))
+            logging.info(f"Converted {self.file_path} to {self.snapshot_path}")
+            if self.cache:
+                with metrics.stage('cache_write', self.storage_name):
+                    self.cache.store(revision, data)
+            return data, revision
+
+        if self.cache:
+            with metrics.stage('remote_fetch', self.storage_name):
+                revision = self._head(self.snapshot_path)
+            with metrics.stage('cache_read', self.storage_name):
+                data = self.cache.load(revision)
+            if data is not None:
+                return data, revision
+
+        content, revision = self._fetch(self.snapshot_path)
+        data = self._deserialize(content, self.snapshot_format)
+        if self.cache:
+            with metrics.stage('cache_write', self.storage_name):
+                self.cache.store(revision, data)
+        return data, revision
+
+    @staticmethod
+    def _compose_revision(snapshot_rev, journal_names):
+        if snapshot_rev is None:
+            return None
+        return f"{snapshot_rev}:{journal_names[-1] if journal_names else ''}"
+
+    def _journal_folder(self, snapshot_rev) -> str:
+        # 每份快照各有一代 journal 目錄，S3 ETag 帶有引號需去掉
+        generation = str(snapshot_rev).strip('"')
+        return f"{self.journal_path}/{generation}"
+
+    def _next_journal_name(self) -> str:
+        last = int(self._journal_names[-1].split('.')[0]) if self._journal_names else 0
+        return f"{last + 1:010d}.json"
+
+    def _wait_for_writes(self):
+        # 呼叫端須持有 _lock；等正在上傳的 journal 寫完，版本與檔名清單才是一致的
+        while self._writing:
+            self._written.wait()
+
+    def _write_delta(self, delta: dict) -> None:
+        # 群組提交：同一程序同時寫入的 delta 先排隊，由一個執行緒合併成一個 journal 檔上傳。
+        # 上傳期間不持有鎖，其他執行緒繼續排隊，下一趟一次寫出；與其他程序之間仍由條件寫入決定先後
+        entry = {'delta': delta, 'done': False, 'error': None}
+        with self._written:
+            self._queue.append(entry)
+        while True:
+            with self._written:
+                while self._writing and not entry['done']:
+                    self._written.wait()
+                if entry['done']:
+                    break
+                batch, target = self._start_batch()
+            error = self._upload_batch(batch, target) if target is not None else None
+            with self._written:
+                try:
+                    self._finish_batch(batch, target, error)
+                finally:
+                    self._writing = False
+                    self._written.notify_all()
+                if target is not None and error is None and len(self._journal_names) >= self.compact_threshold:
+                    self.compact()
+        if entry['error'] is not None:
+            error = entry['error']
+            raise ConflictError(str(error)) if isinstance(error, ConflictError) else error
+
+    def _start_batch(self):
+        # 持有 _lock：取出佇列開頭可合併的 delta，預留下一個 journal 檔名
+        batch = [self._queue.pop(0)]
+        while self._queue and _mergeable(batch[0]['delta'], self._queue[0]['delta']):
+            batch.append(self._queue.pop(0))
+        if self._sealed or self._stale or self._snapshot_rev is None:
+            # 資料已過期，或 journal 已封存但快照尚未寫出 (壓縮中途失敗) 時由本程序完成壓縮；呼叫端重新載入後重試
+            if self._sealed:
+                self.compact()
+            self.revision = None
+            for entry in batch:
+                entry['error'] = ConflictError(f"{self.storage_name} journal is being compacted")
+            return batch, None
+        # 上傳期間 load / save / compact 都會等待，快照版本與檔名清單不會改變
+        self._writing = True
+        return batch, (self._snapshot_rev, self._next_journal_name())
+
+    def _upload_batch(self, batch, target):
+        # 不持有 _lock，回傳例外 (成功時為 None)
+        snapshot_rev, name = target
+        folder = self._journal_folder(snapshot_rev)
+        body = json.dumps(_merge_deltas([entry['delta'] for entry in batch]), ensure_ascii=False).encode('utf-8')
+        try:
+            # 同名檔案已存在代表其他程序先寫入，本程序的資料已過期
+            self._store(f"{folder}/{name}", body, overwrite=False)
+            if self._snapshot_changed():
+                # 快照已被改寫，這筆寫到舊一代的 journal 不會被載入
+                self._delete([f"{folder}/{name}"])
+                raise ConflictError(f"{self.storage_name} snapshot was rewritten by another writer")
+        except Exception as e:
+            if not isinstance(e, ConflictError):
+                logging.error(f"Error writing journal to {self.storage_name}: {e}")
+            return e
+        return None
+
+    def _finish_batch(self, batch, target, error):
+        # 持有 _lock：登記寫入結果並喚醒同一批的執行緒
+        if target is not None:
+            if error is not None:
+                # 衝突或寫入結果未知，交由呼叫端回滾記憶體中的異動
+                self.revision = None
+            else:
+                self._journal_names.append(target[1])
+                if self.revision is not None:
+                    self.revision = self._compose_revision(self._snapshot_rev, self._journal_names)
+            for entry in batch:
+                entry['error'] = error
+        for entry in batch:
+            entry['done'] = True
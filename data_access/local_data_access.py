@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from .data_access import ConflictError
+from .journal_data_access import JournalDataAccess
+
+try:
+    import fcntl
+except ImportError:  # Windows 只靠程序內的鎖
+    fcntl = None
+
+
+class LocalDataAccess(JournalDataAccess):
+    """
+    以本機目錄代替 Dropbox / S3 的 DataAccess，行為與遠端相同 (快照 + journal、條件寫入)，
+    供本機開發與效能測試使用，不需要任何雲端帳號。
+    """
+
+    storage_name = 'local storage'
+
+    def __init__(self, directory, file_name, snapshot_format='xlsx', cache_dir=None):
+        self.directory = directory
+        self.file_name = file_name
+        os.makedirs(directory, exist_ok=True)
+        self._write_lock = threading.Lock()
+        super().__init__(f"{self.directory}/{self.file_name}", snapshot_format, cache_dir)
+
+    def _exists(self, path: str) -> bool:
+        return os.path.isfile(path)
+
+    def _head(self, path: str) -> str:
+        # 以 inode、修改時間與大小當作版本；寫入一律透過 os.replace 換成新檔，版本必定改變
+        stat = os.stat(path)
+        return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def _download(self, path: str) -> tuple:
+        with open(path, 'rb') as f:
+            revision = self._head(path)
+            return f.read(), revision
+
+    def _upload(self, path: str, body: bytes, overwrite: bool = True, expected_rev: str = None) -> str:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._exclusive():
+            if expected_rev is not None:
+                if not os.path.exists(path) or self._head(path) != expected_rev:
+                    raise ConflictError(f"Local file {path} was modified by another writer")
+            elif not overwrite and os.path.exists(path):
+                raise ConflictError(f"Local file {path} already exists")
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(body)
+                os.replace(temp_path, path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            return self._head(path)
+
+    def _list(self, folder: str) -> list:
+        # 與 S3 相同，回傳資料夾底下所有檔案 (含子目錄) 的相對路徑
+        names = []
+        for root, _, files in os.walk(folder):
+            relative = os.path.relpath(root, folder)
+            names.extend(name if relative == '.' else f"{relative}/{name}".replace(os.sep, '/')
+                         for name in files if not name.endswith('.tmp'))
+        return names
+
+    def _delete(self, paths: list) -> None:
+        folders = set()
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            folders.add(os.path.dirname(path))
+        # 清掉已空的分代目錄
+        for folder in sorted(folders, reverse=True):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass
+
+    @contextmanager
+    def _exclusive(self):
+        # 條件檢查與寫入之間不能被其他執行緒或程序插入
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
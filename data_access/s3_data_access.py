@@ -1,48 +1,75 @@
-import pandas as pd
-import os
-import io
 import logging
 import boto3
-from .data_access import DataAccess
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from .data_access import ConflictError
+from .journal_data_access import JournalDataAccess
 
-class S3DataAccess(DataAccess):
+class S3DataAccess(JournalDataAccess):
 
-    def __init__(self, bucket_name, directory, file_name, region, access_key, secret_key):
-        self.s3_client = boto3.client(
+    storage_name = 'S3'
+
+    def __init__(self, bucket_name, directory, file_name, region, access_key, secret_key, snapshot_format='xlsx', cache_dir=None,
+                 client=None, max_pool_connections=10):
+        # 分片共用同一個 client (與其連線池)；未提供時自行建立
+        self.s3_client = client if client is not None else self.create_client(region, access_key, secret_key, max_pool_connections)
+        self.bucket_name = bucket_name
+        self.directory = directory
+        self.file_name = file_name
+        super().__init__(f"{self.directory}/{self.file_name}", snapshot_format, cache_dir)
+
+    @staticmethod
+    def create_client(region, access_key, secret_key, max_pool_connections=10):
+        # 連線池要容納儲存執行緒池與分片執行緒池同時的請求，不足時多出的連線用完即丟，無法重用
+        return boto3.client(
             's3',
             aws_access_key_id=access_key,
             aws_secret_access_key=secret_key,
-            region_name=region
+            region_name=region,
+            config=Config(max_pool_connections=max_pool_connections)
         )
-        self.bucket_name = bucket_name
-        self.directory = directory
-        self.file_name = file_name
-        self.file_path = f"{self.directory}/{self.file_name}"
 
-    def file_exists(self) -> bool:
+    def _exists(self, path: str) -> bool:
         try:
-            self.s3_client.head_object(Bucket=self.bucket_name, Key=self.file_path)
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=path)
             return True
         except Exception as e:
             logging.error(f"Error checking if file exists in S3: {e}")
             return False
 
-    def save(self, data: pd.DataFrame) -> None:
-        try:
-            with io.BytesIO() as output:
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    data.to_excel(writer, index=False)
-                output.seek(0)
-                self.s3_client.put_object(Bucket=self.bucket_name, Key=self.file_path, Body=output.read())
-        except Exception as e:
-            logging.error(f"Error saving to S3: {e}")
+    def _head(self, path: str) -> str:
+        return self.s3_client.head_object(Bucket=self.bucket_name, Key=path)['ETag']
+
+    def _download(self, path: str) -> tuple:
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=path)
+        return response['Body'].read(), response['ETag']
 
-    def load(self) -> pd.DataFrame:
+    def _upload(self, path: str, body: bytes, overwrite: bool = True, expected_rev: str = None) -> str:
+        conditions = {}
+        if expected_rev is not None:
+            conditions['IfMatch'] = expected_rev
+        elif not overwrite:
+            conditions['IfNoneMatch'] = '*'
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.file_path)
-            data = pd.read_excel(io.BytesIO(response['Body'].read()), engine='openpyxl')
-            data['CustomerID'] = data['CustomerID'].astype(str)
-            return data
-        except Exception as e:
-            logging.error(f"Error loading from S3: {e}")
-            return pd.DataFrame(columns=['Region', 'Category', 'CompanyName', 'ExtraRegionCode', 'BranchName', 'BranchHandling', 'CustomerID'])
+            return self.s3_client.put_object(Bucket=self.bucket_name, Key=path, Body=body, **conditions)['ETag']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise ConflictError(f"S3 object {path} was modified by another writer") from e
+            raise
+
+    def _list(self, folder: str) -> list:
+        prefix = f"{folder}/"
+        names = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            names.extend(obj['Key'][len(prefix):] for obj in page.get('Contents', []))
+        return names
+
+    def _delete(self, paths: list) -> None:
+        # delete_objects 一次最多 1000 個 key
+        for start in range(0, len(paths), 1000):
+            batch = paths[start:start + 1000]
+            self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': path} for path in batch]}
+            )
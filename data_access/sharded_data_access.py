@@ -0,0 +1,247 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from .data_access import DataAccess, CUSTOMER_COLUMNS
+
+SHARD_COLUMNS = {'region': ('Region',), 'region_category': ('Region', 'Category')}
+OTHER_SHARD = 'other'
+
+
+def _compose_revision(codes, revisions):
+    if any(revision is None for revision in revisions):
+        return None
+    return '|'.join(f"{code}={revision}" for code, revision in zip(codes, revisions))
+
+
+def _parse_revision(revision):
+    try:
+        return dict(part.split('=', 1) for part in str(revision).split('|'))
+    except ValueError:
+        return {}
+
+
+def _delta_ids(delta):
+    if delta['op'] == 'delete':
+        return {str(customer_id) for customer_id in delta['customer_ids']}
+    return {str(row['CustomerID']) for row in delta.get('rows', [])}
+
+
+def shard_codes(shard_by, regions, categories):
+    # 地區碼與類別碼就是欄位值的第一個字元，也是客戶ID的前兩碼
+    region_codes = [region[0] for region in regions]
+    if shard_by == 'region':
+        return region_codes
+    return [region + category[0] for region in region_codes for category in categories]
+
+
+class ShardedDataAccess(DataAccess):
+    """
+    依地區 (或地區 + 類別) 分片存放：每個分片是獨立的 DataAccess，有各自的快照、journal 與版本。
+    載入時以執行緒池平行讀取各分片，新增 / 修改 / 刪除只寫入資料所在的分片，
+    load_region 只讀取單一地區的分片。
+    分片以客戶ID開頭的地區碼 (與類別碼) 命名，刪除時直接由客戶ID找到分片；
+    一次異動跨多個分片時各分片分別寫入，不是原子性的。
+    """
+
+    def __init__(self, create_shard, codes, shard_columns=('Region',), legacy: DataAccess = None, max_workers=8):
+        # create_shard(name) 建立單一分片的 DataAccess；不在 codes 內的資料放在 other 分片
+        # legacy 為分片前的單一檔案，第一次載入時拆開寫入各分片
+        self.shard_columns = tuple(shard_columns)
+        self.create_shard = create_shard
+        self.shards = {code: create_shard(f"shard-{code}") for code in list(codes) + [OTHER_SHARD]}
+        self._readers = {}
+        self.legacy = legacy
+        self._legacy_checked = legacy is None
+        self._misplaced = {}  # 客戶ID前綴與所在分片不一致的列：客戶ID -> 分片代碼
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shard')
+        self.revision = None
+
+    def _map(self, func, items):
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        # 每個工作各自複製 contextvars，分片內的耗時仍計入目前請求的 metrics
+        futures = [self._executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _row_codes(self, rows: pd.DataFrame) -> pd.Series:
+        codes = pd.Series('', index=rows.index)
+        for column in self.shard_columns:
+            values = rows[column]
+            codes = codes + values.where(values.notna(), '').astype(str).str[:1]
+        return codes.where(codes.isin(list(self.shards)) & (codes != OTHER_SHARD), OTHER_SHARD)
+
+    def _id_code(self, customer_id) -> str:
+        code = self._misplaced.get(customer_id)
+        if code is not None:
+            return code
+        code = str(customer_id)[:len(self.shard_columns)]
+        return code if code in self.shards else OTHER_SHARD
+
+    def _track(self, code, customer_ids: pd.Series):
+        # 記錄客戶ID前綴與所在分片不一致的列，呼叫端須持有 _lock
+        customer_ids = customer_ids.astype(str)
+        prefixes = customer_ids.str[:len(self.shard_columns)]
+        misplaced = prefixes.where(prefixes.isin(list(self.shards)) & (prefixes != OTHER_SHARD), OTHER_SHARD) != code
+        for customer_id in customer_ids[misplaced]:
+            self._misplaced[customer_id] = code
+        if self._misplaced:
+            for customer_id in customer_ids[~misplaced]:
+                self._misplaced.pop(customer_id, None)
+
+    def _split(self, rows: pd.DataFrame) -> dict:
+        if rows.empty:
+            return {}
+        return {code: group for code, group in rows.groupby(self._row_codes(rows), sort=False)}
+
+    def _compose_revision(self):
+        return _compose_revision(self.shards, [shard.revision for shard in self.shards.values()])
+
+    def file_exists(self) -> bool:
+        if any(self._map(lambda code: self.shards[code].file_exists(), self.shards)):
+            return True
+        return self.legacy is not None and self.legacy.file_exists()
+
+    def get_revision(self):
+        return _compose_revision(self.shards, self._map(lambda code: self.shards[code].get_revision(), self.shards))
+
+    def save(self, data: pd.DataFrame) -> None:
+        groups = self._split(data)
+        empty = pd.DataFrame(columns=CUSTOMER_COLUMNS)
+        self._map(lambda code: self.shards[code].save(groups.get(code, empty)), self.shards)
+        with self._lock:
+            self._misplaced = {}
+            for code, group in groups.items():
+                self._track(code, group['CustomerID'])
+        self.revision = self._compose_revision()
+
+    def load(self) -> pd.DataFrame:
+        if not self._legacy_checked:
+            self._legacy_checked = True
+            if not any(self._map(lambda code: self.shards[code].file_exists(), self.shards)) and self.legacy.file_exists():
+                # 第一次啟用分片：讀入原本的單一檔案後拆開寫入各分片，原檔保留不動
+                data = self.legacy.load()
+                self.save(data)
+                logging.info(f"Split {len(data)} rows into {len(self.shards)} shards")
+                return data
+        frames = self._map(self._load_shard, self.shards)
+        with self._lock:
+            self._misplaced = {}
+            for code, frame in zip(self.shards, frames):
+                self._track(code, frame['CustomerID'])
+        self.revision = self._compose_revision()
+        frames = [frame for frame in frames if not frame.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=CUSTOMER_COLUMNS)
+
+    def _load_shard(self, code) -> pd.DataFrame:
+        shard = self.shards[code]
+        data = shard.load()
+        if shard.revision is None and not shard.file_exists():
+            # 新增的分片 (例如新的地區或類別) 尚未建立
+            shard.save(pd.DataFrame(columns=CUSTOMER_COLUMNS))
+            shard.load()
+        return data
+
+    def load_region(self, region, category=None) -> tuple:
+        """只載入單一地區 (與類別) 的分片與 other 分片，回傳 (資料, 這些分片的版本)；版本未知時為 None。"""
+        prefix = str(region)[:1] + (str(category)[:1] if category and len(self.shard_columns) > 1 else '')
+        codes = [code for code in self.shards if code != OTHER_SHARD and code.startswith(prefix)] + [OTHER_SHARD]
+        readers = [self._reader(code) for code in codes]
+        frames = self._map(lambda reader: reader.load(), readers)
+        revision = _compose_revision(codes, [reader.revision for reader in readers])
+        other = frames.pop()
+        frames = [frame for frame in frames if not frame.empty] + [other[other['Region'] == region]]
+        return pd.concat(frames, ignore_index=True), revision
+
+    def _reader(self, code):
+        # 唯讀用的另一個實例：load 會更新寫入端記錄的遠端版本，不能讓 load_region 影響寫入的衝突檢查
+        with self._lock:
+            if code not in self._readers:
+                self._readers[code] = self.create_shard(f"shard-{code}")
+            return self._readers[code]
+
+    def changes(self, since):
+        revisions = _parse_revision(since)
+        if set(revisions) != set(self.shards):
+            return None
+        shard_changes = self._map(lambda code: self.shards[code].changes(revisions[code]), self.shards)
+        return self._merge_changes(revisions, shard_changes)
+
+    def load_changes(self):
+        if self.revision is None:
+            return None
+        shard_changes = self._map(lambda code: self.shards[code].load_changes(), self.shards)
+        entries = self._merge_changes(_parse_revision(self.revision), shard_changes)
+        if entries is None:
+            # 部分分片已推進版本，呼叫端改為整表載入時會全部重新讀取
+            self.revision = None
+            return None
+        with self._lock:
+            for code, changes in zip(self.shards, shard_changes):
+                for _, delta in changes:
+                    if delta['op'] == 'delete':
+                        for customer_id in delta['customer_ids']:
+                            self._misplaced.pop(str(customer_id), None)
+                    else:
+                        self._track(code, pd.Series([row['CustomerID'] for row in delta['rows']], dtype=object))
+        self.revision = self._compose_revision()
+        return entries
+
+    def _merge_changes(self, revisions, shard_changes):
+        # 各分片之間沒有先後順序，同一個客戶ID出現在多個分片 (例如改了地區而搬移) 時無法正確重播
+        if any(changes is None for changes in shard_changes):
+            return None
+        owners = {}
+        for code, changes in zip(self.shards, shard_changes):
+            for _, delta in changes:
+                for customer_id in _delta_ids(delta):
+                    if owners.setdefault(customer_id, code) != code:
+                        return None
+        revisions = dict(revisions)
+        entries = []
+        for code, changes in zip(self.shards, shard_changes):
+            for revision, delta in changes:
+                revisions[code] = revision
+                entries.append((_compose_revision(self.shards, [revisions[name] for name in self.shards]), delta))
+        return entries
+
+    def append(self, rows: pd.DataFrame) -> None:
+        groups = self._split(rows)
+        self._map(lambda code: self.shards[code].append(groups[code]), groups)
+        with self._lock:
+            for code, group in groups.items():
+                self._track(code, group['CustomerID'])
+        self.revision = self._compose_revision()
+
+    def upsert(self, rows: pd.DataFrame) -> None:
+        groups = self._split(rows)
+        # 地區 (或類別) 改變的列先從原本的分片刪除
+        moved = {}
+        for code, group in groups.items():
+            for customer_id in group['CustomerID']:
+                current = self._id_code(customer_id)
+                if current != code:
+                    moved.setdefault(current, []).append(customer_id)
+        if moved:
+            self._map(lambda code: self.shards[code].delete(moved[code]), moved)
+        self._map(lambda code: self.shards[code].upsert(groups[code]), groups)
+        with self._lock:
+            for code, group in groups.items():
+                self._track(code, group['CustomerID'])
+        self.revision = self._compose_revision()
+
+    def delete(self, customer_ids: list) -> None:
+        groups = {}
+        for customer_id in customer_ids:
+            groups.setdefault(self._id_code(customer_id), []).append(customer_id)
+        self._map(lambda code: self.shards[code].delete(groups[code]), groups)
+        with self._lock:
+            for customer_id in customer_ids:
+                self._misplaced.pop(customer_id, None)
+        self.revision = self._compose_revision()
+
+    def compact(self) -> None:
+        self._map(lambda code: self.shards[code].compact(), [code for code in self.shards if hasattr(self.shards[code], 'compact')])
@@ -0,0 +1,46 @@
+import os
+import re
+import logging
+import pandas as pd
+from .snapshot_format import to_arrow_table, from_arrow_table
+
+
+class SnapshotCache:
+    """
+    本機磁碟上的 Arrow IPC 快照快取，讀取時以 memory map 開啟。
+    檔案內記錄遠端快照版本，版本不符時視為未命中。
+    """
+
+    def __init__(self, directory: str, key: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, re.sub(r'[^\w.-]+', '_', key.strip('/')) + '.arrow')
+
+    def load(self, revision: str):
+        if revision is None or not os.path.exists(self.path):
+            return None
+        try:
+            import pyarrow as pa
+            with pa.memory_map(self.path, 'r') as source:
+                reader = pa.ipc.open_file(source)
+                metadata = reader.schema.metadata or {}
+                if metadata.get(b'revision', b'').decode('utf-8') != revision:
+                    return None
+                return from_arrow_table(reader.read_all())
+        except Exception as e:
+            logging.error(f"Error reading snapshot cache {self.path}: {e}")
+            return None
+
+    def store(self, revision: str, data: pd.DataFrame) -> None:
+        if revision is None:
+            return
+        try:
+            import pyarrow as pa
+            table = to_arrow_table(data).replace_schema_metadata({'revision': revision})
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with pa.OSFile(temp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            # 先寫暫存檔再替換，其他 worker 不會讀到寫一半的檔案
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error writing snapshot cache {self.path}: {e}")
@@ -0,0 +1,63 @@
+import io
+import os
+import pandas as pd
+from .data_access import CUSTOMER_COLUMNS
+
+# xlsx 保留給人工開啟與匯入匯出；parquet / arrow 解析快很多，適合當作遠端快照
+SNAPSHOT_FORMATS = ('xlsx', 'parquet', 'arrow')
+
+
+def snapshot_path(file_path: str, snapshot_format: str) -> str:
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unsupported snapshot format: {snapshot_format}")
+    if snapshot_format == 'xlsx':
+        return file_path
+    return f"{os.path.splitext(file_path)[0]}.{snapshot_format}"
+
+
+def to_arrow_table(data: pd.DataFrame):
+    import pyarrow as pa
+    # 欄位一律存成可為空的字串，避免 Excel 讀回來的數字公司名稱造成型別混雜
+    columns = {}
+    for column in CUSTOMER_COLUMNS:
+        values = data[column] if column in data.columns else pd.Series([None] * len(data), dtype=object)
+        columns[column] = pa.array([None if pd.isna(v) else str(v) for v in values], type=pa.string())
+    return pa.table(columns)
+
+
+def from_arrow_table(table) -> pd.DataFrame:
+    data = table.to_pandas()
+    data['CustomerID'] = data['CustomerID'].astype(str)
+    return data
+
+
+def serialize_snapshot(data: pd.DataFrame, snapshot_format: str) -> bytes:
+    if snapshot_format == 'xlsx':
+        with io.BytesIO() as output:
+            with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                data.to_excel(writer, index=False)
+            return output.getvalue()
+
+    import pyarrow as pa
+    table = to_arrow_table(data)
+    sink = pa.BufferOutputStream()
+    if snapshot_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink, compression='zstd')
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def deserialize_snapshot(content: bytes, snapshot_format: str) -> pd.DataFrame:
+    if snapshot_format == 'xlsx':
+        data = pd.read_excel(io.BytesIO(content), engine='openpyxl')
+        data['CustomerID'] = data['CustomerID'].astype(str)
+        return data
+
+    import pyarrow as pa
+    if snapshot_format == 'parquet':
+        import pyarrow.parquet as pq
+        return from_arrow_table(pq.read_table(pa.BufferReader(content)))
+    return from_arrow_table(pa.ipc.open_file(pa.BufferReader(content)).read_all())
@@ -0,0 +1,43 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_STORAGE_WORKERS = 8
+
+
+def create_storage_executor(max_workers=DEFAULT_STORAGE_WORKERS):
+    # 儲存 I/O 專用、有上限的執行緒池；大量匯入或存檔時最多佔用 max_workers 條執行緒，
+    # 不會用光 Starlette 處理同步端點 (例如搜尋) 的執行緒池
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage')
+
+
+async def run_in_executor(executor, func, *args, **kwargs):
+    # 複製 contextvars，執行緒池內的耗時仍計入目前請求的 metrics
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def iterate_in_executor(executor, iterator):
+    # 同步產生器的每一段都在執行緒池產生，序列化大量資料時不會卡住事件迴圈
+    done = object()
+    while True:
+        chunk = await run_in_executor(executor, next, iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+
+class StorageExecutor:
+    """
+    有上限的儲存執行緒池：非同步端點 await run()，實際的 Dropbox / S3 / 資料庫 I/O
+    與讀取整份資料的 CPU 工作在這裡執行，不阻塞事件迴圈，也不佔用 Starlette 的執行緒池。
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor if executor is not None else create_storage_executor()
+
+    async def run(self, func, *args, **kwargs):
+        """在儲存執行緒池執行同步呼叫，例如 generator 持有鎖的寫入流程。"""
+        return await run_in_executor(self.executor, func, *args, **kwargs)
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import pandas as pd
+from .data_access import DataAccess, ConflictError, CUSTOMER_COLUMNS, rows_to_records
+from .journal_data_access import apply_delta
+from monitoring.metrics import metrics
+
+
+def coalesce_deltas(deltas: list) -> tuple:
+    # 把一連串 delta 合併成每個客戶ID的最終狀態：(新增的列, 修改的列, 刪除的客戶ID)
+    rows = {}
+    created = set()
+    deleted = set()
+    for delta in deltas:
+        if delta['op'] == 'delete':
+            for customer_id in delta['customer_ids']:
+                customer_id = str(customer_id)
+                rows.pop(customer_id, None)
+                if customer_id in created:
+                    # 這批才新增又刪除，遠端從未見過
+                    created.discard(customer_id)
+                else:
+                    deleted.add(customer_id)
+            continue
+        for row in delta['rows']:
+            customer_id = str(row['CustomerID'])
+            row = dict(row, CustomerID=customer_id)
+            if customer_id in rows and customer_id in created:
+                rows[customer_id] = row
+                continue
+            if delta['op'] == 'append' and customer_id not in deleted and customer_id not in rows:
+                created.add(customer_id)
+            deleted.discard(customer_id)
+            rows[customer_id] = row
+    return (
+        [row for customer_id, row in rows.items() if customer_id in created],
+        [row for customer_id, row in rows.items() if customer_id not in created],
+        sorted(deleted),
+    )
+
+
+class WriteBehindDataAccess(DataAccess):
+    """
+    包在其他 DataAccess 外層的延遲寫入：
+    每次異動先 fsync 到本機 journal 就回應，背景執行緒每隔 flush_interval 秒或累積 max_batch 筆後
+    才把合併後的異動寫到遠端。啟動時重播本機 journal，程序中斷也不會遺失已回應的寫入。
+    遠端寫入在背景進行，與其他程序的衝突只能在 flush 時發現 (記錄在 stats 的 conflicts)，
+    適合單一寫入程序的部署。
+    """
+
+    def __init__(self, inner: DataAccess, directory, flush_interval=2.0, max_batch=100):
+        self.inner = inner
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, 'write_behind.journal')
+        self.flushing_path = f"{self.journal_path}.flushing"
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._pending = []
+        self._flushing = []
+        self._pending_rows = 0
+        self._pending_since = None
+        self._flushing_since = None
+        self._local_seq = 0
+        self._epoch = 0
+        self._base_rev = None
+        self.revision = None
+        self.flushes = 0
+        self.flushed_ops = 0
+        self.conflicts = 0
+        self.last_flush_at = None
+        self.last_flush_error = None
+
+        self._recover()
+        self._journal = open(self.journal_path, 'ab')
+        self._thread = threading.Thread(target=self._run, name='write-behind-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def file_exists(self) -> bool:
+        return self.inner.file_exists() or bool(self._pending or self._flushing)
+
+    def get_revision(self):
+        # 遠端只被本程序改過時沿用本機版本；其他程序寫入過則回傳 None 讓呼叫端重新載入
+        remote = self.inner.get_revision()
+        with self._lock:
+            return self._token() if remote is not None and remote == self._base_rev else None
+
+    def save(self, data: pd.DataFrame) -> None:
+        # 整表覆寫已包含所有尚未寫出的異動，直接同步寫到遠端
+        with self._flush_lock, self._lock:
+            self._pending, self._flushing = [], []
+            self._pending_rows = 0
+            self._pending_since = self._flushing_since = None
+            self._journal.truncate(0)
+            self._remove_flushing_file()
+            self.inner.save(data)
+            self._base_rev = self.inner.revision
+            self._epoch += 1
+            self.revision = self._token()
+
+    def load(self) -> pd.DataFrame:
+        # 持有 flush 鎖，確保遠端資料與尚未寫出的異動不會重疊或遺漏
+        with self._flush_lock:
+            data = self.inner.load()
+            with self._lock:
+                self._base_rev = self.inner.revision
+                self._epoch += 1
+                for delta in self._flushing + self._pending:
+                    data = apply_delta(data, delta)
+                self.revision = self._token()
+                return data
+
+    def append(self, rows: pd.DataFrame) -> None:
+        self._record({'op': 'append', 'rows': rows_to_records(rows)}, len(rows))
+
+    def upsert(self, rows: pd.DataFrame) -> None:
+        self._record({'op': 'upsert', 'rows': rows_to_records(rows)}, len(rows))
+
+    def delete(self, customer_ids: list) -> None:
+        customer_ids = [str(customer_id) for customer_id in customer_ids]
+        self._record({'op': 'delete', 'customer_ids': customer_ids}, len(customer_ids))
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                # 上次失敗的批次優先重送
+                if not self._flushing:
+                    if not self._pending:
+                        return 0
+                    self._journal.close()
+                    os.replace(self.journal_path, self.flushing_path)
+                    self._journal = open(self.journal_path, 'ab')
+                    self._flushing, self._pending = self._pending, []
+                    self._flushing_since, self._pending_since = self._pending_since, None
+                    self._pending_rows = 0
+                batch = list(self._flushing)
+            try:
+                conflicted = self._push(coalesce_deltas(batch))
+            except Exception as e:
+                self.last_flush_error = str(e)
+                logging.error(f"Error flushing write-behind journal: {e}")
+                return 0
+            with self._lock:
+                self._flushing = []
+                self._flushing_since = None
+                self._remove_flushing_file()
+                # 衝突時遠端有其他程序的異動，讓呼叫端下次 refresh 重新載入
+                self._base_rev = None if conflicted else self.inner.revision
+                self.flushes += 1
+                self.flushed_ops += len(batch)
+                self.last_flush_at = time.time()
+                self.last_flush_error = None
+            logging.info(f"Flushed {len(batch)} write-behind changes")
+            return len(batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            since = [t for t in (self._flushing_since, self._pending_since) if t is not None]
+            return {
+                'queue_depth': len(self._pending) + len(self._flushing),
+                'pending_rows': self._pending_rows,
+                'flush_lag_seconds': time.monotonic() - min(since) if since else 0.0,
+                'flushes': self.flushes,
+                'flushed_ops': self.flushed_ops,
+                'conflicts': self.conflicts,
+                'last_flush_at': self.last_flush_at,
+                'last_flush_error': self.last_flush_error,
+            }
+
+    def close(self) -> None:
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            self._journal.close()
+
+    def _token(self):
+        # 本程序自己的 flush 不改變版本，只有重新載入或本機寫入才會
+        return None if self._base_rev is None else f"{self._epoch}+{self._local_seq}"
+
+    def _record(self, delta: dict, size: int) -> None:
+        line = (json.dumps(delta, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            with metrics.stage('journal_write', 'write-behind'):
+                self._journal.write(line)
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            self._pending.append(delta)
+            self._pending_rows += size
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self._local_seq += 1
+            self.revision = self._token()
+            full = self._pending_rows >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def _push(self, changes: tuple) -> bool:
+        created, updated, deleted = changes
+        conflicted = False
+        for attempt in range(2):
+            try:
+                if created:
+                    self.inner.append(pd.DataFrame(created, columns=CUSTOMER_COLUMNS))
+                    created = []
+                if updated:
+                    self.inner.upsert(pd.DataFrame(updated, columns=CUSTOMER_COLUMNS))
+                    updated = []
+                if deleted:
+                    self.inner.delete(deleted)
+                    deleted = []
+                break
+            except ConflictError:
+                if attempt:
+                    raise
+                conflicted = True
+                # 重新載入讓遠端的版本回到最新；已存在的客戶ID可能是上次中斷前已寫出的，也可能被其他程序配發
+                remote = set(self.inner.load()['CustomerID'])
+                taken = [row['CustomerID'] for row in created if row['CustomerID'] in remote]
+                if taken:
+                    self.conflicts += len(taken)
+                    logging.warning(f"Write-behind skipped {len(taken)} customer IDs already present remotely: {taken[:20]}")
+                created = [row for row in created if row['CustomerID'] not in remote]
+        if self.inner.revision is None:
+            # 遠端的 DataAccess 會吞掉錯誤，版本未知就當作失敗，保留批次下次重送
+            raise RuntimeError("remote write could not be confirmed")
+        return conflicted
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flush thread error: {e}")
+
+    def _recover(self) -> None:
+        # 先重播上次 flush 中斷的批次，再重播尚未 flush 的 journal
+        deltas = []
+        for path in (self.flushing_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        deltas.append(json.loads(line))
+                    except ValueError:
+                        # 最後一行可能在寫入途中中斷，當時也尚未回應
+                        logging.warning(f"Skipped a truncated write-behind journal entry in {path}")
+        if not deltas:
+            return
+        with open(self.journal_path, 'wb') as f:
+            for delta in deltas:
+                f.write((json.dumps(delta, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self._remove_flushing_file()
+        self._pending = deltas
+        self._pending_rows = sum(len(delta.get('rows', delta.get('customer_ids', []))) for delta in deltas)
+        self._pending_since = time.monotonic()
+        logging.info(f"Recovered {len(deltas)} write-behind changes from {self.journal_path}")
+
+    def _remove_flushing_file(self) -> None:
+        try:
+            os.remove(self.flushing_path)
+        except FileNotFoundError:
+            pass
@@ -1,29 +1,85 @@
-from data_access.s3_data_access import S3DataAccess
-from data_access.db_data_access import DBDataAccess
-from data_access.dropbox_data_access import DropboxDataAccess
+import os
+
 
 class DataAccessFactory:
 
+    # 各後端只在被選用時才匯入，避免冷啟動時載入 boto3 / sqlalchemy / dropbox 全部的套件
     @staticmethod
     def get_data_access(storage_type, **kwargs):
         if storage_type == 's3':
+            from data_access.s3_data_access import S3DataAccess
             return S3DataAccess(
                 bucket_name=kwargs['bucket_name'],
                 directory=kwargs['directory'],
                 file_name=kwargs['file_name'],
                 region=kwargs['region'],
                 access_key=kwargs['access_key'],
-                secret_key=kwargs['secret_key']
+                secret_key=kwargs['secret_key'],
+                snapshot_format=kwargs.get('snapshot_format', 'xlsx'),
+                cache_dir=kwargs.get('cache_dir'),
+                client=kwargs.get('client'),
+                max_pool_connections=kwargs.get('max_pool_connections', 10)
             )
         elif storage_type == 'db':
+            from data_access.db_data_access import DBDataAccess
             return DBDataAccess(
-                db_url=kwargs['db_url']
+                db_url=kwargs['db_url'],
+                pool_size=kwargs.get('pool_size', 5),
+                max_overflow=kwargs.get('max_overflow', 10),
+                pool_recycle=kwargs.get('pool_recycle', 1800)
             )
         elif storage_type == 'dropbox':
+            from data_access.dropbox_data_access import DropboxDataAccess
             return DropboxDataAccess(
                 access_token=kwargs['access_token'],
                 directory=kwargs['directory'],
-                file_name=kwargs['file_name']
+                file_name=kwargs['file_name'],
+                snapshot_format=kwargs.get('snapshot_format', 'xlsx'),
+                cache_dir=kwargs.get('cache_dir'),
+                client=kwargs.get('client')
+            )
+        elif storage_type == 'local':
+            from data_access.local_data_access import LocalDataAccess
+            return LocalDataAccess(
+                directory=kwargs['directory'],
+                file_name=kwargs['file_name'],
+                snapshot_format=kwargs.get('snapshot_format', 'xlsx'),
+                cache_dir=kwargs.get('cache_dir')
             )
         else:
             raise ValueError(f"Unsupported storage type: {storage_type}")
+
+    @staticmethod
+    def create_client(storage_type, **kwargs):
+        if storage_type == 's3':
+            from data_access.s3_data_access import S3DataAccess
+            return S3DataAccess.create_client(kwargs['region'], kwargs['access_key'], kwargs['secret_key'],
+                                              kwargs.get('max_pool_connections', 10))
+        if storage_type == 'dropbox':
+            import dropbox
+            return dropbox.Dropbox(kwargs['access_token'])
+        return None
+
+    # 每個地區 (或地區 + 類別) 各一份檔案，檔名加上分片代碼，例如 customer_ids.shard-1.xlsx
+    @staticmethod
+    def get_sharded_data_access(storage_type, shard_by, regions, categories, max_workers=8, **kwargs):
+        from data_access.sharded_data_access import ShardedDataAccess, SHARD_COLUMNS, shard_codes
+        if storage_type not in ('s3', 'dropbox', 'local'):
+            raise ValueError(f"Sharding is not supported for storage type: {storage_type}")
+        if shard_by not in SHARD_COLUMNS:
+            raise ValueError(f"Unsupported shard mode: {shard_by}")
+        stem, extension = os.path.splitext(kwargs['file_name'])
+        if 'client' not in kwargs:
+            # 所有分片 (與唯讀用的實例) 共用同一個 client，連線在分片之間重用
+            kwargs = dict(kwargs, client=DataAccessFactory.create_client(storage_type, **kwargs))
+
+        def create_shard(name):
+            return DataAccessFactory.get_data_access(storage_type, **dict(kwargs, file_name=f"{stem}.{name}{extension}"))
+
+        return ShardedDataAccess(
+            create_shard,
+            shard_codes(shard_by, regions, categories),
+            SHARD_COLUMNS[shard_by],
+            legacy=DataAccessFactory.get_data_access(storage_type, **kwargs),
+            max_workers=max_workers
+        )
@@ -0,0 +1,189 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextlib
+import contextvars
+
+# 秒；涵蓋記憶體索引查詢 (毫秒以下) 到整份 xlsx 下載解析 (數十秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_HELP = {
+    'customer_id_request_seconds': ('histogram', '每個端點的請求處理時間 (含串流回應的內容)'),
+    'customer_id_stage_seconds': ('histogram', '各階段耗時：remote_fetch / parse / cache_read / cache_write / index / filter / serialize / upload / db_query / db_write / journal_write'),
+    'customer_id_storage_bytes_total': ('counter', '與儲存後端傳輸的位元組數'),
+    'customer_id_rows_total': ('counter', '各操作處理的資料列數'),
+    'customer_id_refresh_total': ('counter', 'refresh_data 的次數，result=hit 表示版本未變未重新載入'),
+}
+
+# 目前請求的各階段耗時，由 MetricsMiddleware 設定；請求以外 (背景執行緒) 為 None
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'source', 'start')
+
+    def __init__(self, metrics, name, source):
+        self.metrics = metrics
+        self.name = name
+        self.source = source
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.metrics.observe('customer_id_stage_seconds', elapsed, stage=self.name, source=self.source)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[self.name] = stages.get(self.name, 0.0) + elapsed
+        return False
+
+
+class Metrics:
+    """
+    程序內的計數器與直方圖，以 Prometheus 文字格式輸出。
+    停用時 stage / inc / observe 只檢查一個布林值就返回。
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name, source):
+        # 各階段不應互相包含，請求的耗時拆解才不會重複計算
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, source)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def transferred(self, source, direction, size):
+        # direction 為 download / upload，同時計入目前請求的耗時拆解
+        if not self.enabled:
+            return
+        self.inc('customer_id_storage_bytes_total', size, source=source, direction=direction)
+        stages = _request_stages.get()
+        if stages is not None:
+            field = f"bytes_{direction}"
+            stages[field] = stages.get(field, 0) + size
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        position = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[position] += 1
+            histogram.count += 1
+            histogram.sum += seconds
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.count, h.sum)) for key, h in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = METRIC_HELP.get(name, ('untyped', name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (counts, count, total) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(enabled=os.getenv('METRICS_ENABLED', '1') != '0')
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware：記錄每個端點的處理時間 (到回應內容送完為止)，
+    超過 slow_request_ms 的請求把各階段耗時寫進 log。
+    """
+
+    def __init__(self, app, slow_request_ms=None):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+        stages = {}
+        token = _request_stages.set(stages)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stages.reset(token)
+            route = scope.get('route')
+            # 以路由樣板當標籤，避免路徑參數 (例如客戶ID) 讓標籤數量無限成長
+            endpoint = getattr(route, 'path', 'unmatched')
+            metrics.observe('customer_id_request_seconds', elapsed, method=scope['method'], endpoint=endpoint, status=str(status))
+            if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+                breakdown = ' '.join(
+                    f"{name}={value}" if name.startswith('bytes_') else f"{name}={value * 1000:.1f}ms"
+                    for name, value in sorted(stages.items()))
+                logging.warning(f"Slow request {scope['method']} {scope['path']} -> {status} took {elapsed * 1000:.1f}ms: {breakdown or 'no stages recorded'}")
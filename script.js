@@ -243,15 +243,23 @@ document.getElementById('query-form').addEventListener('submit', async function(
         return;
     }
 
-    const response = await fetch(backendUrl + '/query_customer_id', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ company_name })
-    });
+    // 後端分頁回傳，依 next_cursor 取完所有資料
+    const result = { detail: '', data: [] };
+    let cursor = null;
+    do {
+        const response = await fetch(backendUrl + '/query_customer_id', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ company_name, cursor, limit: 1000 })
+        });
+        const page = await response.json();
+        result.detail = page.detail;
+        result.data = result.data.concat(page.data || []);
+        cursor = page.next_cursor;
+    } while (cursor);
 
-    const result = await response.json();
     const queryResult = document.getElementById('query-result');
     queryResult.innerHTML = '';
 
@@ -324,7 +332,14 @@ document.getElementById('import-form').addEventListener('submit', async function
     });
 
     const result = await response.json();
-    document.getElementById('import-result').innerText = result.detail;
+    let message = result.detail;
+    if (response.ok) {
+        message += ` (${result.imported}/${result.total_rows}, errors: ${result.error_count})`;
+        if (result.errors && result.errors.length) {
+            message += '\n' + result.errors.slice(0, 20).map(e => `Row ${e.row}: ${e.errors.join(', ')}`).join('\n');
+        }
+    }
+    document.getElementById('import-result').innerText = message;
 });
 
 document.getElementById('update-form').addEventListener('submit', async function(event) {
@@ -364,7 +379,7 @@ async function searchCompanyName(keyword) {
         return;
     }
 
-    const response = await fetch(`${backendUrl}/search_all_company_names/?keyword=${keyword}`);
+    const response = await fetch(`${backendUrl}/search_all_company_names/?keyword=${encodeURIComponent(keyword)}`);
     const result = await response.json();
     const companyNameList = document.getElementById('company_name_list');
     companyNameList.innerHTML = '';
@@ -386,7 +401,7 @@ async function searchBranchName(keyword) {
         return;
     }
 
-    const response = await fetch(`${backendUrl}/search_all_branch_names/?keyword=${keyword}`);
+    const response = await fetch(`${backendUrl}/search_all_branch_names/?keyword=${encodeURIComponent(keyword)}`);
     const result = await response.json();
     const branchNameList = document.getElementById('branch_name_list');
     branchNameList.innerHTML = '';
@@ -416,7 +431,7 @@ async function searchAllCompanyNames(keyword) {
         return;
     }
 
-    const response = await fetch(`${backendUrl}/search_all_company_names/?keyword=${keyword}`);
+    const response = await fetch(`${backendUrl}/search_all_company_names/?keyword=${encodeURIComponent(keyword)}`);
     const result = await response.json();
     const companyNameList = document.getElementById('query_company_name_list');
     companyNameList.innerHTML = '';
@@ -438,7 +453,7 @@ async function searchAllCustomerIDs(keyword) {
         return;
     }
 
-    const response = await fetch(`${backendUrl}/search_all_customer_ids/?keyword=${keyword}`);
+    const response = await fetch(`${backendUrl}/search_all_customer_ids/?keyword=${encodeURIComponent(keyword)}`);
     const result = await response.json();
     const customerIDList = document.getElementById('delete_customer_id_list');
     customerIDList.innerHTML = '';
@@ -0,0 +1,138 @@
+import itertools
+import random
+
+import pandas as pd
+import pytest
+
+from customer_id.compact import compact_frame
+from customer_id.customer_index import CustomerIndex, RECORD_COLUMNS
+
+REGIONS = ['1北投', '2台南']
+CATEGORIES = ['0連鎖或相關企業的合開發票', '1連鎖或相關企業的不合開發票', '2單一客戶']
+EXTRA_REGION_CODES = ['0無區分', '1本縣市', None]
+COMPANIES = ['A', 'B', 'C']
+BRANCH_NAMES = ['分行一', '分行二', None]
+BRANCH_HANDLINGS = ['以流水號編列此分行', '00開立發票客編', None]
+# 資料中沒有的值：查詢時不能匹配任何列
+MISSING = {'Region': '3高雄', 'Category': '9其他', 'CompanyName': 'Z', 'ExtraRegionCode': '5外縣市'}
+
+
+def generate_frame(seed, rows=300):
+    rng = random.Random(seed)
+    used = set()
+    entries = []
+    while len(entries) < rows:
+        category = rng.choice(CATEGORIES)
+        chain = category != '2單一客戶'
+        customer_id = (f"{rng.randint(1, 3)}{category[0]}{rng.randint(0, 30):03d}{rng.randint(0, 9)}{rng.randint(0, 12):02d}" if chain
+                       else f"{rng.randint(1, 3)}{category[0]}{rng.randint(0, 400):06d}")
+        if customer_id in used:
+            continue
+        used.add(customer_id)
+        entries.append({
+            'Region': rng.choice(REGIONS),
+            'Category': category,
+            'CompanyName': rng.choice(COMPANIES),
+            'ExtraRegionCode': rng.choice(EXTRA_REGION_CODES),
+            'BranchName': rng.choice(BRANCH_NAMES) if chain else None,
+            'BranchHandling': rng.choice(BRANCH_HANDLINGS) if chain else None,
+            'CustomerID': customer_id,
+        })
+    return pd.DataFrame(entries)
+
+
+# 以下為改用索引前以遮罩掃描整個 DataFrame 的查詢，作為比對的基準
+
+def mask_find_customer_id(data, record):
+    mask = pd.Series(True, index=data.index)
+    for column, value in zip(RECORD_COLUMNS, record):
+        mask &= data[column] == value
+    matches = data[mask]
+    return matches['CustomerID'].iloc[0] if not matches.empty else None
+
+
+def mask_company(data, region, category, company_name, extra_region_code):
+    return data[
+        (data['Region'] == region) &
+        (data['Category'] == category) &
+        (data['CompanyName'] == company_name) &
+        (data['ExtraRegionCode'] == extra_region_code)
+    ]
+
+
+def mask_company_customer_id(data, region, category, company_name, extra_region_code):
+    matches = mask_company(data, region, category, company_name, extra_region_code)
+    return matches['CustomerID'].iloc[0] if not matches.empty else None
+
+
+def mask_max_company_serial(data, region, category, extra_region_code, length):
+    max_serial = data[
+        (data['Region'] == region) &
+        (data['Category'] == category) &
+        (data['ExtraRegionCode'] == extra_region_code)
+    ]['CustomerID'].str[2:2+length].astype(int).max()
+    return int(max_serial) if pd.notna(max_serial) else None
+
+
+def mask_max_branch_serial(data, region, category, company_name, extra_region_code):
+    matches = mask_company(data, region, category, company_name, extra_region_code)
+    max_serial = matches['CustomerID'].str[-2:].astype(int).max()
+    return int(max_serial) if pd.notna(max_serial) else None
+
+
+def with_missing(values, column):
+    return values + [MISSING[column]] if column in MISSING else values
+
+
+def assert_index_matches(index, data):
+    regions = with_missing(REGIONS, 'Region')
+    categories = with_missing(CATEGORIES, 'Category')
+    extra_region_codes = with_missing(EXTRA_REGION_CODES, 'ExtraRegionCode')
+    companies = with_missing(COMPANIES, 'CompanyName')
+
+    for record in itertools.product(regions, categories, companies, extra_region_codes, BRANCH_NAMES, BRANCH_HANDLINGS):
+        assert index.find_customer_id(record) == mask_find_customer_id(data, record), record
+    for region, category, company_name, extra_region_code in itertools.product(regions, categories, companies, extra_region_codes):
+        assert (index.company_customer_id(region, category, company_name, extra_region_code)
+                == mask_company_customer_id(data, region, category, company_name, extra_region_code))
+        assert (index.max_branch_serial(region, category, company_name, extra_region_code)
+                == mask_max_branch_serial(data, region, category, company_name, extra_region_code))
+    for region, category, extra_region_code, length in itertools.product(regions, categories, extra_region_codes, (3, 6)):
+        assert (index.max_company_serial(region, category, extra_region_code, length)
+                == mask_max_company_serial(data, region, category, extra_region_code, length))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('compact', [False, True], ids=['object', 'category'])
+def test_lookups_match_mask_scan(seed, compact):
+    data = generate_frame(seed)
+    if compact:
+        data = compact_frame(data)
+    index = CustomerIndex()
+    index.build(data)
+    assert_index_matches(index, data)
+
+
+def test_lookups_match_mask_scan_after_changes():
+    data = generate_frame(3)
+    index = CustomerIndex()
+    index.build(data)
+    rng = random.Random(3)
+
+    extra = generate_frame(4, rows=60)
+    extra = extra[~extra['CustomerID'].isin(data['CustomerID'])]
+    for entry in extra.to_dict('records'):
+        index.add([entry[column] for column in RECORD_COLUMNS], entry['CustomerID'])
+    data = pd.concat([data, extra], ignore_index=True)
+
+    removed = rng.sample(data['CustomerID'].tolist(), 50)
+    for customer_id in removed:
+        index.remove(customer_id)
+    data = data[~data['CustomerID'].isin(removed)]
+
+    for customer_id in rng.sample(data['CustomerID'].tolist(), 30):
+        company_name = rng.choice(COMPANIES)
+        index.update(customer_id, CompanyName=company_name)
+        data.loc[data['CustomerID'] == customer_id, 'CompanyName'] = company_name
+
+    assert_index_matches(index, data)